@@ -0,0 +1,122 @@
+import time
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# ------------------- Analysis worker pool -------------------
+# One pool is created at service startup and shared by every request. Threads are
+# used because rembg (onnxruntime), OpenCV and NumPy release the GIL for the heavy
+# work, and all workers can share the feature cache and loaded models.
+
+
+class ItemTimeout(Exception):
+    pass
+
+
+class AnalysisPool:
+    def __init__(self, max_workers, thread_name_prefix="analyze"):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._abandoned = set()  # timed-out futures whose thread is still running
+        self._submitted = set()  # unfinished futures of the current executor
+
+    def imap_unordered(self, fn, jobs, max_inflight=None, timeout=None):
+        """
+        Runs fn(*job) for every job with at most max_inflight of this caller's jobs
+        submitted at once. Yields (index, result, error) as items finish; an item
+        that runs for more than `timeout` seconds (time spent queued behind other
+        requests does not count) yields an ItemTimeout error and is abandoned.
+        """
+        max_inflight = max(1, max_inflight or self.max_workers)
+        job_iter = iter(enumerate(jobs))
+        pending = {}  # future -> index
+        queued = {}  # index -> job, until it finishes (resubmitted if its pool is replaced)
+        started = {}  # index -> monotonic time the job began running
+
+        def run(index, job):
+            started[index] = time.monotonic()
+            return fn(*job)
+
+        def submit_next():
+            try:
+                index, job = next(job_iter)
+            except StopIteration:
+                return False
+            queued[index] = job
+            submit(index)
+            return True
+
+        def submit(index):
+            # Run in a copy of the caller's context so per-request metrics follow the job
+            pending[self._submit(contextvars.copy_context().run, run, index, queued[index])] = index
+
+        while len(pending) < max_inflight and submit_next():
+            pass
+        while pending:
+            wait_for = None
+            if timeout:
+                deadlines = [started[i] + timeout for i in pending.values() if i in started]
+                wait_for = max(0.0, min(deadlines) - time.monotonic()) if deadlines else timeout
+                if len(deadlines) < len(pending):
+                    # A queued job may start meanwhile; look again within one timeout
+                    wait_for = min(wait_for, timeout)
+            done, _ = wait(list(pending), timeout=wait_for, return_when=FIRST_COMPLETED)
+            for fut in done:
+                index = pending.pop(fut)
+                if fut.cancelled():
+                    # Still queued when _abandon replaced the executor
+                    submit(index)
+                    continue
+                del queued[index]
+                try:
+                    yield index, fut.result(), None
+                except Exception as e:
+                    yield index, None, e
+            now = time.monotonic()
+            for fut, index in list(pending.items()):
+                if timeout and index in started and started[index] + timeout <= now:
+                    pending.pop(fut)
+                    del queued[index]
+                    self._abandon(fut)
+                    logging.warning(f"Analysis item {index} timed out after running {timeout}s")
+                    yield index, None, ItemTimeout(f"timed out after {timeout}s")
+            while len(pending) < max_inflight and submit_next():
+                pass
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            fut = self._executor.submit(fn, *args)
+            self._submitted.add(fut)
+        fut.add_done_callback(self._submitted.discard)
+        return fut
+
+    def _abandon(self, fut):
+        """
+        A running thread cannot be interrupted, so a timed-out job keeps its thread
+        until it returns. Once every thread is held that way, new jobs go to a fresh
+        executor instead of queueing behind them; jobs already queued on the old one
+        are cancelled, and their callers resubmit them. The old threads exit when done.
+        """
+        with self._lock:
+            self._abandoned.add(fut)
+            fut.add_done_callback(self._abandoned.discard)
+            if sum(not f.done() for f in self._abandoned) >= self.max_workers:
+                logging.error(f"All {self.max_workers} analysis threads are stuck on timed-out items; "
+                              f"starting a new pool")
+                submitted = list(self._submitted)
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                # cancel() alone does not wake callers blocked in wait(); nothing else
+                # will run these futures now that the old queue is drained
+                for f in submitted:
+                    if f.cancelled():
+                        f.set_running_or_notify_cancel()
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix=self.thread_name_prefix)
+                self._abandoned = set()
+                self._submitted = set()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -1,50 +1,197 @@
 import os
 import time
-import itertools
+STARTED_AT = time.time()
 import json
+import importlib.util
+import math
 import cv2
 import numpy as np
 import traceback
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS, cross_origin # 👈 Added cross_origin import for safety
-from sklearn.cluster import KMeans
 from werkzeug.utils import secure_filename
-from PIL import Image
-import shutil
 import logging
+from feature_cache import FeatureCache
+import color_engine
+import pattern_engine
+from image_pipeline import ImageFrame, as_frame
+from analysis_pool import AnalysisPool
+from outfit_scoring import SKIN_TONES, skin_tone_bonus, top_k_outfit_tables
+from outfit_search import OutfitSearch
+from bg_removal import BackgroundRemover
+from previews import PreviewStore
+from skin_tone import SkinToneDetector, DEFAULT_TONE
+from closet_index import ClosetStore
+from recommendations import ClosetRecommender
+from jobs import JobQueue, QueueFull
+from storage import UploadStore
+import metrics
+from startup import Startup
 
 # Set up basic logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Optional: background removal
-try:
-    from rembg import remove as rembg_remove
-    REMBG_AVAILABLE = True
-except ImportError:
-    REMBG_AVAILABLE = False
+# Optional: background removal (imported when its session is first loaded)
+REMBG_AVAILABLE = importlib.util.find_spec("rembg") is not None
+if not REMBG_AVAILABLE:
     logging.warning("rembg library not available. Background removal disabled.")
 
-# Optional: mediapipe for skin tone
-try:
-    import mediapipe as mp
-    MP_AVAILABLE = True
-except ImportError:
-    MP_AVAILABLE = False
+# Optional: mediapipe for skin tone (imported when the first FaceMesh is built)
+MP_AVAILABLE = importlib.util.find_spec("mediapipe") is not None
+if not MP_AVAILABLE:
     logging.warning("mediapipe library not available. Skin tone detection will use fallback.")
 
 # ------------------- Config -------------------
+# Set by gunicorn.conf.py: this module is imported once in the master and its
+# models are shared copy-on-write by the forked workers; per-process resources
+# are set up by init_worker() after the fork.
+PRELOAD = os.environ.get("SMARTFIT_PRELOAD") == "1"
+
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Served artifacts nobody used for the TTL are deleted, and the least recently used
+# ones once the folder exceeds its quota (files referenced by closets are kept)
+UPLOAD_TTL_SEC = int(float(os.environ.get("UPLOAD_TTL_HOURS", 24 * 7)) * 3600)
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_MB", 2048)) * 1024 * 1024
+UPLOAD_REAP_INTERVAL_SEC = int(os.environ.get("UPLOAD_REAP_INTERVAL_SEC", 600))
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg"}
 MAX_FILES_PER_CATEGORY = 5
-MAX_COMBOS = 200  # cap combos generation
+MAX_OUTFIT_EVALUATIONS = 20000  # budget for the branch-and-bound outfit search
 COMBINED_PREVIEW_MAX_HEIGHT = 300
 
+# Feature cache (kept outside UPLOAD_FOLDER so it is never served via /uploads)
+CACHE_FOLDER = "cache"
+FEATURE_CACHE_PATH = os.path.join(CACHE_FOLDER, "features.sqlite3")
+FEATURE_CACHE_MAX_ENTRIES = 5000
+FEATURE_CACHE_MMAP_MB = int(os.environ.get("FEATURE_CACHE_MMAP_MB", 256))
+# Bump whenever an extractor changes so stale cached features are not reused
+ANALYSIS_VERSION = "5"
+# Uploads are normalized to this long edge while decoding, before any analysis
+ANALYZE_MAX_EDGE = int(os.environ.get("ANALYZE_MAX_EDGE", 512))
+
+# Combined previews are rendered on first fetch and kept in a bounded LRU cache
+PREVIEW_FOLDER = os.path.join(CACHE_FOLDER, "previews")
+PREVIEW_FORMAT = os.environ.get("PREVIEW_FORMAT", "png")  # png | webp | jpg
+PREVIEW_QUALITY = int(os.environ.get("PREVIEW_QUALITY", 85))  # webp/jpg only
+PREVIEW_CACHE_MAX_BYTES = int(os.environ.get("PREVIEW_CACHE_MAX_MB", 256)) * 1024 * 1024
+# Registered previews (manifests) expire when not fetched or re-registered for this long
+PREVIEW_MANIFEST_TTL_SEC = int(float(os.environ.get("PREVIEW_MANIFEST_TTL_HOURS", 24 * 7)) * 3600)
+
+# Closet indexes built by /closets/<id>/ingest and read by /suggest_outfit
+CLOSET_FOLDER = os.path.join(CACHE_FOLDER, "closets")
+# Server-side directory JSON ingest requests may read from; unset disables local ingestion
+CLOSET_IMPORT_ROOT = os.environ.get("CLOSET_IMPORT_ROOT")
+CLOSET_MAX_ITEMS_PER_INGEST = 1000
+# Closet indexes kept loaded per worker (least recently used ones are dropped)
+CLOSET_CACHE_ENTRIES = int(os.environ.get("CLOSET_CACHE_ENTRIES", 256))
+# Largest number of item combinations one /suggest_outfit call scores for a closet
+SUGGEST_MAX_COMBINATIONS = 2_000_000
+# Ranked outfits kept per closet/skin tone/occasion so closet edits only rescore what changed
+SUGGEST_TOPK_DEPTH = int(os.environ.get("SUGGEST_TOPK_DEPTH", 200))
+# Ranked outfit buffers kept in memory per worker; older ones are reloaded from disk
+SUGGEST_BUFFER_ENTRIES = int(os.environ.get("SUGGEST_BUFFER_ENTRIES", 1024))
+# Most (skin tone, occasion) tables one multi-occasion /suggest_outfit call may request
+SUGGEST_MAX_TABLES = 100
+
+# Per-item analysis pool (shared by all requests)
+ANALYZE_WORKERS = int(os.environ.get("ANALYZE_WORKERS", os.cpu_count() or 4))
+ANALYZE_MAX_INFLIGHT_PER_REQUEST = int(os.environ.get("ANALYZE_MAX_INFLIGHT_PER_REQUEST", 4))
+ANALYZE_ITEM_TIMEOUT_SEC = float(os.environ.get("ANALYZE_ITEM_TIMEOUT_SEC", 30))
+
+# Async /analyze jobs: bounded in-process queue, status/results shared via small files
+JOB_FOLDER = os.path.join(CACHE_FOLDER, "jobs")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_QUEUE_MAX_DEPTH = int(os.environ.get("JOB_QUEUE_MAX_DEPTH", 32))
+JOB_RESULT_TTL_SEC = int(os.environ.get("JOB_RESULT_TTL_SEC", 600))
+
+# Instrumentation: opt-in sampling profile of requests slower than this (0 = off)
+PROFILE_SLOW_REQUESTS_SEC = float(os.environ.get("PROFILE_SLOW_REQUESTS_SEC", 0))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", 10))
+PROFILE_FOLDER = os.path.join(CACHE_FOLDER, "profiles")
+
+# Background removal: one rembg session per worker process, loaded by the warm-up.
+# u2net is the CPU-friendly default; u2netp/silueta trade quality for speed.
+REMBG_MODEL = os.environ.get("REMBG_MODEL", "u2net")
+# Cached features also depend on these settings, so changing either one recomputes them
+FEATURE_VERSION = f"{ANALYSIS_VERSION}/{ANALYZE_MAX_EDGE}/{REMBG_MODEL}"
+# A batch can only fill up with items analyzed concurrently, so it is capped by the pool size
+REMBG_BATCH_SIZE = int(os.environ.get("REMBG_BATCH_SIZE", min(4, ANALYZE_WORKERS)))
+REMBG_BATCH_WAIT_MS = float(os.environ.get("REMBG_BATCH_WAIT_MS", 15))
+REMBG_WARMUP = os.environ.get("REMBG_WARMUP", "1") == "1"
+# 1 = no onnxruntime thread pool, which is what makes a session loaded before fork
+# usable in the workers (parallelism then comes from processes and analysis threads)
+REMBG_INTRA_OP_THREADS = int(os.environ.get("REMBG_INTRA_OP_THREADS", 1 if PRELOAD else 0))
+# Threads feeding batches to the session. One is enough when onnxruntime spreads an
+# inference over every core; with a single intra-op thread, one dispatcher would run
+# the worker's masks one batch at a time, so inferences are overlapped instead
+REMBG_DISPATCHERS = int(os.environ.get(
+    "REMBG_DISPATCHERS", min(ANALYZE_WORKERS, os.cpu_count() or 1) if REMBG_INTRA_OP_THREADS == 1 else 1))
+
+# Skin tone: pool of FaceMesh detectors per worker, landmarking on a downscaled photo
+SKIN_DETECTOR_POOL_SIZE = int(os.environ.get("SKIN_DETECTOR_POOL_SIZE", min(4, os.cpu_count() or 4)))
+SKIN_MAX_EDGE = int(os.environ.get("SKIN_MAX_EDGE", 640))
+SKIN_CACHE_ENTRIES = 1024
+
 # Flask setup
 app = Flask(__name__)
 # 🌟 CORS FIX: Explicitly allow all origins in development to fix 403 errors
 CORS(app, resources={r"/*": {"origins": "*"}}) 
 
+feature_cache = FeatureCache(FEATURE_CACHE_PATH, max_entries=FEATURE_CACHE_MAX_ENTRIES, version=FEATURE_VERSION,
+                             mmap_bytes=FEATURE_CACHE_MMAP_MB * 1024 * 1024)
+analysis_pool = AnalysisPool(max_workers=ANALYZE_WORKERS)
+closet_store = ClosetStore(CLOSET_FOLDER, analysis_version=ANALYSIS_VERSION, cache_size=CLOSET_CACHE_ENTRIES)
+upload_store = UploadStore(UPLOAD_FOLDER, ttl_sec=UPLOAD_TTL_SEC, max_bytes=UPLOAD_MAX_BYTES,
+                           interval_sec=UPLOAD_REAP_INTERVAL_SEC)
+upload_store.add_reference_files(closet_store.meta_paths, closet_store.image_names)
+job_queue = JobQueue(JOB_FOLDER, workers=JOB_WORKERS, max_depth=JOB_QUEUE_MAX_DEPTH, result_ttl=JOB_RESULT_TTL_SEC)
+metrics.profiler.configure(PROFILE_SLOW_REQUESTS_SEC, PROFILE_INTERVAL_MS, PROFILE_FOLDER)
+bg_remover = BackgroundRemover(model_name=REMBG_MODEL, batch_size=REMBG_BATCH_SIZE, batch_wait_ms=REMBG_BATCH_WAIT_MS,
+                               intra_op_threads=REMBG_INTRA_OP_THREADS, dispatchers=REMBG_DISPATCHERS)
+def import_mediapipe():
+    import mediapipe
+    return mediapipe
+
+
+def build_face_mesh():
+    return import_mediapipe().solutions.face_mesh.FaceMesh(static_image_mode=True)
+
+
+skin_detector = SkinToneDetector(
+    build_face_mesh,
+    pool_size=SKIN_DETECTOR_POOL_SIZE, max_edge=SKIN_MAX_EDGE, cache_size=SKIN_CACHE_ENTRIES,
+) if MP_AVAILABLE else None
+preview_store = PreviewStore(PREVIEW_FOLDER, height=COMBINED_PREVIEW_MAX_HEIGHT, default_format=PREVIEW_FORMAT,
+                             quality=PREVIEW_QUALITY, max_bytes=PREVIEW_CACHE_MAX_BYTES,
+                             manifest_ttl=PREVIEW_MANIFEST_TTL_SEC)
+# Preview manifests re-render from item files; keep those until the manifest expires
+upload_store.add_reference_files(preview_store.manifest_paths,
+                                 lambda path: [os.path.basename(p) for p in preview_store.manifest_items(path)])
+
+# Models warm up after the module is imported; the service answers /healthz at once
+startup = Startup(started_at=STARTED_AT)
+startup.record("imports", time.time() - STARTED_AT)
+if REMBG_AVAILABLE and REMBG_WARMUP:
+    startup.add("rembg", bg_remover.warm_up, shared=True)
+if skin_detector is not None:
+    startup.add("mediapipe", import_mediapipe, shared=True)
+    # FaceMesh graphs run their own threads, so each worker builds its detectors itself
+    startup.add("face_mesh", skin_detector.warm_up)
+if PRELOAD:
+    # Loaded before fork so every worker shares the pages
+    startup.run_shared()
+
+
+def init_worker():
+    """Per-process setup: warms this worker's remaining models and starts the upload reaper in the background."""
+    startup.start()
+    upload_store.start()
+    logging.info(f"Worker {os.getpid()} serving after {time.time() - STARTED_AT:.2f}s")
+
+
+if not PRELOAD:
+    init_worker()
+
 # ------------------- Helpers -------------------
 
 # ... (All helper functions: allowed_file, check_image_quality, get_dominant_colors, 
@@ -55,11 +202,14 @@ CORS(app, resources={r"/*": {"origins": "*"}})
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def check_image_quality(image_path, brightness_threshold=50, blur_threshold=100):
-    img = cv2.imread(image_path)
-    if img is None:
+# Thresholds are calibrated for frames normalized to ANALYZE_MAX_EDGE: Laplacian
+# variance depends on resolution (sensor noise alone reaches ~50 at 12MP), while
+# at 512px sharp photos sit around 90 and visibly blurred ones below 10
+def check_image_quality(image, brightness_threshold=50, blur_threshold=25):
+    frame = as_frame(image)
+    if frame is None:
         return ["Cannot read image"]
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    gray = frame.gray
     brightness = float(np.mean(gray))
     blur_value = float(np.var(cv2.Laplacian(gray, cv2.CV_64F)))
     warnings = []
@@ -69,38 +219,31 @@ def check_image_quality(image_path, brightness_threshold=50, blur_threshold=100)
         warnings.append("Image too blurry")
     return warnings
 
-def get_dominant_colors(image_path, k=3):
-    image = cv2.imread(image_path)
-    if image is None:
+def get_dominant_colors(image, k=3):
+    frame = as_frame(image)
+    if frame is None:
         return []
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    h, w, _ = image.shape
-    # sample to ~200x200 for speed
-    sample_size = 200 * 200
-    pixels = image.reshape(-1, 3)
-    if pixels.shape[0] > sample_size:
-        idx = np.linspace(0, pixels.shape[0]-1, sample_size).astype(int)
-        sample = pixels[idx]
-    else:
-        sample = pixels
-    n_clusters = min(k, len(sample))
-    if n_clusters <= 0:
-        return []
-    kmeans = KMeans(n_clusters=n_clusters, n_init=10, random_state=0)
-    kmeans.fit(sample)
-    colors = kmeans.cluster_centers_.astype(int)
-    labels, counts = np.unique(kmeans.labels_, return_counts=True)
-    order = np.argsort(-counts)
-    ordered_colors = [tuple(int(c) for c in colors[idx]) for idx in order]
-    return ordered_colors
-
-def detect_pattern(image_path):
-    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    if image is None:
+    return color_engine.dominant_colors(frame.rgba, k=k)
+
+def get_dominant_colors_batch(images, k=3):
+    frames = [as_frame(img) for img in images]
+    return color_engine.dominant_colors_batch([f.rgba if f is not None else None for f in frames], k=k)
+
+def analyze_pattern(image):
+    """{"label": solid/striped/checked/printed/unknown, "confidence"} for the garment region."""
+    frame = as_frame(image)
+    if frame is None:
+        return {"label": "unknown", "confidence": 0.0}
+    return pattern_engine.analyze(frame.rgb, frame.alpha)
+
+def pattern_label(detail):
+    # Outfit scoring only distinguishes solid from patterned garments
+    if detail["label"] == "unknown":
         return "Unknown"
-    edges = cv2.Canny(image, 50, 150)
-    lines = cv2.HoughLines(edges, 1, np.pi / 180, 120)
-    return "Patterned" if lines is not None else "Solid"
+    return "Solid" if detail["label"] == "solid" else "Patterned"
+
+def detect_pattern(image):
+    return pattern_label(analyze_pattern(image))
 
 def detect_style_from_filename(filename):
     fname = filename.lower()
@@ -122,99 +265,38 @@ def simple_color_name(rgb):
     if r < 50 and g < 50 and b < 50: return "Black"
     return "#{:02x}{:02x}{:02x}".format(int(r), int(g), int(b))
 
-def remove_bg(image_path):
+def remove_bg(frame):
+    """
+    Returns the frame with a background alpha mask attached (or unchanged when
+    rembg is not installed), or None if background removal failed.
+    """
     try:
-        base, ext = os.path.splitext(image_path)
-        out_path = f"{base}_nobg{ext}"
         if REMBG_AVAILABLE:
-            with open(image_path, "rb") as i:
-                input_bytes = i.read()
-            output_bytes = rembg_remove(input_bytes)
-            with open(out_path, "wb") as o:
-                o.write(output_bytes)
-            return out_path
+            # The shared session returns the alpha mask directly: no PNG round-trip
+            return frame.with_alpha(bg_remover.mask(frame.rgb))
         else:
-            # fallback: copy and return same image (no bg removal)
-            shutil.copy(image_path, out_path)
-            return out_path
+            # fallback: no bg removal
+            return frame
     except Exception as e:
         logging.error(f"remove_bg error: {e}")
-        return image_path
-
-# Mediapipe face detection
-mp_face_mesh = mp.solutions.face_mesh.FaceMesh(static_image_mode=True) if MP_AVAILABLE else None
-
-def detect_skin_tone_mediapipe(face_image_path):
-    if not MP_AVAILABLE or mp_face_mesh is None:
-        return "Medium / Olive"
-    img = cv2.imread(face_image_path)
-    if img is None:
-        return "Medium / Olive"
-    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    results = mp_face_mesh.process(img_rgb)
-    if not results.multi_face_landmarks:
-        return "Medium / Olive"
-    h, w, _ = img.shape
-    mask = np.zeros((h, w), dtype=np.uint8)
-    for face_landmarks in results.multi_face_landmarks:
-        # A proper implementation would use a subset of landmarks for skin area (e.g., cheeks/forehead)
-        # But for this simple mask, we use the whole detected face mesh area
-        pts = [[int(lm.x * w), int(lm.y * h)] for lm in face_landmarks.landmark]
-        pts = np.array(pts, dtype=np.int32)
-        if pts.size > 0:
-            cv2.fillConvexPoly(mask, pts, 255)
-    skin_pixels = img_rgb[mask == 255]
-    if len(skin_pixels) == 0:
-        return "Medium / Olive"
-    
-    # Calculate average color in the masked skin area
-    avg_color = np.mean(skin_pixels, axis=0)
-    brightness = float(np.mean(avg_color))
-    
-    # Simple classification based on brightness
-    if brightness > 210: return "Very Light / Porcelain"
-    elif 180 < brightness <= 210: return "Light / Fair"
-    elif 150 < brightness <= 180: return "Medium / Olive"
-    elif 120 < brightness <= 150: return "Tan / Caramel / Light Brown"
-    elif 90 < brightness <= 120: return "Brown / Warm Brown"
-    elif 60 < brightness <= 90: return "Dark Brown / Deep"
-    else: return "Very Dark / Ebony"
-
-def combine_clothing_images(image_paths):
-    if not image_paths:
         return None
-    images = []
-    for p in image_paths:
-        try:
-            # Check if the path is the no-background version and use it
-            if os.path.exists(p):
-                 images.append(Image.open(p).convert("RGBA"))
-        except Exception as e:
-            logging.error(f"Failed to open image {p} for combination: {e}")
-            continue
-    if not images:
+
+def detect_skin_tone_mediapipe(face_image):
+    """Accepts encoded image bytes, a file path or an ImageFrame."""
+    if skin_detector is None:
+        return DEFAULT_TONE
+    if isinstance(face_image, (bytes, bytearray)):
+        return skin_detector.detect_bytes(bytes(face_image))
+    return skin_detector.detect(as_frame(face_image))
+
+def combine_clothing_images(image_paths, fmt=None, quality=None):
+    """
+    Registers a side-by-side preview of the given (no-bg) images and returns its
+    filename. The image itself is rendered lazily when /uploads/<filename> is fetched.
+    """
+    if not image_paths:
         return None
-        
-    # Resize images proportionally
-    max_height = COMBINED_PREVIEW_MAX_HEIGHT
-    resized_images = []
-    for img in images:
-        h_percent = max_height / float(img.size[1])
-        wsize = int(img.size[0] * h_percent)
-        # Use Image.Resampling.LANCZOS for newer PIL versions
-        resized_images.append(img.resize((wsize, max_height), Image.Resampling.LANCZOS if hasattr(Image, 'Resampling') else Image.LANCZOS))
-    
-    total_width = sum(img.size[0] for img in resized_images)
-    combined = Image.new("RGBA", (total_width, max_height), (255,255,255,0))
-    x_offset = 0
-    for img in resized_images:
-        combined.paste(img, (x_offset,0), mask=img)
-        x_offset += img.size[0]
-        
-    combined_filename = f"combined_{int(time.time())}.png"
-    combined_path = os.path.join(UPLOAD_FOLDER, combined_filename)
-    combined.save(combined_path)
-    return combined_filename
+    return preview_store.register(image_paths, fmt=fmt, quality=quality)
 
 def suggest_colors_for_skin(skin_tone):
     palettes = {
@@ -241,6 +323,9 @@ OCCASION_MULTIPLIERS = {
     'Gym': {'Sporty': 1.3, 'Casual': 0.8, 'Formal': 0.5, 'Party/Festive': 0.5},
 }
 
+closet_recommender = ClosetRecommender(OCCASION_MULTIPLIERS, depth=SUGGEST_TOPK_DEPTH, analysis_version=ANALYSIS_VERSION,
+                                       max_buffers=SUGGEST_BUFFER_ENTRIES)
+
 def score_outfit(items, skin_tone, occasion):
     base_score = 50
     styles = [item.get('style','Casual') for item in items]
@@ -258,170 +343,389 @@ def score_outfit(items, skin_tone, occasion):
     else:
         base_score += 3
         
-    # skin-tone approximate boost based on first item color
-    if items and items[0].get('dominant_colors'):
-        # Only use the first, most dominant color
-        r,g,b = items[0]['dominant_colors'][0]
-        total = r+g+b
-        if skin_tone in ["Very Light / Porcelain", "Light / Fair"] and total > 400:
-            base_score += 5
-        elif skin_tone in ["Medium / Olive", "Tan / Caramel / Light Brown"] and 150 < total < 400:
-            base_score += 4
-        elif skin_tone in ["Brown / Warm Brown", "Dark Brown / Deep", "Very Dark / Ebony"] and total < 300:
-            base_score += 4
+    # skin-tone approximate boost based on first item color (most dominant color only)
+    if items:
+        base_score += skin_tone_bonus(items[0], skin_tone)
             
-    dominant_style = max(set(styles), key=styles.count) if styles else 'Casual'
+    # Ties go to the style that appears first, so scores do not depend on set ordering
+    dominant_style = max(styles, key=styles.count) if styles else 'Casual'
     multiplier = OCCASION_MULTIPLIERS.get(occasion, {}).get(dominant_style, 1.0)
     final_score = base_score * multiplier
     final_score = max(0, min(100, final_score))
     
-    feedback = f"Great match for {occasion}." if final_score > 85 else (f"Good for {occasion}." if final_score > 70 else f"Maybe not ideal for {occasion}.")
-    return int(final_score), feedback
+    return int(final_score), outfit_feedback(final_score, occasion)
+
+def outfit_feedback(final_score, occasion):
+    return f"Great match for {occasion}." if final_score > 85 else (f"Good for {occasion}." if final_score > 70 else f"Maybe not ideal for {occasion}.")
+
+def get_cached_item_features(cache_key):
+    """
+    Returns the cached full feature record for an upload, or None when the
+    entry is missing, partial (colors only) or its no-bg artifact is gone.
+    """
+    record = feature_cache.get(cache_key)
+    if not record or any(k not in record for k in ("nobg_path", "dominant_colors", "pattern", "pattern_detail", "warnings")):
+        return None
+    if not os.path.exists(record["nobg_path"]):
+        return None
+    # Reusing the artifact counts as a use for the upload reaper
+    upload_store.touch(record["nobg_path"])
+    return record
+
+def analyze_clothing_item(data, fname):
+    """
+    Runs the per-item pipeline on raw upload bytes. The upload is decoded once and
+    only the no-bg artifact (served via /uploads) is written to disk.
+    """
+    with metrics.stage("feature_cache_lookup"):
+        cache_key = feature_cache.key_for(data)
+        features = get_cached_item_features(cache_key)
+    if features is not None:
+        metrics.event("feature_cache_hit")
+        return features
+    metrics.event("feature_cache_miss")
+
+    with metrics.stage("decode"):
+        frame = ImageFrame.from_bytes(data, ANALYZE_MAX_EDGE)
+    if frame is None:
+        metrics.event("decode_failed")
+        return {"nobg_path": None, "dominant_colors": [], "pattern": "Unknown",
+                "pattern_detail": {"label": "unknown", "confidence": 0.0}, "warnings": ["Cannot read image"]}
+    h, w = frame.source_shape
+    metrics.observe("image_megapixels", h * w / 1e6)
+
+    with metrics.stage("remove_bg"):
+        nobg = remove_bg(frame)
+    bg_removal_failed = nobg is None
+    if bg_removal_failed:
+        metrics.event("remove_bg_failed")
+        nobg = frame
+
+    nobg_path = upload_store.path_for(f"{os.path.splitext(fname)[0]}_nobg.png")
+    with metrics.stage("save_nobg"):
+        nobg.save_png(nobg_path)
+    with metrics.stage("dominant_colors"):
+        dominant_colors = get_dominant_colors(nobg, k=3)
+    with metrics.stage("detect_pattern"):
+        pattern_detail = analyze_pattern(nobg)
+    with metrics.stage("quality_check"):
+        warnings = check_image_quality(nobg)
+    features = {
+        "nobg_path": nobg_path,
+        "dominant_colors": dominant_colors,
+        "pattern": pattern_label(pattern_detail),
+        "pattern_detail": pattern_detail,
+        "warnings": warnings
+    }
+    # The no-background file is kept: the cache entry points at it
+    if not bg_removal_failed:
+        feature_cache.put(cache_key, features)
+    return features
 
 # ------------------- API Endpoints -------------------
 @app.route("/detect_skin", methods=["POST"])
+@metrics.instrumented("detect_skin")
 def detect_skin():
     face_file = request.files.get("file_face")
     if face_file and allowed_file(face_file.filename):
-        filename = secure_filename(face_file.filename)
-        path = os.path.join(UPLOAD_FOLDER, filename)
-        face_file.save(path)
-        skin_tone = detect_skin_tone_mediapipe(path)
-        # Optional: delete the file after analysis
-        os.remove(path)
+        with metrics.stage("skin_tone"):
+            skin_tone = detect_skin_tone_mediapipe(face_file.read())
         return jsonify({"skin_tone": skin_tone})
     return jsonify({"skin_tone": "Medium / Olive"})
 
+# Categories list is inclusive of common item types
+CLOTHING_CATEGORIES = ["shirt","pants","shoes","top","bottom","outerwear","dress","skirt"]
+
+def read_analyze_request():
+    """
+    Reads an /analyze multipart request into plain data (bytes + options) so the
+    analysis itself can run without the request context.
+    """
+    face_file = request.files.get("file_face")
+    face_bytes = face_file.read() if face_file and allowed_file(face_file.filename) else None
+
+    jobs = [] # (category, filename, bytes) in deterministic category order
+    for cat in CLOTHING_CATEGORIES:
+        files = request.files.getlist(f"file_{cat}")
+        for f in files[:MAX_FILES_PER_CATEGORY]:
+            if f and allowed_file(f.filename):
+                # Use a unique name for the saved file
+                fname_safe = secure_filename(f.filename)
+                fname = f"{cat}_{int(time.time()*1000)}_{fname_safe}" 
+                jobs.append((cat, fname, f.read()))
+
+    max_evaluations = request.form.get("max_evaluations", MAX_OUTFIT_EVALUATIONS, type=int)
+    if max_evaluations < 1:
+        raise ValueError("max_evaluations must be at least 1")
+
+    return {
+        "face": face_bytes,
+        "occasion": request.form.get("occasion", "Casual Outing"),
+        "max_evaluations": min(max_evaluations, MAX_OUTFIT_EVALUATIONS),
+        "jobs": jobs,
+        "preview_format": request.form.get("preview_format", PREVIEW_FORMAT).lower().replace("jpeg", "jpg"),
+        "preview_quality": request.form.get("preview_quality", PREVIEW_QUALITY, type=int),
+        "include_timings": wants_timings(),
+    }
+
+def wants_timings():
+    value = request.values.get("include_timings") or (request.get_json(silent=True) or {}).get("include_timings")
+    return str(value).lower() in ("1", "true", "yes")
+
+def analysis_events(spec, result):
+    """
+    Runs the /analyze pipeline for a spec from read_analyze_request. Yields progress
+    events as each stage finishes and fills `result` with the full response body
+    (plus a per-stage "timings" breakdown when spec["include_timings"] is set).
+    """
+    with metrics.request_scope("analyze") as scope:
+        for event in analysis_steps(spec, result):
+            if event["type"] == "done" and spec.get("include_timings"):
+                result["timings"] = event["timings"] = scope.breakdown()
+            yield event
+
+def analysis_steps(spec, result):
+    start_time = time.time()
+    skin_tone = "Medium / Olive"
+    
+    if spec["face"]:
+        # The face photo is never served, so it is analyzed in memory only
+        with metrics.stage("skin_tone"):
+            skin_tone = detect_skin_tone_mediapipe(spec["face"])
+    recommended_colors = suggest_colors_for_skin(skin_tone)
+    yield {"type": "skin_tone", "skin_tone": skin_tone, "recommended_colors": recommended_colors}
+
+    occasion = spec["occasion"]
+    jobs = spec["jobs"]
+    clothing_data = {cat: [] for cat in CLOTHING_CATEGORIES}
+    uploaded_items = {} # Filename -> nobg_filepath
+    metrics.observe("items_per_request", len(jobs))
+
+    # Items are analyzed in parallel and reported as soon as each one finishes
+    items = [None] * len(jobs)
+    failures = [None] * len(jobs)
+    for index, features, error in analysis_pool.imap_unordered(
+        analyze_clothing_item,
+        [(data, fname) for _, fname, data in jobs],
+        max_inflight=ANALYZE_MAX_INFLIGHT_PER_REQUEST,
+        timeout=ANALYZE_ITEM_TIMEOUT_SEC,
+    ):
+        cat, fname, _ = jobs[index]
+        if error is not None:
+            logging.error(f"Analysis failed for {fname}: {error}")
+            failures[index] = {"category": cat, "filename": fname, "error": str(error)}
+            yield {"type": "item_failed", "index": index, **failures[index]}
+            continue
+        dominant = features["dominant_colors"]
+        items[index] = {
+            "filename": fname,
+            "dominant_colors": dominant,
+            "dominant_color_name": simple_color_name(dominant[0]) if dominant else "unknown",
+            "pattern": features["pattern"],
+            "pattern_detail": features["pattern_detail"],
+            "style": detect_style_from_filename(fname),
+            "warnings": features["warnings"]
+        }
+        if features["nobg_path"]:
+            uploaded_items[fname] = features["nobg_path"]
+        yield {"type": "item", "index": index, "category": cat, "item": items[index]}
+
+    # Reassemble in upload order regardless of completion order
+    failed_items = [f for f in failures if f is not None]
+    for (cat, _, _), item in zip(jobs, items):
+        if item is not None:
+            clothing_data[cat].append(item)
+    uploaded_items = {fname: uploaded_items[fname] for _, fname, _ in jobs if fname in uploaded_items}
+
+    # --- Outfit Recommendation Generation ---
+    recommended_outfits = []
+    available_lists = [clothing_data[c] for c in CLOTHING_CATEGORIES if clothing_data[c]]
+    
+    search_stats = None
+    
+    if len(available_lists) >= 2:
+        # Best 10 outfits over the full category product, pruned with score upper bounds
+        search = OutfitSearch(
+            available_lists,
+            lambda combo: score_outfit(combo, skin_tone, occasion)[0],
+            skin_tone, occasion, OCCASION_MULTIPLIERS,
+        )
+        with metrics.stage("outfit_search"):
+            top, search_stats = search.run(k=10, max_evaluations=spec["max_evaluations"])
+        for combo_idx, score in top:
+            combo = [available_lists[d][i] for d, i in enumerate(combo_idx)]
+            _, feedback = score_outfit(combo, skin_tone, occasion)
+            recommended_outfits.append({
+                "items": [c["filename"] for c in combo],
+                "score": score,
+                "feedback": feedback
+            })
+    yield {"type": "outfits", "recommended_outfits": recommended_outfits, "search_stats": search_stats}
+
+    # Combined preview of the no-bg versions, named after the item set and rendered on first fetch
+    with metrics.stage("preview_register"):
+        combined_preview = combine_clothing_images(list(uploaded_items.values()),
+                                                   fmt=spec["preview_format"], quality=spec["preview_quality"])
+    yield {"type": "preview", "combined_preview": combined_preview}
+
+    accessories = ["Belt", "Watch", "Handbag", "Shoes Matching Color"]
+    elapsed = time.time() - start_time
+    
+    result.update({
+        "success": True,
+        "timing_sec": elapsed,
+        "skin_tone": skin_tone,
+        "clothing_items": clothing_data,
+        "recommended_outfits": recommended_outfits,
+        "recommended_accessories": accessories,
+        "recommended_colors": recommended_colors,
+        "combined_preview": combined_preview,
+        "failed_items": failed_items,
+        "search_stats": search_stats
+    })
+    yield {"type": "done", "success": True, "timing_sec": elapsed, "recommended_accessories": accessories, "failed_items": failed_items}
+
+def stream_analysis(spec):
+    """NDJSON body: one JSON event per line, flushed as each stage completes."""
+    try:
+        for event in analysis_events(spec, {}):
+            yield json.dumps(event) + "\n"
+    except Exception as e:
+        logging.error(f"❌ /analyze stream error: {traceback.format_exc()}")
+        yield json.dumps({"type": "error", "success": False, "error": str(e)}) + "\n"
+
+def run_analysis_job(job, spec):
+    """Job-queue entry point: runs the pipeline, publishing progress as it goes."""
+    result = {}
+    items_done = 0
+    for event in analysis_events(spec, result):
+        if event["type"] in ("item", "item_failed"):
+            items_done += 1
+        job.update(stage=event["type"], items_done=items_done, items_total=len(spec["jobs"]))
+    return result
+
+def wants_async():
+    if request.form.get("async", "").lower() in ("1", "true", "yes"):
+        return True
+    return "respond-async" in request.headers.get("Prefer", "")
+
+def wants_stream():
+    if request.form.get("stream", "").lower() in ("1", "true", "yes"):
+        return True
+    return request.accept_mimetypes.best == "application/x-ndjson"
+
 @app.route("/analyze", methods=["POST"])
 def analyze():
     """
     Accepts uploaded face (optional) and many clothing files named file_<category>.
-    Returns clothing metadata and recommendations.
+    Returns clothing metadata and recommendations. With stream=1 (or
+    Accept: application/x-ndjson) the response is newline-delimited JSON events:
+    skin_tone, item/item_failed per garment as it finishes, outfits, preview, done.
+    With async=1 (or Prefer: respond-async) the work is queued and 202 + job_id is
+    returned; poll /jobs/<job_id> and fetch /jobs/<job_id>/result.
     """
-    temp_files = [] # To ensure we clean up all files regardless of success/fail
     try:
-        start_time = time.time()
-        face_file = request.files.get("file_face")
-        skin_tone = "Medium / Olive"
-        
-        if face_file and allowed_file(face_file.filename):
-            face_name = f"face_{int(time.time()*1000)}_{secure_filename(face_file.filename)}"
-            face_path = os.path.join(UPLOAD_FOLDER, face_name)
-            face_file.save(face_path)
-            temp_files.append(face_path)
-            skin_tone = detect_skin_tone_mediapipe(face_path)
-
-        occasion = request.form.get("occasion", "Casual Outing")
-        
-        # Categories list is inclusive of common item types
-        categories = ["shirt","pants","shoes","top","bottom","outerwear","dress","skirt"]
-        clothing_data = {cat: [] for cat in categories}
-        uploaded_items = {} # Filename -> nobg_filepath
-
-        for cat in categories:
-            files = request.files.getlist(f"file_{cat}")
-            for f in files[:MAX_FILES_PER_CATEGORY]:
-                if f and allowed_file(f.filename):
-                    # Use a unique name for the saved file
-                    fname_safe = secure_filename(f.filename)
-                    fname = f"{cat}_{int(time.time()*1000)}_{fname_safe}" 
-                    fpath = os.path.join(UPLOAD_FOLDER, fname)
-                    f.save(fpath)
-                    temp_files.append(fpath) # Original image file
-                    
-                    fpath_nobg = remove_bg(fpath)
-                    if fpath_nobg != fpath:
-                        temp_files.append(fpath_nobg) # No-background image file
-                        
-                    dominant = get_dominant_colors(fpath_nobg, k=3)
-                    
-                    clothing_data[cat].append({
-                        "filename": fname,
-                        "dominant_colors": dominant,
-                        "dominant_color_name": simple_color_name(dominant[0]) if dominant else "unknown",
-                        "pattern": detect_pattern(fpath_nobg),
-                        "style": detect_style_from_filename(fname),
-                        "warnings": check_image_quality(fpath_nobg)
-                    })
-                    uploaded_items[fname] = fpath_nobg
-
-        # --- Outfit Recommendation Generation ---
-        recommended_outfits = []
-        available_lists = [clothing_data[c] for c in categories if clothing_data[c]]
-        
-        if len(available_lists) >= 2:
-            combos = itertools.product(*available_lists)
-            for idx, combo in enumerate(combos):
-                if idx >= MAX_COMBOS:
-                    break
-                
-                combo_items = []
-                for c in combo:
-                    # Pass necessary item metadata to the scoring function
-                    combo_items.append({
-                        "style": c.get("style"),
-                        "pattern": c.get("pattern"),
-                        "dominant_colors": c.get("dominant_colors", [])
-                    })
-                
-                score, feedback = score_outfit(combo_items, skin_tone, occasion)
-                
-                recommended_outfits.append({
-                    "items": [c["filename"] for c in combo],
-                    "score": score,
-                    "feedback": feedback
-                })
-            
-            # Sort and cap the recommendations
-            recommended_outfits = sorted(recommended_outfits, key=lambda x: x["score"], reverse=True)[:10]
-
-        # Combine uploaded item previews (using no-bg versions)
-        combined_preview = combine_clothing_images(list(uploaded_items.values()))
-        if combined_preview:
-            # Add the combined preview to the list for cleanup in case of error
-             temp_files.append(os.path.join(UPLOAD_FOLDER, combined_preview))
-
-        accessories = ["Belt", "Watch", "Handbag", "Shoes Matching Color"]
-        recommended_colors = suggest_colors_for_skin(skin_tone)
-        elapsed = time.time() - start_time
-        
-        # NOTE: In a production environment, you would save files to persistent storage 
-        # (e.g., S3/CDN) and NOT delete them. For this local setup, we delete originals 
-        # but keep the no-bg versions/combined previews temporarily for the Node server 
-        # to process/fetch via /uploads route.
-        
-        # Clean up original file uploads (keep no-bg and combined preview for fetching)
-        for fpath in temp_files:
-            if not fpath.endswith("_nobg.png") and not fpath.startswith("combined_") and os.path.exists(fpath):
-                try:
-                    os.remove(fpath)
-                except OSError as e:
-                    logging.warning(f"Could not delete temporary file {fpath}: {e}")
+        spec = read_analyze_request()
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    try:
+        if wants_async():
+            try:
+                job_id = job_queue.submit(run_analysis_job, spec)
+            except QueueFull as e:
+                return jsonify({"success": False, "error": str(e), "retry_after": e.retry_after}), 429, \
+                    {"Retry-After": str(e.retry_after)}
+            return jsonify({
+                "success": True,
+                "job_id": job_id,
+                "status": "queued",
+                "status_url": f"/jobs/{job_id}",
+                "result_url": f"/jobs/{job_id}/result"
+            }), 202, {"Location": f"/jobs/{job_id}"}
+        if wants_stream():
+            return Response(stream_analysis(spec), mimetype="application/x-ndjson",
+                            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-        return jsonify({
-            "success": True,
-            "timing_sec": elapsed,
-            "skin_tone": skin_tone,
-            "clothing_items": clothing_data,
-            "recommended_outfits": recommended_outfits,
-            "recommended_accessories": accessories,
-            "recommended_colors": recommended_colors,
-            "combined_preview": combined_preview
-        })
+        result = {}
+        for _ in analysis_events(spec, result):
+            pass
+        return jsonify(result)
         
     except Exception as e:
         logging.error(f"❌ /analyze error: {traceback.format_exc()}")
         # Minimal cleanup on error - usually kept for post-mortem debugging
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    state = job_queue.status(job_id)
+    if state is None:
+        return jsonify({"success": False, "error": "Unknown or expired job"}), 404
+    return jsonify({"success": True, **{k: v for k, v in state.items() if k != "result"}})
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    state = job_queue.status(job_id)
+    if state is None:
+        return jsonify({"success": False, "error": "Unknown or expired job"}), 404
+    if state["status"] == "done":
+        return jsonify(state["result"])
+    if state["status"] == "failed":
+        return jsonify({"success": False, "error": state.get("error")}), 500
+    # Still queued or running
+    return jsonify({"success": True, "job_id": job_id, "status": state["status"],
+                    "progress": state.get("progress")}), 202, {"Retry-After": "1"}
+
 # ... (suggest_outfit endpoint remains largely unchanged) ...
 @app.route("/suggest_outfit", methods=["POST"])
+@metrics.instrumented("suggest_outfit")
 def suggest_outfit():
     """
-    Called by frontend OutfitSuggestion. Accepts items from local storage/DB.
-    Returns recommended_outfits (score + items).
+    Called by frontend OutfitSuggestion. Accepts items from local storage/DB, or a
+    closet_id whose ingested item index is scored instead.
+    Returns recommended_outfits (score + items), or with skin_tones and/or occasions
+    ("all" or a list) one ranked table per (skin tone, occasion) from a single pass.
     """
     try:
+        skin_tone = request.form.get("skin_tone") or (request.get_json(silent=True) or {}).get("skin_tone") or "Medium / Olive"
+        occasion = request.form.get("occasion") or (request.get_json(silent=True) or {}).get("occasion") or "Casual Outing"
+        # Multi-occasion mode: skin_tones and/or occasions ask for one table per pair
+        try:
+            tables = requested_tables(skin_tone, occasion)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        # A stored closet index replaces the item payload entirely
+        closet_id = request.form.get("closet_id") or (request.get_json(silent=True) or {}).get("closet_id")
+        if closet_id:
+            try:
+                with metrics.stage("closet_load"):
+                    closet = closet_store.load(closet_id)
+            except ValueError as e:
+                return jsonify({"success": False, "error": str(e)}), 400
+            if closet is None:
+                return jsonify({"success": False, "error": f"Unknown closet: {closet_id}"}), 404
+            sizes = closet_combination_sizes(len(closet))
+            verify = str(request.form.get("verify") or (request.get_json(silent=True) or {}).get("verify") or "").lower() in ("1", "true", "yes")
+            metrics.observe("items_per_request", len(closet))
+            with metrics.stage("suggest_scoring"):
+                by_pair = closet_recommender.recommend_many(closet, tables or [(skin_tone, occasion)], sizes, k=20, verify=verify)
+            for _, rec_stats in by_pair.values():
+                metrics.event(f"recommendations_{rec_stats['mode']}")
+            body = {"success": True, "skin_tone": skin_tone, "closet_id": closet_id, "combination_sizes": list(sizes)}
+            if tables:
+                body["tables"] = [{
+                    "skin_tone": tone,
+                    "occasion": occ,
+                    "recommendation_stats": by_pair[(tone, occ)][1],
+                    "recommended_outfits": outfit_entries(by_pair[(tone, occ)][0], occ, closet.item),
+                } for tone, occ in tables]
+            else:
+                top, rec_stats = by_pair[(skin_tone, occasion)]
+                body["recommendation_stats"] = rec_stats
+                body["recommended_outfits"] = outfit_entries(top, occasion, closet.item)
+            return jsonify({**body, **timings_field()})
+
         # Accept either JSON body or form-encoded repeated items
         items_payload = []
         if request.is_json:
@@ -443,9 +747,6 @@ def suggest_outfit():
                     except Exception:
                         items_payload = [single]
 
-        skin_tone = request.form.get("skin_tone") or (request.get_json() or {}).get("skin_tone") or "Medium / Olive"
-        occasion = request.form.get("occasion") or (request.get_json() or {}).get("occasion") or "Casual Outing"
-
         # Normalize items: ensure each has keys we expect
         normalized = []
         for it in items_payload:
@@ -463,6 +764,7 @@ def suggest_outfit():
             normalized.append(itn)
 
         # Quick local analysis for items that lack dominant_colors: try to find file path
+        pending = [] # (item, path, cache_key, cached record) still needing color analysis
         for it in normalized:
             if not it.get("dominant_colors") and it.get("image"):
                 path_candidate = None
@@ -471,60 +773,383 @@ def suggest_outfit():
                 if "uploads/" in img_url:
                     # Extract filename from the path
                     filename = img_url.split("/")[-1]
-                    path_candidate = os.path.join(UPLOAD_FOLDER, filename)
+                    path_candidate = upload_store.resolve(filename)
                 
-                if path_candidate and os.path.exists(path_candidate):
+                if path_candidate:
                     try:
-                        # Re-run color analysis on the saved file
-                        it["dominant_colors"] = get_dominant_colors(path_candidate, k=3)
+                        with open(path_candidate, "rb") as fh:
+                            cache_key = feature_cache.key_for(fh.read())
+                        record = feature_cache.get(cache_key) or {}
+                        if record.get("dominant_colors") is not None:
+                            it["dominant_colors"] = record["dominant_colors"]
+                        else:
+                            pending.append((it, path_candidate, cache_key, record))
                     except Exception as e:
                         logging.warning(f"Failed to re-analyze colors for {path_candidate}: {e}")
                         it["dominant_colors"] = []
 
+        if pending:
+            # Re-run color analysis on all uncached files in one batch
+            try:
+                with metrics.stage("suggest_color_backfill"):
+                    batch_colors = get_dominant_colors_batch([p for _, p, _, _ in pending], k=3)
+            except Exception as e:
+                logging.warning(f"Failed to re-analyze colors for {len(pending)} items: {e}")
+                batch_colors = [[] for _ in pending]
+            for (it, _, cache_key, record), colors in zip(pending, batch_colors):
+                it["dominant_colors"] = colors
+                if colors:
+                    feature_cache.put(cache_key, {**record, "dominant_colors": colors})
+
         # Now generate suggestions: as simple permutations of selected items
-        recommended = []
+        pairs = tables or [(skin_tone, occasion)]
+        top_by_pair = {pair: [] for pair in pairs}
         n = len(normalized)
         if n >= 2:
-            combos = []
-            for r in range(2, min(n, 5)+1):  # cap combination size at 5 for performance
-                combos.extend(itertools.combinations(normalized, r))
-            
-            # Score combos
-            for combo in combos:
-                # Need to map the minimal saved data to the format score_outfit expects
-                combo_items = [{
-                    "style": i.get("style"), 
-                    "pattern": i.get("pattern"), 
-                    "dominant_colors": i.get("dominant_colors", [])
-                } for i in combo]
-                
-                score, feedback = score_outfit(combo_items, skin_tone, occasion)
-                
-                recommended.append({
-                    "items": [{"name": it.get("name"), "image": it.get("image"), "category": it.get("category")} for it in combo],
-                    "score": score,
-                    "feedback": feedback
-                })
-            
-            recommended = sorted(recommended, key=lambda x: x["score"], reverse=True)[:20]
+            # Need to map the minimal saved data to the format score_outfit expects
+            scoring_items = [{
+                "style": i.get("style"), 
+                "pattern": i.get("pattern"), 
+                "dominant_colors": i.get("dominant_colors", [])
+            } for i in normalized]
 
+            # Vectorized scoring of every 2..5-item combination, keeping only the top 20 per table
+            metrics.observe("items_per_request", n)
+            with metrics.stage("suggest_scoring"):
+                top_by_pair = top_k_outfit_tables(scoring_items, pairs, OCCASION_MULTIPLIERS, k=20, sizes=range(2, 6))
+
+        if tables:
+            return jsonify({
+                "success": True,
+                "skin_tone": skin_tone,
+                "tables": [{
+                    "skin_tone": tone,
+                    "occasion": occ,
+                    "recommended_outfits": outfit_entries(top_by_pair[(tone, occ)], occ, lambda i: normalized[i]),
+                } for tone, occ in tables],
+                **timings_field()
+            })
         return jsonify({
             "success": True,
             "skin_tone": skin_tone,
-            "recommended_outfits": recommended
+            "recommended_outfits": outfit_entries(top_by_pair[(skin_tone, occasion)], occasion, lambda i: normalized[i]),
+            **timings_field()
         })
     except Exception as e:
         logging.error(f"❌ /suggest_outfit error: {traceback.format_exc()}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+def requested_list(name):
+    """A list parameter given as JSON array, repeated form fields or a comma-separated string."""
+    value = (request.get_json(silent=True) or {}).get(name) if request.is_json else request.form.getlist(name)
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    return [v.strip() for part in value for v in str(part).split(",") if v.strip()]
+
+def requested_tables(skin_tone, occasion):
+    """
+    (skin tone, occasion) pairs for multi-occasion /suggest_outfit, or None when
+    neither skin_tones nor occasions was sent. "all" expands to every known value.
+    """
+    skin_tones = requested_list("skin_tones")
+    occasions = requested_list("occasions")
+    if not skin_tones and not occasions:
+        return None
+    skin_tones = list(SKIN_TONES) if skin_tones == ["all"] else skin_tones or [skin_tone]
+    occasions = list(OCCASION_MULTIPLIERS) if occasions == ["all"] else occasions or [occasion]
+    pairs = list(dict.fromkeys((t, o) for t in skin_tones for o in occasions))
+    if len(pairs) > SUGGEST_MAX_TABLES:
+        raise ValueError(f"Too many tables requested: {len(pairs)} (max {SUGGEST_MAX_TABLES})")
+    return pairs
+
+def outfit_entries(top, occasion, member):
+    """recommended_outfits entries for top-k results; member(i) is item i's display dict."""
+    entries = []
+    for combo, score, final_score in top:
+        members = [member(i) for i in combo]
+        entries.append({
+            "items": [{"name": m.get("name"), "image": m.get("image"), "category": m.get("category")} for m in members],
+            "score": score,
+            "feedback": outfit_feedback(final_score, occasion)
+        })
+    return entries
+
+def timings_field():
+    """{"timings": per-stage breakdown} when the request asked for include_timings."""
+    scope = metrics.current_scope()
+    return {"timings": scope.breakdown()} if scope is not None and wants_timings() else {}
+
+def closet_combination_sizes(n):
+    """Outfit sizes (2..5, like the item-payload path) whose combinations fit SUGGEST_MAX_COMBINATIONS."""
+    sizes = []
+    total = 0
+    for r in range(2, 6):
+        total += math.comb(n, r)
+        if sizes and total > SUGGEST_MAX_COMBINATIONS:
+            break
+        sizes.append(r)
+    return range(sizes[0], sizes[-1] + 1)
+
+def resolve_import_path(rel_path):
+    """Resolves a client-supplied path inside CLOSET_IMPORT_ROOT, refusing anything outside it."""
+    if not CLOSET_IMPORT_ROOT:
+        raise PermissionError("Local closet ingestion is disabled (CLOSET_IMPORT_ROOT not set)")
+    if not isinstance(rel_path, str):
+        raise ValueError(f"Import paths must be strings, not {rel_path!r}")
+    root = os.path.realpath(CLOSET_IMPORT_ROOT)
+    full = os.path.realpath(os.path.join(root, rel_path))
+    if os.path.commonpath([root, full]) != root:
+        raise PermissionError(f"Path outside import root: {rel_path}")
+    return full
+
+def read_ingest_request():
+    """
+    Returns ([(category, name, bytes or local path)], replace). Multipart uploads use
+    the /analyze field names (file_<category>); a JSON body names either a
+    "directory" (category from each sub-directory name) or a "manifest" list of
+    {"path", "category", "name"} entries, relative to CLOSET_IMPORT_ROOT.
+    """
+    sources = []
+
+    def add(category, name, source):
+        # Checked as sources are collected, so a huge directory is not walked to the end
+        if len(sources) >= CLOSET_MAX_ITEMS_PER_INGEST:
+            raise ValueError(f"At most {CLOSET_MAX_ITEMS_PER_INGEST} images per ingest request")
+        sources.append((category, name, source))
+
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            raise ValueError("JSON body must be an object")
+        default_category = payload.get("category", "unknown")
+        if payload.get("directory"):
+            base = resolve_import_path(payload["directory"])
+            if not os.path.isdir(base):
+                raise ValueError(f"Not a directory: {payload['directory']}")
+            for dirpath, _, filenames in os.walk(base):
+                parent = os.path.basename(dirpath).lower()
+                category = parent if parent in CLOTHING_CATEGORIES else default_category
+                for name in sorted(filenames):
+                    if allowed_file(name):
+                        add(category, name, os.path.join(dirpath, name))
+        manifest = payload.get("manifest") or []
+        if not isinstance(manifest, list):
+            raise ValueError("manifest must be a list")
+        for i, entry in enumerate(manifest):
+            if not isinstance(entry, dict) or not entry.get("path"):
+                raise ValueError(f"manifest[{i}] must be an object with a \"path\"")
+            path = resolve_import_path(entry["path"])
+            name = entry.get("name") or os.path.basename(path)
+            if allowed_file(path):
+                add(entry.get("category") or default_category, name, path)
+        replace = bool(payload.get("replace"))
+    else:
+        for cat in CLOTHING_CATEGORIES:
+            for f in request.files.getlist(f"file_{cat}"):
+                if f and allowed_file(f.filename):
+                    add(cat, secure_filename(f.filename), f.read())
+        replace = request.form.get("replace", "").lower() in ("1", "true", "yes")
+    if not sources:
+        raise ValueError("No images to ingest")
+    return sources, replace
+
+def ingest_closet_item(closet_id, category, name, source):
+    """Analyzes one closet image (upload bytes or local path) into an index record."""
+    if isinstance(source, bytes):
+        data = source
+    else:
+        with open(source, "rb") as fh:
+            data = fh.read()
+    key = feature_cache.key_for(data)
+    # The content key keeps equal filenames from different folders apart
+    fname = secure_filename(f"{closet_id}_{key[:12]}_{name}")
+    features = analyze_clothing_item(data, fname)
+    if not features["nobg_path"]:
+        raise ValueError(", ".join(features["warnings"]) or "Cannot read image")
+    return {
+        "key": key,
+        "name": os.path.splitext(name)[0],
+        "image": f"/uploads/{os.path.basename(features['nobg_path'])}",
+        "filename": fname,
+        "category": category,
+        "style": detect_style_from_filename(name),
+        "pattern": features["pattern"],
+        "pattern_detail": features["pattern_detail"],
+        "dominant_colors": features["dominant_colors"],
+        "warnings": features["warnings"],
+    }
+
+@app.route("/closets/<closet_id>/ingest", methods=["POST"])
+@metrics.instrumented("closet_ingest")
+def ingest_closet(closet_id):
+    """
+    Bulk-analyzes garment images on the shared analysis pool and adds them to the
+    closet's item index (or replaces it with replace=1).
+    """
+    try:
+        closet_store.path(closet_id)
+        sources, replace = read_ingest_request()
+    except PermissionError as e:
+        return jsonify({"success": False, "error": str(e)}), 403
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    try:
+        start_time = time.time()
+        records = [None] * len(sources)
+        failed_items = []
+        for index, record, error in analysis_pool.imap_unordered(
+            ingest_closet_item,
+            [(closet_id, cat, name, source) for cat, name, source in sources],
+            max_inflight=ANALYZE_WORKERS,
+            timeout=ANALYZE_ITEM_TIMEOUT_SEC,
+        ):
+            if error is not None:
+                cat, name, _ = sources[index]
+                logging.error(f"Closet ingest failed for {name}: {error}")
+                failed_items.append({"index": index, "category": cat, "name": name, "error": str(error)})
+            else:
+                records[index] = record
+        records = [r for r in records if r is not None]
+        metrics.observe("items_per_request", len(sources))
+        with metrics.stage("closet_write"):
+            closet, added = closet_store.write(closet_id, records, replace=replace)
+        return jsonify({
+            "success": True,
+            "closet_id": closet_id,
+            "ingested": added,
+            "duplicates": len(records) - added,
+            "failed_items": sorted(failed_items, key=lambda f: f["index"]),
+            "item_count": len(closet),
+            "timing_sec": time.time() - start_time,
+            **timings_field()
+        })
+    except Exception as e:
+        logging.error(f"❌ /closets ingest error: {traceback.format_exc()}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+CLOSET_ITEM_FIELDS = ("name", "category", "style", "pattern", "dominant_colors")
+
+def read_item_fields():
+    """Validated editable fields from a PATCH body."""
+    payload = request.get_json(silent=True) or {}
+    fields = {k: payload[k] for k in CLOSET_ITEM_FIELDS if k in payload}
+    if not fields:
+        raise ValueError(f"Nothing to update; editable fields: {', '.join(CLOSET_ITEM_FIELDS)}")
+    for k, v in fields.items():
+        if k == "dominant_colors":
+            if not isinstance(v, list) or not all(
+                isinstance(c, list) and len(c) == 3 and all(isinstance(x, int) and 0 <= x <= 255 for x in c) for c in v
+            ):
+                raise ValueError("dominant_colors must be a list of [r, g, b] values in 0..255")
+        elif not isinstance(v, str) or not v:
+            raise ValueError(f"{k} must be a non-empty string")
+    return fields
+
+@app.route("/closets/<closet_id>/items/<item_key>", methods=["DELETE", "PATCH"])
+@metrics.instrumented("closet_item")
+def closet_item(closet_id, item_key):
+    """
+    Removes one item (DELETE) or edits its fields (PATCH with a JSON body); items
+    are added through /closets/<id>/ingest. Stored recommendations catch up on the
+    next /suggest_outfit by rescoring only outfits that include the changed item.
+    """
+    try:
+        if request.method == "DELETE":
+            closet, removed = closet_store.remove(closet_id, [item_key])
+            found = removed > 0
+        else:
+            closet, found = closet_store.update(closet_id, item_key, read_item_fields())
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"❌ /closets item error: {traceback.format_exc()}")
+        return jsonify({"success": False, "error": str(e)}), 500
+    if closet is None:
+        return jsonify({"success": False, "error": f"Unknown closet: {closet_id}"}), 404
+    if not found:
+        return jsonify({"success": False, "error": f"Unknown item: {item_key}"}), 404
+    return jsonify({"success": True, "closet_id": closet_id, "item_key": item_key,
+                    "item_count": len(closet), "generation": closet.generation})
+
+@app.route("/closets/<closet_id>", methods=["GET"])
+def closet_summary(closet_id):
+    try:
+        closet = closet_store.load(closet_id)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    if closet is None:
+        return jsonify({"success": False, "error": f"Unknown closet: {closet_id}"}), 404
+    return jsonify({"success": True, **closet.summary()})
+
+@app.route("/closets/<closet_id>", methods=["DELETE"])
+@metrics.instrumented("closet_delete")
+def closet_delete(closet_id):
+    """Deletes a closet's index and stored recommendations; its upload images are left to the reaper."""
+    try:
+        existed = closet_store.delete(closet_id)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"❌ /closets delete error: {traceback.format_exc()}")
+        return jsonify({"success": False, "error": str(e)}), 500
+    closet_recommender.forget(closet_id)
+    if not existed:
+        return jsonify({"success": False, "error": f"Unknown closet: {closet_id}"}), 404
+    return jsonify({"success": True, "closet_id": closet_id})
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Prometheus text format; numbers are per worker process."""
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@app.after_request
+def count_response(response):
+    metrics.count("http_requests_total", endpoint=request.endpoint or "unknown", status=response.status_code)
+    return response
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    return jsonify({"status": "ok", "pid": os.getpid(), "uptime_sec": round(time.time() - STARTED_AT, 3)})
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    report = startup.report()
+    return jsonify(report), 200 if report["ready"] else 503
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify(feature_cache.stats())
+
+@app.route("/storage/stats", methods=["GET"])
+def storage_stats():
+    """Upload folder settings and this worker's last reaper pass."""
+    return jsonify(upload_store.stats())
+
 @app.route("/uploads/<filename>")
 @cross_origin() # 🌟 CORS FIX: Explicitly allow cross-origin requests for file serving
 def uploaded_file(filename):
     # Security: use secure_filename to prevent directory traversal attacks
     safe = secure_filename(filename)
-    return send_from_directory(UPLOAD_FOLDER, safe)
+    if preview_store.is_preview(safe):
+        try:
+            with metrics.stage("preview_serve"):
+                path = preview_store.ensure(safe)
+        except Exception as e:
+            logging.error(f"❌ Preview render error for {safe}: {traceback.format_exc()}")
+            return jsonify({"success": False, "error": str(e)}), 500
+        if path is None:
+            return jsonify({"success": False, "error": "Preview not found"}), 404
+        return send_from_directory(os.path.abspath(os.path.dirname(path)), safe, max_age=86400)
+    path = upload_store.resolve(safe)
+    if path is None:
+        return jsonify({"success": False, "error": "File not found"}), 404
+    upload_store.touch(path)
+    return send_from_directory(os.path.abspath(os.path.dirname(path)), safe)
 
 if __name__ == "__main__":
+    # Development server; in production run `gunicorn -c gunicorn.conf.py app:app`
     logging.info("Starting Flask ML Microservice on 127.0.0.1:5001")
     # run on port 5001 to avoid conflict with Node server if needed
     app.run(debug=True, host="127.0.0.1", port=5001)
\ No newline at end of file
@@ -0,0 +1,916 @@
+"""
+Benchmarks for the ML service hot paths. The legacy baselines need the extra
+packages in requirements-benchmark.txt (pip install -r requirements-benchmark.txt).
+
+    python benchmark.py colors --items 40 --repeat 3
+    python benchmark.py scoring --items 40 --trials 200
+    python benchmark.py search --categories 8 --items 5
+    python benchmark.py incremental --items 60 --trials 200
+    python benchmark.py tables --items 40 --trials 50
+    python benchmark.py bg --items 16 --model u2netp
+    python benchmark.py pattern --items 80 --image-size 1600
+    python benchmark.py decode --items 8 --image-size 4032 --max-edge 512
+    python benchmark.py suite --garments 8 --closet 30 --iterations 20 --save-baseline base.json
+    python benchmark.py suite --baseline base.json --threshold 0.25
+    python benchmark.py workers --workers 4
+    python benchmark.py storage --files 20000
+    python benchmark.py startup --repeat 3
+"""
+import argparse
+import io
+import itertools
+import json
+import math
+import os
+import sys
+import signal
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import color_engine
+import pattern_engine
+import outfit_scoring
+import outfit_search
+
+# ------------------- Synthetic workload -------------------
+
+def synthetic_garment(rng, size=(900, 700)):
+    """
+    RGBA garment on a transparent background, like rembg _nobg output: a base
+    color with two stripe colors covering roughly 1/2, 1/3 and 1/6 of the body.
+    """
+    h, w = size
+    img = np.zeros((h, w, 4), dtype=np.uint8)
+    base, stripe_a, stripe_b = rng.integers(0, 256, (3, 3))
+    x0, y0, x1, y1 = w // 5, h // 6, 4 * w // 5, 5 * h // 6
+    img[y0:y1, x0:x1, :3] = base
+    img[y0:y1, x0:x1, 3] = 255
+    period = int(rng.integers(24, 60))
+    for y in range(y0, y1, period):
+        img[y:min(y + period // 3, y1), x0:x1, :3] = stripe_a
+        img[y + period // 3:min(y + period // 2, y1), x0:x1, :3] = stripe_b
+    noise = rng.integers(-10, 11, (h, w, 3))
+    img[..., :3] = np.clip(img[..., :3].astype(int) + noise, 0, 255).astype(np.uint8)
+    return img
+
+
+PATTERN_KINDS = ("solid", "striped", "checked", "printed")
+
+
+def synthetic_patterned_garment(rng, kind, size=(1600, 1200)):
+    """
+    (rgb, alpha) garment with a known surface: solid (with shading and seams),
+    striped or checked at a random angle and period, or a printed blob motif,
+    passed through JPEG like a phone upload.
+    """
+    h, w = size
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    c1, c2 = rng.integers(0, 256, (2, 3))
+    while np.abs(c1.astype(int) - c2).sum() < 120:
+        c2 = rng.integers(0, 256, 3)
+    img = np.empty((h, w, 3), np.float32)
+    img[:] = c1
+    scale = max(h, w) / 1000
+    if kind == "solid":
+        img += (yy / h * rng.uniform(-40, 40))[..., None]
+        for _ in range(int(rng.integers(0, 3))):
+            x = int(rng.integers(w // 4, 3 * w // 4))
+            img[:, x:x + max(2, int(3 * scale))] *= 0.7
+        y = int(rng.integers(h // 4, 3 * h // 4))
+        img[y:y + max(2, int(3 * scale))] *= 0.7
+    elif kind in ("striped", "checked"):
+        angle, period = rng.uniform(0, np.pi), rng.uniform(14, 60) * scale
+        across = np.mod(xx * np.cos(angle) + yy * np.sin(angle), period) < period * rng.uniform(0.3, 0.6)
+        img[across] = c2
+        if kind == "checked":
+            period2 = period * rng.uniform(0.7, 1.4)
+            along = np.mod(-xx * np.sin(angle) + yy * np.cos(angle), period2) < period2 * rng.uniform(0.3, 0.6)
+            img[along] = (img[along] + c2) / 2
+            img[across & along] = c2 * 0.6
+    else:
+        for _ in range(int(rng.integers(40, 200))):
+            color = tuple(int(v) for v in rng.integers(0, 256, 3))
+            r = int(rng.uniform(6, 40) * scale)
+            center = (int(rng.integers(0, w)), int(rng.integers(0, h)))
+            if rng.random() < 0.5:
+                cv2.circle(img, center, r, color, -1)
+            else:
+                cv2.ellipse(img, center, (r, r // 2 + 1), float(rng.uniform(0, 180)), 0, 360, color, -1)
+    img += rng.normal(0, 4, img.shape)
+    bgr = cv2.cvtColor(np.clip(img, 0, 255).astype(np.uint8), cv2.COLOR_RGB2BGR)
+    rgb = cv2.cvtColor(cv2.imdecode(np.frombuffer(encode(bgr), np.uint8), cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+
+    alpha = np.zeros((h, w), np.uint8)
+    x0, y0, x1, y1 = w // 6, h // 8, 5 * w // 6, 7 * h // 8
+    cv2.rectangle(alpha, (x0, y0), (x1, y1), 255, -1)
+    cv2.rectangle(alpha, (x0 - w // 8, y0), (x0, y0 + h // 3), 255, -1)  # sleeves
+    cv2.rectangle(alpha, (x1, y0), (x1 + w // 8, y0 + h // 3), 255, -1)
+    return rgb, alpha
+
+
+def synthetic_face(rng, size=(640, 480)):
+    """BGR portrait-like image: a skin-toned ellipse with darker eyes and mouth."""
+    h, w = size
+    img = np.full((h, w, 3), rng.integers(60, 200, 3), dtype=np.uint8)
+    skin = tuple(int(c) for c in rng.integers(60, 230) * np.array([0.75, 0.85, 1.0]))
+    cx, cy = w // 2, h // 2
+    cv2.ellipse(img, (cx, cy), (w // 5, h // 3), 0, 0, 360, skin, -1)
+    for dx in (-w // 12, w // 12):
+        cv2.circle(img, (cx + dx, cy - h // 12), max(3, w // 60), (40, 30, 30), -1)
+    cv2.ellipse(img, (cx, cy + h // 8), (w // 16, h // 60 + 2), 0, 0, 360, (60, 60, 150), -1)
+    return img
+
+
+def synthetic_photo(rng, size):
+    """BGR camera-like photo of a garment on a plain backdrop, with sensor noise."""
+    h, w = size
+    small = synthetic_garment(rng, (max(64, h // 4), max(48, w // 4)))
+    alpha = small[..., 3:].astype(np.float32) / 255.0
+    backdrop = np.full(small.shape[:2] + (3,), rng.integers(150, 230), dtype=np.float32)
+    img = small[..., :3] * alpha + backdrop * (1 - alpha)
+    img = cv2.resize(img, (w, h), interpolation=cv2.INTER_CUBIC) + rng.normal(0, 1.5, (h, w, 3))
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def with_exif_orientation(jpeg, orientation):
+    """Re-saves a JPEG with an EXIF Orientation tag, as phone cameras write it."""
+    from PIL import Image
+    img = Image.open(io.BytesIO(jpeg))
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=90, exif=exif.tobytes())
+    return out.getvalue()
+
+
+def encode(img, ext=".jpg"):
+    ok, buf = cv2.imencode(ext, img)
+    return buf.tobytes()
+
+STYLES = ["Casual", "Formal", "Party/Festive", "Sporty", None]
+PATTERNS = ["Solid", "Patterned", "Unknown", None]
+
+
+def synthetic_closet(rng, n):
+    """Item payloads as /suggest_outfit receives them after normalization."""
+    items = []
+    for _ in range(n):
+        colors = [] if rng.random() < 0.1 else [tuple(int(c) for c in rng.integers(0, 256, 3))]
+        items.append({
+            "style": STYLES[rng.integers(len(STYLES))],
+            "pattern": PATTERNS[rng.integers(len(PATTERNS))],
+            "dominant_colors": colors,
+        })
+    return items
+
+# ------------------- Reference implementations -------------------
+
+def legacy_dominant_colors(image, k=3):
+    # Previous get_dominant_colors: sklearn KMeans(n_init=10) on <= 40k pixels.
+    # Fed the same foreground pixels as the engine so only the quantizer differs.
+    from sklearn.cluster import KMeans
+    pixels = image[..., :3][image[..., 3] >= color_engine.ALPHA_THRESHOLD]
+    sample_size = 200 * 200
+    if pixels.shape[0] > sample_size:
+        idx = np.linspace(0, pixels.shape[0] - 1, sample_size).astype(int)
+        pixels = pixels[idx]
+    kmeans = KMeans(n_clusters=min(k, len(pixels)), n_init=10, random_state=0).fit(pixels)
+    colors = kmeans.cluster_centers_.astype(int)
+    _, counts = np.unique(kmeans.labels_, return_counts=True)
+    return [tuple(int(c) for c in colors[i]) for i in np.argsort(-counts)]
+
+
+def delta_e(rgb_a, rgb_b):
+    """CIE76 color difference between two RGB tuples."""
+    lab = cv2.cvtColor(np.array([[rgb_a, rgb_b]], dtype=np.float32) / 255.0, cv2.COLOR_RGB2Lab)[0]
+    return float(np.linalg.norm(lab[0] - lab[1]))
+
+
+def palette_fit(image, colors):
+    """Mean CIE76 distance from the image's sampled pixels to their nearest palette color."""
+    to_lab = lambda rgb: cv2.cvtColor(np.asarray(rgb, np.float32).reshape(-1, 1, 3) / 255.0,
+                                      cv2.COLOR_RGB2Lab).reshape(-1, 3)
+    pixels, palette = to_lab(color_engine.sample_pixels(image)), to_lab(colors)
+    return float(np.mean(np.min(np.linalg.norm(pixels[:, None, :] - palette[None], axis=2), axis=1)))
+
+
+def matched_delta_e(colors_a, colors_b):
+    # Cluster order can swap when shares are close, so match palettes optimally
+    n = min(len(colors_a), len(colors_b))
+    if n == 0:
+        return 0.0
+    return min(
+        max(delta_e(colors_a[i], perm_b[i]) for i in range(n))
+        for perm_b in itertools.permutations(colors_b, n)
+    )
+
+
+def legacy_detect_pattern(rgb, alpha):
+    # Previous detect_pattern: full-resolution Canny + HoughLines on the _nobg image
+    from image_pipeline import ImageFrame
+    lines = cv2.HoughLines(cv2.Canny(ImageFrame(rgb, alpha).gray, 50, 150), 1, np.pi / 180, 120)
+    return "Patterned" if lines is not None else "Solid"
+
+# ------------------- Stages -------------------
+
+def timed(fn, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def bench_colors(args):
+    rng = np.random.default_rng(args.seed)
+    images = [synthetic_garment(rng) for _ in range(args.items)]
+
+    legacy_t, legacy = timed(lambda: [legacy_dominant_colors(img) for img in images], args.repeat)
+    single_t, single = timed(lambda: [color_engine.dominant_colors(img) for img in images], args.repeat)
+    batch_t, batch = timed(lambda: color_engine.dominant_colors_batch(images), args.repeat)
+
+    diffs = [matched_delta_e(a, b) for a, b in zip(legacy, batch)]
+    top = [delta_e(a[0], b[0]) for a, b in zip(legacy, batch) if a and b]
+    print(f"items={args.items}")
+    print(f"sklearn KMeans      {legacy_t * 1000:9.1f} ms")
+    print(f"engine (per image)  {single_t * 1000:9.1f} ms  x{legacy_t / single_t:.1f}")
+    print(f"engine (batched)    {batch_t * 1000:9.1f} ms  x{legacy_t / batch_t:.1f}")
+    print(f"palette dE76 max={max(diffs):.2f} mean={np.mean(diffs):.2f}  dominant dE76 max={max(top):.2f}")
+    if single != batch:
+        print("FAIL: batched output differs from per-image output")
+        return 1
+    if max(diffs) > args.max_delta_e:
+        print(f"FAIL: palette dE76 above {args.max_delta_e}")
+        return 1
+    return 0
+
+
+def legacy_suggest(items, skin_tone, occasion, k=20):
+    # Previous /suggest_outfit loop: score every combination, stable sort, slice
+    import app
+    scored = []
+    for r in range(2, min(len(items), 5) + 1):
+        for combo in itertools.combinations(range(len(items)), r):
+            score, feedback = app.score_outfit([items[i] for i in combo], skin_tone, occasion)
+            scored.append((combo, score, feedback))
+    return sorted(scored, key=lambda x: x[1], reverse=True)[:k]
+
+
+def engine_suggest(items, skin_tone, occasion, k=20):
+    import app
+    top = outfit_scoring.top_k_outfits(items, skin_tone, occasion, app.OCCASION_MULTIPLIERS, k=k)
+    return [(combo, score, app.outfit_feedback(final, occasion)) for combo, score, final in top]
+
+
+def bench_scoring(args):
+    # Property check: identical (items, score, feedback) lists on random closets
+    import app
+    rng = np.random.default_rng(args.seed)
+    tones = [
+        "Very Light / Porcelain", "Light / Fair", "Medium / Olive", "Tan / Caramel / Light Brown",
+        "Brown / Warm Brown", "Dark Brown / Deep", "Very Dark / Ebony"]
+    occasions = list(app.OCCASION_MULTIPLIERS) + ["Unlisted"]
+    for trial in range(args.trials):
+        items = synthetic_closet(rng, int(rng.integers(0, 12)))
+        tone = tones[rng.integers(len(tones))]
+        occasion = occasions[rng.integers(len(occasions))]
+        k = int(rng.integers(1, 30))
+        if legacy_suggest(items, tone, occasion, k) != engine_suggest(items, tone, occasion, k):
+            print(f"FAIL: trial {trial} differs (n={len(items)}, {tone}, {occasion}, k={k})")
+            return 1
+    print(f"parity: {args.trials} random closets identical")
+
+    items = synthetic_closet(rng, args.items)
+    legacy_t, legacy = timed(lambda: legacy_suggest(items, "Medium / Olive", "Office"), 1)
+    engine_t, engine = timed(lambda: engine_suggest(items, "Medium / Olive", "Office"), args.repeat)
+    print(f"items={args.items}")
+    print(f"score_outfit loop   {legacy_t * 1000:9.1f} ms")
+    print(f"vectorized engine   {engine_t * 1000:9.1f} ms  x{legacy_t / engine_t:.1f}")
+    if legacy != engine:
+        print("FAIL: large closet ranking differs")
+        return 1
+    return 0
+
+
+def bench_tables(args):
+    # Every (skin tone, occasion) table from one pass vs one top_k_outfits call per table
+    import app
+    rng = np.random.default_rng(args.seed)
+    pairs = [(tone, occasion) for tone in outfit_scoring.SKIN_TONES for occasion in app.OCCASION_MULTIPLIERS]
+    for trial in range(args.trials):
+        items = synthetic_closet(rng, int(rng.integers(0, 14)))
+        subset = [pairs[i] for i in rng.choice(len(pairs), int(rng.integers(1, len(pairs))), replace=False)]
+        k = int(rng.integers(1, 30))
+        tables = outfit_scoring.top_k_outfit_tables(items, subset, app.OCCASION_MULTIPLIERS, k=k, sizes=range(2, 6))
+        for tone, occasion in subset:
+            if tables[(tone, occasion)] != outfit_scoring.top_k_outfits(items, tone, occasion, app.OCCASION_MULTIPLIERS, k=k):
+                print(f"FAIL: trial {trial} differs (n={len(items)}, {tone}, {occasion}, k={k})")
+                return 1
+    print(f"parity: {args.trials} random closets identical")
+
+    enc = outfit_scoring.EncodedItems(synthetic_closet(rng, args.items))
+    occasion_pairs = [("Medium / Olive", occasion) for occasion in app.OCCASION_MULTIPLIERS]
+    print(f"items={args.items}")
+    for label, subset in (("all occasions", occasion_pairs), ("all tones x occasions", pairs)):
+        loop_t, _ = timed(lambda: [outfit_scoring.top_k_outfits(enc, t, o, app.OCCASION_MULTIPLIERS) for t, o in subset], 1)
+        pass_t, _ = timed(lambda: outfit_scoring.top_k_outfit_tables(enc, subset, app.OCCASION_MULTIPLIERS), args.repeat)
+        print(f"{label:22} tables={len(subset):3}  per-table calls {loop_t * 1000:9.1f} ms  "
+              f"one pass {pass_t * 1000:9.1f} ms  x{loop_t / pass_t:.1f}")
+    return 0
+
+
+def closet_records(rng, n, start=0):
+    """Closet index records (as ClosetStore.write takes them) with unique keys."""
+    return [{"key": f"item{start + i}", "name": f"item{start + i}", "image": "", "filename": "",
+             "category": "top", "warnings": [], "style": item["style"] or "Casual",
+             "pattern": item["pattern"] or "Solid", "dominant_colors": item["dominant_colors"]}
+            for i, item in enumerate(synthetic_closet(rng, n))]
+
+
+def edit_closet(rng, store, closet_id, next_key):
+    """One random add / remove / update; returns the next unused key number."""
+    keys = [it["key"] for it in store.load(closet_id).items]
+    op = rng.random()
+    if op < 0.35 or len(keys) < 4:
+        store.write(closet_id, closet_records(rng, 1, next_key))
+        return next_key + 1
+    key = keys[rng.integers(len(keys))]
+    if op < 0.65:
+        store.remove(closet_id, [key])
+    else:
+        fresh = synthetic_closet(rng, 1)[0]
+        store.update(closet_id, key, {"style": fresh["style"] or "Formal", "dominant_colors": [list(c) for c in fresh["dominant_colors"]]})
+    return next_key
+
+
+def bench_incremental(args):
+    # Property check: after every random edit the incremental top-K equals a full recomputation
+    import app
+    from closet_index import ClosetStore
+    from recommendations import ClosetRecommender
+    rng = np.random.default_rng(args.seed)
+    store = ClosetStore(tempfile.mkdtemp(prefix="smartfit-closets-"))
+    occasions = list(app.OCCASION_MULTIPLIERS)
+    modes = {}
+    for trial in range(args.trials):
+        if trial % 20 == 0:
+            closet_id = f"c{trial}"
+            n = int(rng.integers(4, 25))
+            store.write(closet_id, closet_records(rng, n))
+            recommender = ClosetRecommender(app.OCCASION_MULTIPLIERS, depth=int(rng.integers(5, 60)))
+            next_key = n
+            tone, occasion = "Medium / Olive", occasions[rng.integers(len(occasions))]
+        next_key = edit_closet(rng, store, closet_id, next_key)
+        closet = store.load(closet_id)
+        k = int(rng.integers(1, 25))
+        _, stats = recommender.recommend(closet, tone, occasion, app.closet_combination_sizes(len(closet)), k=k, verify=True)
+        modes[stats["mode"]] = modes.get(stats["mode"], 0) + 1
+        if not stats["verified"]:
+            print(f"FAIL: trial {trial} differs from a full recomputation ({stats})")
+            return 1
+    print(f"parity: {args.trials} random edits identical ({', '.join(f'{m} {c}' for m, c in sorted(modes.items()))})")
+
+    store.write("big", closet_records(rng, args.items))
+    recommender = ClosetRecommender(app.OCCASION_MULTIPLIERS, depth=app.SUGGEST_TOPK_DEPTH)
+    closet = store.load("big")
+    sizes = app.closet_combination_sizes(len(closet))
+    full_t, _ = timed(lambda: outfit_scoring.top_k_outfits(closet.encoded(), "Medium / Olive", "Office",
+                                                             app.OCCASION_MULTIPLIERS, k=20, sizes=sizes), args.repeat)
+    recommender.recommend(closet, "Medium / Olive", "Office", sizes)
+    edit_t, scored, next_key = [], [], args.items
+    for _ in range(args.repeat * 5):
+        next_key = edit_closet(rng, store, "big", next_key)
+        closet = store.load("big")
+        start = time.perf_counter()
+        _, stats = recommender.recommend(closet, "Medium / Olive", "Office", app.closet_combination_sizes(len(closet)))
+        edit_t.append(time.perf_counter() - start)
+        scored.append(stats["scored_combinations"] / stats["total_combinations"])
+    print(f"items={args.items} sizes={list(sizes)} combinations={sum(math.comb(args.items, r) for r in sizes)}")
+    print(f"full recomputation  {full_t * 1000:9.1f} ms")
+    print(f"incremental edit    {np.median(edit_t) * 1000:9.1f} ms median  x{full_t / np.median(edit_t):.1f}  "
+          f"(rescoring {np.mean(scored):.0%} of combinations)")
+    return 0
+
+
+def legacy_analyze_ranking(lists, skin_tone, occasion, k=10):
+    # Full product enumeration, stable sort (the old /analyze loop without its cap)
+    import app
+    scored = []
+    for combo in itertools.product(*[range(len(items)) for items in lists]):
+        score, _ = app.score_outfit([lists[d][i] for d, i in enumerate(combo)], skin_tone, occasion)
+        scored.append((combo, score))
+    return sorted(scored, key=lambda x: x[1], reverse=True)[:k]
+
+
+def search_ranking(lists, skin_tone, occasion, k=10, max_evaluations=None):
+    import app
+    search = outfit_search.OutfitSearch(
+        lists, lambda combo: app.score_outfit(combo, skin_tone, occasion)[0],
+        skin_tone, occasion, app.OCCASION_MULTIPLIERS)
+    return search.run(k=k, max_evaluations=max_evaluations)
+
+
+def bench_search(args):
+    import app
+    rng = np.random.default_rng(args.seed)
+    occasions = list(app.OCCASION_MULTIPLIERS)
+    for trial in range(args.trials):
+        lists = [synthetic_closet(rng, int(rng.integers(1, 5))) for _ in range(int(rng.integers(2, 6)))]
+        occasion = occasions[rng.integers(len(occasions))]
+        k = int(rng.integers(1, 15))
+        found, stats = search_ranking(lists, "Medium / Olive", occasion, k)
+        if found != legacy_analyze_ranking(lists, "Medium / Olive", occasion, k) or not stats["complete"]:
+            print(f"FAIL: trial {trial} differs ({[len(l) for l in lists]}, {occasion}, k={k})")
+            return 1
+    print(f"parity: {args.trials} random product spaces identical")
+
+    lists = [synthetic_closet(rng, args.items) for _ in range(args.categories)]
+    legacy_t, legacy = timed(lambda: legacy_analyze_ranking(lists, "Medium / Olive", "Office"), 1)
+    search_t, (found, stats) = timed(lambda: search_ranking(lists, "Medium / Olive", "Office"), args.repeat)
+    print(f"space={args.items}^{args.categories}={stats['total_candidates']}")
+    print(f"full enumeration    {legacy_t * 1000:9.1f} ms")
+    print(f"branch-and-bound    {search_t * 1000:9.1f} ms  x{legacy_t / search_t:.1f}  "
+          f"evaluated={stats['evaluated']} pruned={stats['pruned_candidates']} ({stats['pruned_subtrees']} subtrees)")
+    if found != legacy:
+        print("FAIL: large space ranking differs")
+        return 1
+    return 0
+
+
+def bench_bg(args):
+    # Needs rembg and the model file; reports images/second per-image vs batched
+    from bg_removal import BackgroundRemover
+    rng = np.random.default_rng(args.seed)
+    images = [synthetic_garment(rng)[..., :3].copy() for _ in range(args.items)]
+    remover = BackgroundRemover(model_name=args.model, batch_size=args.batch_size)
+    start = time.perf_counter()
+    remover.warm_up()
+    print(f"model={args.model} load+warm-up {time.perf_counter() - start:.2f}s batched={remover._batchable}")
+    single_t, single = timed(lambda: [remover.masks([img])[0] for img in images], args.repeat)
+    batch_t, batch = timed(lambda: remover.masks(images), args.repeat)
+    print(f"per image           {args.items / single_t:9.2f} img/s")
+    print(f"batch of {args.batch_size:<3}        {args.items / batch_t:9.2f} img/s")
+    diff = max(int(np.abs(a.astype(int) - b.astype(int)).max()) for a, b in zip(single, batch))
+    print(f"max mask difference {diff}")
+    return 0
+
+
+# ------------------- Suite -------------------
+# Drives the app helpers and the Flask endpoints (test client) on synthetic
+# workloads. Every stage runs one warm-up call, `iterations` timed calls and one
+# extra call under tracemalloc for peak Python/NumPy memory.
+
+def measure(op, iterations):
+    op()
+    latencies = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        op()
+        latencies.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    op()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    ms = np.array(latencies) * 1000
+    return {
+        "iterations": iterations,
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+        "throughput_per_s": float(iterations / max(sum(latencies), 1e-9)),
+        "peak_mem_mb": peak / (1024 * 1024),
+    }
+
+
+def analyze_form(rng, garments):
+    """Multipart form for /analyze with `garments` fresh items spread over categories."""
+    categories = ["shirt", "pants", "shoes", "top", "bottom", "outerwear", "dress", "skirt"]
+    form = {"occasion": "Office"}
+    for i in range(garments):
+        cat = categories[i % len(categories)]
+        bgr = cv2.cvtColor(synthetic_garment(rng, (480, 360))[..., :3], cv2.COLOR_RGB2BGR)
+        form.setdefault(f"file_{cat}", []).append((io.BytesIO(encode(bgr)), f"{cat}_{i}.jpg"))
+    return form
+
+
+def build_suite(args, app):
+    from image_pipeline import ImageFrame
+    from previews import PreviewStore
+
+    rng = np.random.default_rng(args.seed)
+    client = app.app.test_client()
+    garments = [synthetic_garment(rng, (args.image_size, args.image_size * 3 // 4)) for _ in range(8)]
+    frames = [(g[..., :3].copy(), g[..., 3].copy()) for g in garments]
+    face = encode(synthetic_face(rng))
+    closet = synthetic_closet(rng, args.closet)
+    lists = [synthetic_closet(rng, 5) for _ in range(6)]
+    counter = itertools.count()
+
+    def fresh_frame():
+        # New frame each call so lazily derived views (bgr, gray) are not reused
+        rgb, alpha = frames[next(counter) % len(frames)]
+        return ImageFrame(rgb, alpha)
+
+    nobg_paths = []
+    for i, (rgb, alpha) in enumerate(frames[:4]):
+        nobg_paths.append(ImageFrame(rgb, alpha).save_png(os.path.join(app.UPLOAD_FOLDER, f"bench_{i}_nobg.png")))
+
+    def render_preview():
+        store = PreviewStore(tempfile.mkdtemp(dir=app.CACHE_FOLDER), height=app.COMBINED_PREVIEW_MAX_HEIGHT)
+        store.ensure(store.register(nobg_paths))
+
+    def detect_skin():
+        app.skin_detector and app.skin_detector._cache.clear()
+        app.detect_skin_tone_mediapipe(face)
+
+    def post_detect_skin():
+        app.skin_detector and app.skin_detector._cache.clear()
+        client.post("/detect_skin", data={"file_face": (io.BytesIO(face), "face.jpg")},
+                    content_type="multipart/form-data")
+
+    # Fresh uploads for the cold /analyze stage; the warm stage re-posts one set
+    cold_forms = iter([analyze_form(rng, args.garments) for _ in range(args.iterations + 2)])
+    warm_seed = args.seed + 1
+
+    def post_analyze(form):
+        r = client.post("/analyze", data=form, content_type="multipart/form-data")
+        if r.status_code != 200:
+            raise RuntimeError(f"/analyze returned {r.status_code}: {r.get_data(as_text=True)[:200]}")
+        return r.get_json()
+
+    preview = post_analyze(analyze_form(np.random.default_rng(warm_seed), args.garments))["combined_preview"]
+    suggest_payload = {"items": [{**it, "name": f"item{i}", "image": f"/uploads/item{i}.png"}
+                                 for i, it in enumerate(closet)], "occasion": "Office"}
+
+    stages = [
+        ("helper.dominant_colors", lambda: app.get_dominant_colors(fresh_frame())),
+        ("helper.detect_pattern", lambda: app.detect_pattern(fresh_frame())),
+        ("helper.check_image_quality", lambda: app.check_image_quality(fresh_frame())),
+        ("helper.combine_preview", render_preview),
+        ("helper.skin_tone", detect_skin),
+        ("engine.suggest_top_k", lambda: outfit_scoring.top_k_outfits(
+            closet, "Medium / Olive", "Office", app.OCCASION_MULTIPLIERS, k=20)),
+        ("engine.analyze_search", lambda: search_ranking(lists, "Medium / Olive", "Office")),
+        ("endpoint.analyze_cold", lambda: post_analyze(next(cold_forms))),
+        ("endpoint.analyze_warm", lambda: post_analyze(analyze_form(np.random.default_rng(warm_seed), args.garments))),
+        ("endpoint.suggest_outfit", lambda: client.post("/suggest_outfit", json=suggest_payload)),
+        ("endpoint.detect_skin", post_detect_skin),
+        ("endpoint.preview", lambda: client.get(f"/uploads/{preview}")),
+    ]
+    if app.REMBG_AVAILABLE:
+        stages.insert(4, ("helper.remove_bg", lambda: app.remove_bg(fresh_frame())))
+    return stages
+
+
+def compare(results, baseline, metric, threshold):
+    """Prints per-stage change vs a baseline; returns the stages slower than allowed."""
+    regressions = []
+    print(f"\n{'stage':28} {'baseline':>10} {'current':>10} {'change':>8}   ({metric})")
+    for name, cur in results.items():
+        base = baseline.get("stages", {}).get(name)
+        if base is None:
+            print(f"{name:28} {'-':>10} {cur[metric]:10.2f}      new")
+            continue
+        change = cur[metric] / max(base[metric], 1e-9) - 1
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"{name:28} {base[metric]:10.2f} {cur[metric]:10.2f} {change:+7.0%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def bench_suite(args):
+    # The app creates uploads/ and cache/ in the working directory
+    workdir = args.workdir or tempfile.mkdtemp(prefix="smartfit-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    os.environ.setdefault("REMBG_WARMUP", "0")
+    import app
+    if app.REMBG_AVAILABLE:
+        try:
+            app.bg_remover.warm_up()
+        except Exception as e:
+            print(f"rembg unavailable ({type(e).__name__}), background removal disabled for this run")
+            app.REMBG_AVAILABLE = False
+    # Measure warm models only: let the background warm-up finish first
+    deadline = time.time() + 120
+    while not app.startup.ready and time.time() < deadline:
+        time.sleep(0.05)
+
+    results = {}
+    print(f"workdir={workdir} garments={args.garments} closet={args.closet} iterations={args.iterations}")
+    print(f"{'stage':28} {'p50':>9} {'p90':>9} {'p99':>9} {'ops/s':>9} {'peak MB':>8}")
+    for name, op in build_suite(args, app):
+        if args.only and not any(name.startswith(prefix) for prefix in args.only.split(",")):
+            continue
+        r = results[name] = measure(op, args.iterations)
+        print(f"{name:28} {r['p50_ms']:9.2f} {r['p90_ms']:9.2f} {r['p99_ms']:9.2f} "
+              f"{r['throughput_per_s']:9.1f} {r['peak_mem_mb']:8.1f}")
+
+    report = {
+        "created_at": time.time(),
+        "config": {k: getattr(args, k) for k in ("garments", "closet", "iterations", "image_size", "seed")},
+        "rembg": app.REMBG_AVAILABLE,
+        "stages": results,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"baseline saved to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        if baseline.get("config") != report["config"]:
+            print(f"WARNING: baseline config {baseline.get('config')} differs from this run")
+        regressions = compare(results, baseline, args.metric, args.threshold)
+        if regressions:
+            print(f"FAIL: {len(regressions)} stage(s) regressed more than {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+def bench_pattern(args):
+    rng = np.random.default_rng(args.seed)
+    size = (args.image_size, args.image_size * 3 // 4)
+    samples = [(kind, *synthetic_patterned_garment(rng, kind, size))
+               for kind in PATTERN_KINDS for _ in range(max(1, args.items // len(PATTERN_KINDS)))]
+
+    legacy_t, legacy = timed(lambda: [legacy_detect_pattern(rgb, a) for _, rgb, a in samples], args.repeat)
+    engine_t, engine = timed(lambda: [pattern_engine.analyze(rgb, a) for _, rgb, a in samples], args.repeat)
+
+    truth = [kind for kind, _, _ in samples]
+    binary = ["Solid" if kind == "solid" else "Patterned" for kind in truth]
+    legacy_acc = np.mean([a == b for a, b in zip(legacy, binary)])
+    engine_binary = np.mean([("Solid" if r["label"] == "solid" else "Patterned") == b for r, b in zip(engine, binary)])
+    engine_acc = np.mean([r["label"] == k for r, k in zip(engine, truth)])
+    print(f"images={len(samples)} size={size[1]}x{size[0]}")
+    print(f"Canny + HoughLines  {legacy_t * 1000 / len(samples):9.2f} ms/img  solid-vs-patterned accuracy {legacy_acc:.0%}")
+    print(f"pattern engine      {engine_t * 1000 / len(samples):9.2f} ms/img  solid-vs-patterned accuracy {engine_binary:.0%}  "
+          f"x{legacy_t / engine_t:.1f}")
+    print(f"4-way accuracy {engine_acc:.0%}")
+    for kind in PATTERN_KINDS:
+        got = [r["label"] for r, k in zip(engine, truth) if k == kind]
+        print(f"  {kind:8} -> " + ", ".join(f"{label} {got.count(label)}" for label in sorted(set(got))))
+    if engine_acc < args.min_accuracy:
+        print(f"FAIL: 4-way accuracy below {args.min_accuracy:.0%}")
+        return 1
+    return 0
+
+
+def analyze_frame(frame):
+    # The resolution-dependent part of the item pipeline (everything but rembg)
+    gray = frame.gray
+    blur = float(np.var(cv2.Laplacian(gray, cv2.CV_64F)))
+    colors = color_engine.dominant_colors(frame.rgba)
+    pattern = pattern_engine.analyze(frame.rgb, frame.alpha)["label"]
+    cv2.imencode(".png", frame.rgba)
+    return colors, pattern, blur
+
+
+def bench_decode(args):
+    from image_pipeline import ImageFrame
+    rng = np.random.default_rng(args.seed)
+    size = (args.image_size * 3 // 4, args.image_size)
+    uploads = [encode(synthetic_photo(rng, size)) for _ in range(args.items)]
+    print(f"images={len(uploads)} size={size[1]}x{size[0]} jpeg={np.mean([len(u) for u in uploads]) / 1e6:.1f} MB "
+          f"max_edge={args.max_edge}")
+
+    paths = {"full decode": None, "normalized": args.max_edge}
+    results = {}
+    for label, max_edge in paths.items():
+        decode = measure(lambda: [ImageFrame.from_bytes(u, max_edge) for u in uploads], args.repeat)
+        pipeline = measure(lambda: [analyze_frame(ImageFrame.from_bytes(u, max_edge)) for u in uploads], args.repeat)
+        results[label] = [analyze_frame(ImageFrame.from_bytes(u, max_edge)) for u in uploads]
+        print(f"{label:12} decode {decode['p50_ms'] / len(uploads):8.1f} ms/img  peak {decode['peak_mem_mb'] / len(uploads):7.1f} MB/img  "
+              f"| decode+analysis {pipeline['p50_ms'] / len(uploads):8.1f} ms/img  peak {pipeline['peak_mem_mb']:7.1f} MB")
+
+    full, small = results["full decode"], results["normalized"]
+    # Reduced decoding vs resizing a full decode, at the palette tolerance of the colors stage
+    resized = [analyze_frame(ImageFrame.from_bytes(u).fit(args.max_edge)) for u in uploads]
+    decoder_de = [matched_delta_e(a[0], b[0]) for a, b in zip(resized, small)]
+    decoder_pattern = np.mean([a[1] == b[1] for a, b in zip(resized, small)])
+    print(f"normalized vs resized full decode: dominant colors median dE {np.median(decoder_de):.2f} "
+          f"(max {max(decoder_de):.2f})  pattern agreement {decoder_pattern:.0%}")
+    resolution_de = [matched_delta_e(a[0], b[0]) for a, b in zip(full, small)]
+    print(f"{args.max_edge}px vs full resolution: dominant colors median dE {np.median(resolution_de):.2f} "
+          f"(max {max(resolution_de):.2f})  pattern agreement {np.mean([a[1] == b[1] for a, b in zip(full, small)]):.0%}")
+    # A 3-color palette of a 4-color photo can settle on a different third color when
+    # two are nearly tied, whether the pixels change by resizing or by decoding, so the
+    # max above is not gated. Instead, how well each palette fits the full-resolution
+    # pixels: on average reduced decoding may not cost more than the tolerance on top
+    # of what resizing does
+    full_pixels = [ImageFrame.from_bytes(u).rgba for u in uploads]
+    fit = lambda runs: np.array([palette_fit(img, r[0]) - palette_fit(img, f[0])
+                                 for img, r, f in zip(full_pixels, runs, full)])
+    resize_fit, decoder_fit = fit(resized), fit(small)
+    fit_cost = decoder_fit.mean() - resize_fit.mean()
+    print(f"palette fit vs full resolution, excess dE mean/worst: resized full decode {resize_fit.mean():.2f}/"
+          f"{resize_fit.max():.2f}  normalized {decoder_fit.mean():.2f}/{decoder_fit.max():.2f}")
+    print(f"Laplacian variance  full median {np.median([a[2] for a in full]):.1f}  "
+          f"normalized median {np.median([b[2] for b in small]):.1f}")
+
+    # Reduced decoding must still apply EXIF orientation
+    rotated = with_exif_orientation(uploads[0], 6)
+    upright = ImageFrame.from_bytes(rotated)
+    reduced = ImageFrame.from_bytes(rotated, args.max_edge)
+    orientation_ok = (upright.shape[0] > upright.shape[1]) == (reduced.shape[0] > reduced.shape[1])
+    print(f"EXIF orientation {'applied' if orientation_ok else 'LOST'}: full {upright.shape} -> normalized "
+          f"{reduced.shape}, source {reduced.source_shape}")
+    if (np.median(decoder_de) > args.max_delta_e or fit_cost > args.max_delta_e
+            or decoder_pattern < 1 or not orientation_ok):
+        print("FAIL: normalized decoding changed the analysis")
+        return 1
+    return 0
+
+
+def process_memory(pid):
+    """(PSS, USS) in MB from /proc/<pid>/smaps_rollup."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r", encoding="utf-8") as fh:
+        for line in fh:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return fields["Pss"] / 1024, (fields["Private_Clean"] + fields["Private_Dirty"]) / 1024
+
+
+def serve_and_measure(args, preload, port, workdir):
+    """Starts gunicorn, sends a few /analyze requests, returns (master, workers) memory."""
+    from urllib import request as urlrequest
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, WEB_CONCURRENCY=str(args.workers), BIND=f"127.0.0.1:{port}",
+               GUNICORN_PRELOAD="1" if preload else "0", PYTHONPATH=here)
+    proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", os.path.join(here, "gunicorn.conf.py"),
+                             "--chdir", workdir, "app:app"],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 300
+        while True:
+            try:
+                urlrequest.urlopen(f"http://127.0.0.1:{port}/cache/stats", timeout=5).read()
+                break
+            except OSError:
+                if proc.poll() is not None or time.time() > deadline:
+                    raise RuntimeError("gunicorn did not start")
+                time.sleep(0.5)
+        rng = np.random.default_rng(args.seed)
+        for _ in range(args.workers * 2):
+            boundary = "smartfitbench"
+            body = io.BytesIO()
+            for name, value in analyze_form(rng, args.garments).items():
+                if not isinstance(value, list):
+                    body.write(f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode())
+                    continue
+                for fh, filename in value:
+                    body.write(f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"; filename=\"{filename}\"\r\n"
+                               f"Content-Type: image/jpeg\r\n\r\n".encode() + fh.getvalue() + b"\r\n")
+            body.write(f"--{boundary}--\r\n".encode())
+            req = urlrequest.Request(f"http://127.0.0.1:{port}/analyze", data=body.getvalue(),
+                                     headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+            urlrequest.urlopen(req, timeout=300).read()
+        with open(f"/proc/{proc.pid}/task/{proc.pid}/children", "r", encoding="utf-8") as fh:
+            children = [int(p) for p in fh.read().split()]
+        return process_memory(proc.pid), [process_memory(p) for p in children]
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=60)
+
+
+def bench_workers(args):
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        print("workers stage needs Linux /proc/<pid>/smaps_rollup")
+        return 1
+    results = {}
+    for preload in (False, True):
+        workdir = tempfile.mkdtemp(prefix="smartfit-workers-")
+        (master_pss, _), workers = serve_and_measure(args, preload, args.port, workdir)
+        total = master_pss + sum(pss for pss, _ in workers)
+        uss = [u for _, u in workers]
+        results[preload] = total
+        print(f"{'preload' if preload else 'no preload':10}  workers={len(workers)}  total PSS {total:8.1f} MB  "
+              f"per-worker USS {np.mean(uss):7.1f} MB (max {max(uss):.1f})")
+    print(f"preload saves {results[False] - results[True]:.1f} MB ({1 - results[True] / results[False]:.0%})")
+    return 0
+
+
+def bench_storage(args):
+    # Artifact lookups in one flat folder vs the sharded layout, and the cost of a reaper pass
+    from storage import UploadStore
+    rng = np.random.default_rng(args.seed)
+    names = [f"item_{i}_{rng.integers(1 << 40):x}_nobg.png" for i in range(args.files)]
+    flat = tempfile.mkdtemp(prefix="smartfit-flat-")
+    sharded = UploadStore(tempfile.mkdtemp(prefix="smartfit-sharded-"), ttl_sec=86400, max_bytes=1 << 40)
+    now = time.time()
+    for i, name in enumerate(names):
+        for path in (os.path.join(flat, name), sharded.path_for(name)):
+            with open(path, "wb") as fh:
+                fh.write(b"\0" * 64)
+            # Half the files were last used two days ago
+            used = now - (2 * 86400 if i % 2 else 60)
+            os.utime(path, (used, used))
+    probe = [names[i] for i in rng.integers(len(names), size=2000)]
+    flat_t, _ = timed(lambda: [os.path.isfile(os.path.join(flat, n)) for n in probe], args.repeat)
+    sharded_t, _ = timed(lambda: [sharded.resolve(n) for n in probe], args.repeat)
+    list_t, _ = timed(lambda: os.listdir(flat), args.repeat)
+    print(f"files={args.files}  largest directory: flat {args.files}, sharded "
+          f"{max(len(os.listdir(os.path.join(sharded.root, d))) for d in os.listdir(sharded.root) if not d.startswith('.'))}")
+    print(f"lookup  flat {flat_t * 1e6 / len(probe):6.1f} us  sharded {sharded_t * 1e6 / len(probe):6.1f} us  "
+          f"(flat directory listing {list_t * 1000:.1f} ms)")
+    t0 = time.perf_counter()
+    summary = sharded.reap(now=now)
+    print(f"reaper pass {(time.perf_counter() - t0) * 1000:.1f} ms  reclaimed {summary['reclaimed_files']['ttl']} "
+          f"expired files, {summary['files']} left")
+    if summary["reclaimed_files"]["ttl"] != args.files // 2 or summary["files"] != args.files - args.files // 2:
+        print("FAIL: reaper did not delete exactly the expired files")
+        return 1
+    return 0
+
+
+STARTUP_PROBE = """
+import json, sys, time
+t0 = time.time()
+import app
+imported = time.time() - t0
+while not app.startup.ready:
+    time.sleep(0.01)
+print(json.dumps({"import_sec": imported, "ready_sec": time.time() - t0, "steps": app.startup.report()["steps"]}))
+"""
+
+
+def bench_startup(args):
+    """Fresh-process time until the app serves (import) and until models are warm (ready)."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=here)
+    runs = []
+    for _ in range(args.repeat):
+        out = subprocess.run([sys.executable, "-c", STARTUP_PROBE], cwd=tempfile.mkdtemp(prefix="smartfit-startup-"),
+                             env=env, capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+    import_sec = [r["import_sec"] for r in runs]
+    ready_sec = [r["ready_sec"] for r in runs]
+    print(f"runs={len(runs)}")
+    print(f"serving (import app)  median {np.median(import_sec):6.2f}s  max {max(import_sec):6.2f}s")
+    print(f"ready (models warm)   median {np.median(ready_sec):6.2f}s  max {max(ready_sec):6.2f}s")
+    for name, step in runs[-1]["steps"].items():
+        print(f"  {name:12} {step['seconds']}s {step['status']}")
+    return 0
+
+
+STAGES = {
+    "incremental": bench_incremental,
+    "tables": bench_tables,
+    "startup": bench_startup,
+    "storage": bench_storage,
+    "workers": bench_workers,
+    "pattern": bench_pattern,
+    "decode": bench_decode,
+    "colors": bench_colors,
+    "scoring": bench_scoring,
+    "search": bench_search,
+    "bg": bench_bg,
+    "suite": bench_suite,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SmartFit ML service benchmarks")
+    parser.add_argument("stage", choices=sorted(STAGES))
+    parser.add_argument("--items", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trials", type=int, default=200)
+    parser.add_argument("--categories", type=int, default=8)
+    parser.add_argument("--model", default="u2net")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--max-delta-e", type=float, default=3.0)
+    parser.add_argument("--workers", type=int, default=4, help="workers stage: gunicorn worker processes")
+    parser.add_argument("--files", type=int, default=20000, help="storage stage: stored upload files")
+    parser.add_argument("--port", type=int, default=5099, help="workers stage: port for the test server")
+    parser.add_argument("--max-edge", type=int, default=512, help="decode stage: long edge uploads are normalized to")
+    parser.add_argument("--min-accuracy", type=float, default=0.85, help="pattern stage: minimum 4-way accuracy")
+    # suite options
+    parser.add_argument("--garments", type=int, default=8, help="garments per /analyze request")
+    parser.add_argument("--closet", type=int, default=30, help="items per /suggest_outfit payload")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--image-size", type=int, default=900, help="long edge of synthetic garments")
+    parser.add_argument("--only", help="comma-separated stage name prefixes, e.g. helper.,endpoint.analyze")
+    parser.add_argument("--workdir", help="directory for uploads/ and cache/ (default: a new temp dir)")
+    parser.add_argument("--save-baseline", help="write results as a JSON baseline")
+    parser.add_argument("--baseline", help="compare against a saved baseline and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = +25%%")
+    parser.add_argument("--metric", default="p50_ms", choices=["mean_ms", "p50_ms", "p90_ms", "p99_ms"])
+    args = parser.parse_args(argv)
+    return STAGES[args.stage](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
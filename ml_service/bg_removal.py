@@ -0,0 +1,167 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+from PIL import Image
+
+# ------------------- Background removal -------------------
+# Owns the rembg ONNX session for this worker process: it is created once (at
+# startup via warm_up, or on first use), shared by every analysis thread, and
+# returns alpha masks as arrays instead of re-encoded PNG bytes. Masks requested
+# concurrently by the analysis pool are micro-batched into a single inference
+# call for models whose ONNX graph accepts a dynamic batch dimension.
+# With intra_op_threads=1 the session owns no thread pool, so it can be loaded
+# in a preforking server's master and shared copy-on-write by every worker.
+# Each inference then runs on a single core, and a single batching thread would
+# serialize every mask in the worker; several dispatchers pull batches from the
+# same queue so inferences overlap (at the cost of smaller batches).
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+# model name -> (mean, std, input size) for models using rembg's U2net-style
+# normalize/predict pipeline; other models fall back to session.predict per image.
+# The DIS models (isnet-*) are left out: their normalization constants have
+# changed between rembg releases, so only rembg's own predict is guaranteed to match.
+BATCHABLE_MODELS = {
+    "u2net": (IMAGENET_MEAN, IMAGENET_STD, (320, 320)),
+    "u2netp": (IMAGENET_MEAN, IMAGENET_STD, (320, 320)),
+    "u2net_human_seg": (IMAGENET_MEAN, IMAGENET_STD, (320, 320)),
+    "silueta": (IMAGENET_MEAN, IMAGENET_STD, (320, 320)),
+}
+
+
+class BackgroundRemover:
+    def __init__(self, model_name="u2net", batch_size=4, batch_wait_ms=15, providers=None, intra_op_threads=0,
+                 dispatchers=1):
+        self.model_name = model_name
+        self.intra_op_threads = intra_op_threads  # 0 = onnxruntime default (one thread per core)
+        self.batch_size = max(1, batch_size)
+        self.dispatchers = max(1, dispatchers)
+        self.batch_wait = batch_wait_ms / 1000.0
+        self.providers = providers
+        self.load_seconds = None
+        self._session = None
+        self._batchable = False
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._dispatcher_pid = None
+
+    @property
+    def loaded(self):
+        return self._session is not None
+
+    def load(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    from rembg import new_session
+                    start = time.time()
+                    kwargs = {"providers": self.providers} if self.providers else {}
+                    if self.intra_op_threads:
+                        import onnxruntime as ort
+                        opts = ort.SessionOptions()
+                        opts.intra_op_num_threads = self.intra_op_threads
+                        opts.inter_op_num_threads = 1
+                        kwargs["sess_opts"] = opts
+                    session = new_session(self.model_name, **kwargs)
+                    self._batchable = self.model_name in BATCHABLE_MODELS and self._dynamic_batch(session)
+                    self._session = session
+                    self.load_seconds = time.time() - start
+                    logging.info(f"rembg session '{self.model_name}' loaded in {self.load_seconds:.2f}s "
+                                 f"(batched inference {'on' if self._batchable else 'off'})")
+        return self._session
+
+    @staticmethod
+    def _dynamic_batch(session):
+        try:
+            dim = session.inner_session.get_inputs()[0].shape[0]
+        except Exception:
+            return False
+        return not isinstance(dim, int)
+
+    def warm_up(self):
+        """Loads the session and runs one tiny inference so the first request is not slow."""
+        self.load()
+        self.masks([np.full((64, 64, 3), 127, dtype=np.uint8)])
+
+    def masks(self, rgb_images):
+        """rgb_images: list of HxWx3 uint8 arrays. Returns one HxW uint8 alpha mask per image."""
+        session = self.load()
+        if self._batchable and len(rgb_images) > 1:
+            results = []
+            for start in range(0, len(rgb_images), self.batch_size):
+                results.extend(self._predict_batch(session, rgb_images[start:start + self.batch_size]))
+            return results
+        return [self._predict_single(session, rgb) for rgb in rgb_images]
+
+    def _predict_single(self, session, rgb):
+        if self._batchable:
+            return self._predict_batch(session, [rgb])[0]
+        masks = session.predict(Image.fromarray(rgb))
+        # Multi-mask models (e.g. cloth segmentation) are merged into one garment mask
+        merged = np.max(np.stack([np.asarray(m.convert("L")) for m in masks]), axis=0)
+        return merged.astype(np.uint8)
+
+    def _predict_batch(self, session, rgb_images):
+        mean, std, size = BATCHABLE_MODELS[self.model_name]
+        inputs = [session.normalize(Image.fromarray(rgb), mean, std, size) for rgb in rgb_images]
+        name = next(iter(inputs[0]))
+        batch = np.concatenate([inp[name] for inp in inputs], axis=0)
+        preds = session.inner_session.run(None, {name: batch})[0][:, 0, :, :]
+        results = []
+        for pred, rgb in zip(preds, rgb_images):
+            # Same post-processing as rembg's U2net predict, per image
+            ma, mi = np.max(pred), np.min(pred)
+            pred = (pred - mi) / max(ma - mi, 1e-12)
+            mask = Image.fromarray((pred.clip(0, 1) * 255).astype("uint8"), mode="L")
+            mask = mask.resize((rgb.shape[1], rgb.shape[0]), Image.Resampling.LANCZOS)
+            results.append(np.asarray(mask))
+        return results
+
+    def mask(self, rgb):
+        """
+        Alpha mask for one image. Concurrent callers are grouped into batches of up
+        to batch_size, waiting at most batch_wait_ms for a batch to fill.
+        """
+        if self.batch_size <= 1 or not self._batchable:
+            return self.masks([rgb])[0]
+        fut = Future()
+        self._ensure_dispatcher()
+        self._queue.put((rgb, fut))
+        return fut.result()
+
+    def _ensure_dispatcher(self):
+        # Threads do not survive fork, so a forked worker starts its own dispatchers
+        if self._dispatcher_pid != os.getpid():
+            with self._lock:
+                if self._dispatcher_pid != os.getpid():
+                    self._queue = queue.Queue()
+                    for i in range(self.dispatchers):
+                        threading.Thread(target=self._dispatch_loop, args=(self._queue,),
+                                         name=f"rembg-batcher-{i}", daemon=True).start()
+                    self._dispatcher_pid = os.getpid()
+
+    def _dispatch_loop(self, pending):
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                masks = self.masks([rgb for rgb, _ in batch])
+                for (_, fut), m in zip(batch, masks):
+                    fut.set_result(m)
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
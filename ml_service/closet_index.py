@@ -0,0 +1,322 @@
+import os
+import re
+import json
+import time
+import uuid
+import glob
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # no flock (Windows): writes are only serialized within a process
+    fcntl = None
+
+import numpy as np
+
+from outfit_scoring import EncodedItems
+
+# ------------------- Closet item index -------------------
+# A closet is a directory holding one .npy file per numeric column (style,
+# pattern and category codes, dominant colors) plus meta.json with the string
+# vocabularies and per-item display fields. Columns are loaded memory-mapped, so
+# /suggest_outfit reads a closet without re-sending or re-normalizing its items.
+# Every write produces a new, uniquely named generation of column files and then
+# atomically swaps meta.json, so readers never see a half-written index. Writers
+# hold a per-closet file lock around the whole read-modify-write, so concurrent
+# writes from different worker processes do not lose each other's items.
+# Deleting a closet removes everything but that lock file, so a writer waiting
+# on it still serializes with the next one.
+
+CLOSET_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+MAX_COLORS = 3
+COLUMNS = ("style", "pattern", "category", "colors", "color_count")
+LOCK_NAME = ".write.lock"
+
+
+class ClosetIndex:
+    def __init__(self, closet_id, path, meta, columns):
+        self.closet_id = closet_id
+        self.path = path
+        self.meta = meta
+        self.generation = meta["generation"]
+        self.items = meta["items"]  # display fields: key, name, image, filename, pattern_detail, warnings
+        self.styles = meta["styles"]
+        self.patterns = meta["patterns"]
+        self.categories = meta["categories"]
+        self.style = columns["style"]
+        self.pattern = columns["pattern"]
+        self.category = columns["category"]
+        self.colors = columns["colors"]
+        self.color_count = columns["color_count"]
+        self._encoded = None
+        self._fingerprints = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def dominant_colors(self, i):
+        return self.colors[i, :int(self.color_count[i])].tolist()
+
+    def item(self, i):
+        """Item i in the dict shape used by score_outfit and /suggest_outfit."""
+        return {
+            **self.items[i],
+            "category": self.categories[self.category[i]],
+            "style": self.styles[self.style[i]],
+            "pattern": self.patterns[self.pattern[i]],
+            "dominant_colors": self.dominant_colors(i),
+        }
+
+    def records(self):
+        return [self.item(i) for i in range(len(self))]
+
+    def encoded(self):
+        """EncodedItems for the vectorized scorer, built directly from the columns."""
+        if self._encoded is None:
+            self._encoded = EncodedItems.from_columns(
+                self.styles, self.style, self.patterns, self.pattern,
+                self.colors[:, 0, :], self.color_count > 0,
+            )
+        return self._encoded
+
+    def fingerprints(self):
+        """Per item, the fields outfit scores depend on; a changed fingerprint means rescoring."""
+        if self._fingerprints is None:
+            self._fingerprints = [
+                f"{self.styles[self.style[i]]}|{self.patterns[self.pattern[i]]}|"
+                f"{self.colors[i, 0].tolist() if self.color_count[i] else ''}"
+                for i in range(len(self))
+            ]
+        return self._fingerprints
+
+    def summary(self):
+        counts = np.bincount(np.asarray(self.category, dtype=np.int64), minlength=len(self.categories))
+        return {
+            "closet_id": self.closet_id,
+            "generation": self.generation,
+            "analysis_version": self.meta.get("analysis_version"),
+            "item_count": len(self),
+            "categories": {c: int(n) for c, n in zip(self.categories, counts) if n},
+            "updated_at": self.meta.get("updated_at"),
+        }
+
+
+def _vocab_codes(values):
+    vocab = sorted(set(values))
+    lookup = {v: i for i, v in enumerate(vocab)}
+    return vocab, np.array([lookup[v] for v in values], dtype=np.int16)
+
+
+class ClosetStore:
+    def __init__(self, root, analysis_version=None, cache_size=256):
+        self.root = root
+        self.analysis_version = analysis_version
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._write_locks = {}  # closet_id -> [lock, holders]; dropped when the last holder leaves
+        self._loaded = OrderedDict()  # closet_id -> ClosetIndex in LRU order (reloaded when meta.json changes)
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, closet_id):
+        if not CLOSET_ID_RE.match(closet_id or ""):
+            raise ValueError(f"Invalid closet id: {closet_id!r}")
+        return os.path.join(self.root, closet_id)
+
+    def load(self, closet_id, mmap_mode="r"):
+        """The closet's current index, or None if it was never written."""
+        path = self.path(closet_id)
+        meta_path = os.path.join(path, "meta.json")
+        for attempt in range(3):
+            try:
+                with open(meta_path, "r", encoding="utf-8") as fh:
+                    meta = json.load(fh)
+            except FileNotFoundError:
+                with self._lock:
+                    self._loaded.pop(closet_id, None)
+                return None
+            with self._lock:
+                cached = self._loaded.get(closet_id)
+                if cached is not None and cached.generation == meta["generation"]:
+                    self._loaded.move_to_end(closet_id)
+                    return cached
+            gen = meta["generation"]
+            try:
+                columns = {name: np.load(os.path.join(path, f"{name}.{gen}.npy"), mmap_mode=mmap_mode) for name in COLUMNS}
+                break
+            except FileNotFoundError:
+                # A concurrent write replaced this generation between the two reads
+                if attempt == 2:
+                    raise
+        index = ClosetIndex(closet_id, path, meta, columns)
+        with self._lock:
+            self._loaded[closet_id] = index
+            self._loaded.move_to_end(closet_id)
+            while len(self._loaded) > self.cache_size:
+                self._loaded.popitem(last=False)
+        return index
+
+    def meta_paths(self):
+        """meta.json path of every closet directory (the file may be missing)."""
+        return [os.path.join(self.root, closet_id, "meta.json") for closet_id in os.listdir(self.root)]
+
+    @staticmethod
+    def image_names(meta_path):
+        """Upload filenames shown by a closet's items (kept by the upload reaper)."""
+        try:
+            with open(meta_path, "r", encoding="utf-8") as fh:
+                items = json.load(fh)["items"]
+        except (OSError, ValueError, KeyError):
+            return set()
+        return {os.path.basename(it.get("image") or "") for it in items} - {""}
+
+    @contextmanager
+    def _write_lock(self, closet_id):
+        """Serializes writers of one closet across threads and processes."""
+        path = self.path(closet_id)
+        with self._lock:
+            entry = self._write_locks.setdefault(closet_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                if fcntl is None:
+                    yield
+                    return
+                os.makedirs(path, exist_ok=True)
+                with open(os.path.join(path, LOCK_NAME), "a") as fh:
+                    fcntl.flock(fh, fcntl.LOCK_EX)
+                    try:
+                        yield
+                    finally:
+                        fcntl.flock(fh, fcntl.LOCK_UN)
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._write_locks[closet_id]
+
+    def write(self, closet_id, records, replace=False):
+        """
+        Adds analyzed item records (dicts with key, name, image, filename, category,
+        style, pattern, dominant_colors, warnings) to the closet, skipping keys it
+        already holds, or replaces its contents. Returns (index, added count).
+        """
+        path = self.path(closet_id)
+        with self._write_lock(closet_id):
+            current = None if replace else self.load(closet_id)
+            existing = current.records() if current is not None else []
+            seen = {r["key"] for r in existing}
+            merged = list(existing)
+            for r in records:
+                if r["key"] not in seen:
+                    seen.add(r["key"])
+                    merged.append(r)
+            added = len(merged) - len(existing)
+            if added or replace or current is None:
+                self._write_generation(closet_id, path, merged)
+        return self.load(closet_id), added
+
+    def remove(self, closet_id, keys):
+        """Drops the items with these keys. Returns (index, removed count); index is None if unknown."""
+        keys = set(keys)
+        with self._write_lock(closet_id):
+            current = self.load(closet_id)
+            if current is None:
+                return None, 0
+            kept = [r for r in current.records() if r["key"] not in keys]
+            removed = len(current) - len(kept)
+            if removed:
+                self._write_generation(closet_id, current.path, kept)
+        return self.load(closet_id), removed
+
+    def delete(self, closet_id):
+        """Removes the closet's index and stored recommendations. Returns False if it did not exist."""
+        path = self.path(closet_id)
+        with self._write_lock(closet_id):
+            try:
+                os.remove(os.path.join(path, "meta.json"))  # readers see the closet gone from here on
+                existed = True
+            except FileNotFoundError:
+                existed = False
+            for dirpath, dirnames, filenames in os.walk(path, topdown=False):
+                for name in filenames:
+                    if dirpath != path or name != LOCK_NAME:
+                        try:
+                            os.remove(os.path.join(dirpath, name))
+                        except OSError as e:
+                            logging.warning(f"Could not remove closet file {os.path.join(dirpath, name)}: {e}")
+                if dirpath != path:
+                    try:
+                        os.rmdir(dirpath)
+                    except OSError:
+                        pass
+            with self._lock:
+                self._loaded.pop(closet_id, None)
+        return existed
+
+    def update(self, closet_id, key, fields):
+        """
+        Changes fields (name, category, style, pattern, dominant_colors) of one item
+        in place. Returns (index, updated); index is None if the closet is unknown.
+        """
+        with self._write_lock(closet_id):
+            current = self.load(closet_id)
+            if current is None:
+                return None, False
+            records = current.records()
+            for r in records:
+                if r["key"] == key:
+                    changed = {k: v for k, v in fields.items() if r.get(k) != v}
+                    if changed:
+                        r.update(changed)
+                        self._write_generation(closet_id, current.path, records)
+                    break
+            else:
+                return current, False
+        return self.load(closet_id), True
+
+    def _write_generation(self, closet_id, path, records):
+        os.makedirs(path, exist_ok=True)
+        # Unique even for writes within the same millisecond, so no file is ever overwritten
+        gen = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:12]}"
+        styles, style = _vocab_codes([r["style"] for r in records])
+        patterns, pattern = _vocab_codes([r["pattern"] for r in records])
+        categories, category = _vocab_codes([r["category"] for r in records])
+        colors = np.full((len(records), MAX_COLORS, 3), -1, dtype=np.int16)
+        color_count = np.zeros(len(records), dtype=np.int8)
+        for i, r in enumerate(records):
+            dc = (r.get("dominant_colors") or [])[:MAX_COLORS]
+            if dc:
+                colors[i, :len(dc)] = np.asarray(dc, dtype=np.int16)
+            color_count[i] = len(dc)
+        for name, column in (("style", style), ("pattern", pattern), ("category", category),
+                             ("colors", colors), ("color_count", color_count)):
+            np.save(os.path.join(path, f"{name}.{gen}.npy"), column)
+
+        meta = {
+            "closet_id": closet_id,
+            "generation": gen,
+            "analysis_version": self.analysis_version,
+            "updated_at": time.time(),
+            "styles": styles,
+            "patterns": patterns,
+            "categories": categories,
+            "items": [{k: r.get(k) for k in ("key", "name", "image", "filename", "pattern_detail", "warnings")} for r in records],
+        }
+        tmp = os.path.join(path, f"meta.json.{gen}.tmp")
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(meta, fh)
+        os.replace(tmp, os.path.join(path, "meta.json"))
+
+        # Older generations can go: readers that still map them keep their inode. The
+        # generation meta.json names is never deleted, whoever wrote it
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as fh:
+            keep = {gen, json.load(fh)["generation"]}
+        for old in glob.glob(os.path.join(path, "*.npy")):
+            if os.path.basename(old).split(".")[1] not in keep:
+                try:
+                    os.remove(old)
+                except OSError as e:
+                    logging.warning(f"Could not remove old closet column {old}: {e}")
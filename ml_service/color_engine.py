@@ -0,0 +1,124 @@
+import numpy as np
+
+# ------------------- Dominant color engine -------------------
+# Replaces per-image sklearn KMeans. Pixels are downsampled with a single strided
+# pass, transparent (background) pixels from the _nobg output are dropped, and the
+# remainder is collapsed into a 32x32x32 color histogram. A weighted Lloyd
+# k-means then runs on the (few thousand) occupied bins instead of on raw pixels,
+# vectorized across every image of the batch at once.
+
+MAX_SAMPLE_PIXELS = 200 * 200
+HIST_BITS = 5
+ALPHA_THRESHOLD = 128
+MIN_FOREGROUND_FRACTION = 0.01
+LLOYD_ITERATIONS = 8
+
+_SHIFT = 8 - HIST_BITS
+_NBINS = 1 << (3 * HIST_BITS)
+
+
+def sample_pixels(image, max_pixels=MAX_SAMPLE_PIXELS):
+    """
+    image: HxWx3 RGB or HxWx4 RGBA uint8 array. Returns an Nx3 uint8 array of
+    foreground pixels, downsampled so that N <= max_pixels.
+    """
+    if image is None or image.size == 0:
+        return np.empty((0, 3), dtype=np.uint8)
+    h, w = image.shape[:2]
+    step = int(np.ceil(np.sqrt(h * w / float(max_pixels)))) if h * w > max_pixels else 1
+    small = image[::step, ::step]
+    if small.shape[2] == 4:
+        opaque = small[..., 3] >= ALPHA_THRESHOLD
+        # Images without a usable alpha channel are analyzed as a whole
+        if opaque.mean() >= MIN_FOREGROUND_FRACTION:
+            return small[..., :3][opaque]
+        return small[..., :3].reshape(-1, 3)
+    return small.reshape(-1, 3)
+
+
+def _histogram(pixel_sets):
+    # One bincount over all images: bin ids are offset per image
+    ids = []
+    for b, px in enumerate(pixel_sets):
+        px = px.astype(np.int64)
+        ids.append(b * _NBINS + ((px[:, 0] >> _SHIFT) << (2 * HIST_BITS) | (px[:, 1] >> _SHIFT) << HIST_BITS | (px[:, 2] >> _SHIFT)))
+    ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+    allpx = np.concatenate(pixel_sets).astype(np.float64) if pixel_sets else np.empty((0, 3))
+    size = len(pixel_sets) * _NBINS
+    counts = np.bincount(ids, minlength=size).reshape(len(pixel_sets), _NBINS)
+    sums = np.stack([np.bincount(ids, weights=allpx[:, c], minlength=size) for c in range(3)], axis=-1)
+    return counts, sums.reshape(len(pixel_sets), _NBINS, 3)
+
+
+def _seed(points, weights, k):
+    # Deterministic k-means++ style seeding: heaviest bin first, then the bin
+    # maximizing weight * squared distance to the seeds chosen so far.
+    batch = points.shape[0]
+    rows = np.arange(batch)
+    first = np.argmax(weights, axis=1)
+    centers = [points[rows, first]]
+    mind = ((points - centers[0][:, None, :]) ** 2).sum(-1)
+    for _ in range(1, k):
+        nxt = np.argmax(weights * mind, axis=1)
+        c = points[rows, nxt]
+        centers.append(c)
+        mind = np.minimum(mind, ((points - c[:, None, :]) ** 2).sum(-1))
+    return np.stack(centers, axis=1)
+
+
+def _sq_distances(points, sq_norms, centers):
+    # |p - c|^2 expanded so no (B, N, k, 3) intermediate is materialized
+    cross = np.einsum("bnc,bkc->bnk", points, centers)
+    return sq_norms[..., None] - 2.0 * cross + (centers ** 2).sum(-1)[:, None, :]
+
+
+def dominant_colors_batch(images, k=3, iterations=LLOYD_ITERATIONS):
+    """
+    images: list of HxWx3 RGB / HxWx4 RGBA uint8 arrays (None allowed).
+    Returns one list of (r, g, b) int tuples per image, ordered by pixel share.
+    """
+    if not images:
+        return []
+    pixel_sets = [sample_pixels(img) for img in images]
+    counts, sums = _histogram(pixel_sets)
+
+    # Compact the occupied bins of every image into a padded (B, N, 3) array
+    occupied = [np.flatnonzero(c) for c in counts]
+    n_max = max((len(o) for o in occupied), default=0)
+    if n_max == 0:
+        return [[] for _ in images]
+    batch = len(images)
+    points = np.zeros((batch, n_max, 3))
+    weights = np.zeros((batch, n_max))
+    for b, occ in enumerate(occupied):
+        if len(occ):
+            weights[b, :len(occ)] = counts[b, occ]
+            points[b, :len(occ)] = sums[b, occ] / counts[b, occ][:, None]
+
+    k_eff = max(1, min(k, n_max))
+    sq_norms = (points ** 2).sum(-1)
+    centers = _seed(points, weights, k_eff)
+    for _ in range(iterations):
+        labels = np.argmin(_sq_distances(points, sq_norms, centers), axis=2)
+        onehot = (labels[..., None] == np.arange(k_eff)) * weights[..., None]
+        cluster_w = onehot.sum(axis=1)
+        cluster_sum = np.einsum("bnk,bnc->bkc", onehot, points)
+        moved = cluster_w > 0
+        new_centers = np.where(moved[..., None], cluster_sum / np.maximum(cluster_w, 1e-12)[..., None], centers)
+        if np.allclose(new_centers, centers):
+            centers = new_centers
+            break
+        centers = new_centers
+
+    labels = np.argmin(_sq_distances(points, sq_norms, centers), axis=2)
+    cluster_w = ((labels[..., None] == np.arange(k_eff)) * weights[..., None]).sum(axis=1)
+
+    results = []
+    for b in range(batch):
+        order = [i for i in np.argsort(-cluster_w[b], kind="stable") if cluster_w[b, i] > 0]
+        results.append([tuple(int(c) for c in centers[b, i]) for i in order[:k]])
+    return results
+
+
+def dominant_colors(image, k=3):
+    return dominant_colors_batch([image], k=k)[0]
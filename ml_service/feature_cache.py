@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import logging
+
+# ------------------- Feature cache -------------------
+# Content-addressed store for per-garment analysis results. Entries are keyed by
+# sha256(analysis version + image bytes), so resubmitting the same closet photo
+# skips background removal and color/pattern/quality extraction entirely.
+# The database is a single WAL-mode file shared by every worker process; reads go
+# through a memory map of it, so workers share the OS page cache instead of each
+# holding its own copy of hot entries.
+
+
+class FeatureCache:
+    def __init__(self, path, max_entries=5000, version="1", mmap_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.mmap_bytes = mmap_bytes
+        self.max_entries = max_entries
+        self.version = str(version)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS features ("
+            " key TEXT PRIMARY KEY,"
+            " record TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_features_access ON features(last_access)")
+        conn.commit()
+
+    def _conn(self):
+        # sqlite connections must not be shared across threads or forked processes
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_bytes)}")
+            # Small private page cache: hot pages are served from the shared mapping
+            conn.execute("PRAGMA cache_size=-2048")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def key_for(self, data):
+        h = hashlib.sha256()
+        h.update(self.version.encode("utf-8"))
+        h.update(b"\0")
+        h.update(data)
+        return h.hexdigest()
+
+    def get(self, key):
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT record FROM features WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE features SET last_access = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+        except sqlite3.Error as e:
+            logging.warning(f"Feature cache read failed: {e}")
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, key, record):
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO features (key, record, created, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(record), now, now),
+            )
+            conn.commit()
+            self._evict(conn)
+        except sqlite3.Error as e:
+            logging.warning(f"Feature cache write failed: {e}")
+
+    def _evict(self, conn):
+        count = conn.execute("SELECT COUNT(*) FROM features").fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+        conn.execute(
+            "DELETE FROM features WHERE key IN (SELECT key FROM features ORDER BY last_access ASC LIMIT ?)",
+            (excess,),
+        )
+        conn.commit()
+        with self._lock:
+            self.evictions += excess
+
+    def stats(self):
+        try:
+            entries = self._conn().execute("SELECT COUNT(*) FROM features").fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "version": self.version,
+            }
@@ -0,0 +1,41 @@
+import gc
+import os
+
+# ------------------- Production serving -------------------
+# gunicorn -c gunicorn.conf.py app:app
+#
+# The app is imported once in the master (preload_app), so Python modules,
+# OpenCV/MediaPipe/onnxruntime libraries and the rembg model are loaded before
+# fork and shared copy-on-write by every worker. Anything that owns threads
+# (FaceMesh graphs, the analysis pool, job workers, the rembg batcher) is
+# created per worker after the fork. The feature cache is one SQLite file read
+# through a shared memory map, and closet indexes are memory-mapped .npy
+# columns, so neither is duplicated per worker.
+
+bind = os.environ.get("BIND", "127.0.0.1:5001")
+workers = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 2))
+# Threads keep /analyze streams and job polls from blocking a whole worker
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+# Split the cores between workers instead of giving every worker a pool per core
+_cores = os.cpu_count() or 2
+os.environ.setdefault("ANALYZE_WORKERS", str(max(1, _cores // workers)))
+os.environ.setdefault("SKIN_DETECTOR_POOL_SIZE", str(max(1, min(threads, _cores // workers))))
+if preload_app:
+    os.environ["SMARTFIT_PRELOAD"] = "1"
+
+
+def when_ready(server):
+    # Runs after the app is preloaded and before the first fork: move everything
+    # allocated so far out of the collector's reach, so a worker's GC passes do
+    # not write to (and thereby un-share) those pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from app import init_worker
+        init_worker()
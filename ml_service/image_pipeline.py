@@ -0,0 +1,160 @@
+import cv2
+import numpy as np
+
+# ------------------- In-memory image pipeline -------------------
+# An upload is decoded once into an ImageFrame; background removal attaches an
+# alpha mask to the same pixel buffer and every extractor reads the derived
+# views (composited BGR, grayscale), which are computed at most once.
+# Uploads can be normalized to a maximum long edge while decoding: JPEGs are
+# decoded directly at 1/2, 1/4 or 1/8 scale by libjpeg (the full-size bitmap is
+# never materialized), using the largest reduction that keeps the long edge at or
+# above the cap, and then area-resized to the cap.
+
+PNG_MAGIC = b"\x89PNG"
+JPEG_MAGIC = b"\xff\xd8"
+# (scale denominator, flag) from the most to the least reduced
+REDUCED_DECODE = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+# Start-of-frame markers carrying the image size (all SOFn except DHT, JPG and DAC)
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def jpeg_size(data):
+    """(width, height) from a JPEG's start-of-frame header, or None."""
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in SOF_MARKERS:
+            return int.from_bytes(data[i + 7:i + 9], "big"), int.from_bytes(data[i + 5:i + 7], "big")
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+
+class ImageFrame:
+    def __init__(self, rgb, alpha=None, source_shape=None):
+        self.rgb = rgb
+        self.alpha = alpha
+        self.source_shape = source_shape or rgb.shape[:2]  # (h, w) as uploaded
+        self._views = {}
+
+    @classmethod
+    def from_array(cls, image):
+        """Builds a frame from a cv2-decoded array (BGR, BGRA or grayscale)."""
+        if image is None or image.size == 0:
+            return None
+        if image.dtype != np.uint8:
+            image = (image >> 8).astype(np.uint8) if image.dtype == np.uint16 else image.astype(np.uint8)
+        if image.ndim == 2:
+            return cls(cv2.cvtColor(image, cv2.COLOR_GRAY2RGB))
+        if image.shape[2] == 4:
+            return cls(cv2.cvtColor(image[..., :3], cv2.COLOR_BGR2RGB), np.ascontiguousarray(image[..., 3]))
+        return cls(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+
+    @classmethod
+    def from_bytes(cls, data, max_edge=None):
+        """
+        Decodes an upload; with max_edge, the long edge is capped (JPEGs are decoded
+        at reduced scale where possible).
+        """
+        if not data:
+            return None
+        # Only PNGs can carry alpha; JPEGs go through IMREAD_COLOR(_REDUCED) so EXIF orientation is applied
+        flags = cv2.IMREAD_UNCHANGED if data[:4] == PNG_MAGIC else cv2.IMREAD_COLOR
+        source = None
+        if max_edge and data[:2] == JPEG_MAGIC:
+            size = jpeg_size(data)
+            if size is not None:
+                source = size
+                for scale, reduced in REDUCED_DECODE:
+                    if max(size) // scale >= max_edge:
+                        flags = reduced
+                        break
+        frame = cls.from_array(cv2.imdecode(np.frombuffer(data, np.uint8), flags))
+        if frame is None or not max_edge:
+            return frame
+        if source is not None:
+            # The header size is before EXIF rotation; follow the decoded orientation
+            long_side, short_side = max(source), min(source)
+            h, w = frame.shape
+            frame.source_shape = (long_side, short_side) if h >= w else (short_side, long_side)
+        return frame.fit(max_edge)
+
+    @classmethod
+    def from_path(cls, path, max_edge=None):
+        try:
+            with open(path, "rb") as fh:
+                return cls.from_bytes(fh.read(), max_edge)
+        except OSError:
+            return None
+
+    def with_alpha(self, alpha):
+        return ImageFrame(self.rgb, alpha, self.source_shape)
+
+    def fit(self, max_edge):
+        """This frame with its long edge area-resized down to max_edge (self if already smaller)."""
+        h, w = self.shape
+        if max(h, w) <= max_edge:
+            return self
+        scale = max_edge / float(max(h, w))
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        alpha = None if self.alpha is None else cv2.resize(self.alpha, size, interpolation=cv2.INTER_AREA)
+        return ImageFrame(cv2.resize(self.rgb, size, interpolation=cv2.INTER_AREA), alpha, self.source_shape)
+
+    @property
+    def shape(self):
+        return self.rgb.shape[:2]
+
+    def _view(self, name, build):
+        view = self._views.get(name)
+        if view is None:
+            view = self._views[name] = build()
+        return view
+
+    @property
+    def rgba(self):
+        """RGB(A) pixels for the color engine, which skips transparent pixels itself."""
+        if self.alpha is None:
+            return self.rgb
+        return self._view("rgba", lambda: np.dstack([self.rgb, self.alpha]))
+
+    @property
+    def bgr(self):
+        """BGR pixels composited onto black, as the _nobg file used to be read by cv2.imread."""
+        def build():
+            rgb = self.rgb
+            if self.alpha is not None:
+                rgb = (rgb.astype(np.uint16) * self.alpha[..., None] // 255).astype(np.uint8)
+            return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+        return self._view("bgr", build)
+
+    @property
+    def gray(self):
+        return self._view("gray", lambda: cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY))
+
+    def encode_png(self):
+        bgr = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2BGR)
+        if self.alpha is not None:
+            bgr = np.dstack([bgr, self.alpha])
+        ok, buf = cv2.imencode(".png", bgr)
+        if not ok:
+            raise ValueError("PNG encoding failed")
+        return buf.tobytes()
+
+    def save_png(self, path):
+        with open(path, "wb") as fh:
+            fh.write(self.encode_png())
+        return path
+
+
+def as_frame(image):
+    """Accepts a file path or an ImageFrame so extractors work with either."""
+    if isinstance(image, ImageFrame) or image is None:
+        return image
+    return ImageFrame.from_path(image)
@@ -0,0 +1,148 @@
+import os
+import re
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+
+# ------------------- Background job queue -------------------
+# Runs long /analyze requests off the request thread. Submissions go to a bounded
+# in-process queue drained by a fixed number of worker threads. Every job's status
+# and result is written to a small JSON file, so a poll answered by another worker
+# process of the same box still finds it. Finished jobs expire after result_ttl.
+
+JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+SWEEP_INTERVAL_SEC = 30
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Job queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Job:
+    def __init__(self, store, job_id):
+        self.store = store
+        self.id = job_id
+        self.state = {"job_id": job_id, "status": "queued", "created_at": time.time(),
+                      "started_at": None, "finished_at": None, "progress": {}}
+
+    def update(self, **progress):
+        """Records progress (e.g. stage, items done) visible to status polls."""
+        self.state["progress"].update(progress)
+        self.store._save(self.state)
+
+
+class JobQueue:
+    def __init__(self, folder, workers=2, max_depth=32, result_ttl=600):
+        self.folder = folder
+        self.workers = max(1, workers)
+        self.max_depth = max_depth
+        self.result_ttl = result_ttl
+        self._lock = threading.Lock()
+        self._queue = None
+        self._pid = None
+        self._durations = []  # recent job run times, for the Retry-After estimate
+        self._last_sweep = 0.0
+        os.makedirs(folder, exist_ok=True)
+
+    def _ensure_workers(self):
+        # Threads do not survive fork, so each worker process starts its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self.max_depth)
+                    for i in range(self.workers):
+                        threading.Thread(target=self._work, args=(self._queue,),
+                                         name=f"job-worker-{i}", daemon=True).start()
+                    self._pid = os.getpid()
+
+    def retry_after(self):
+        """Seconds until a queue slot is likely free, from recent job durations."""
+        with self._lock:
+            avg = sum(self._durations) / len(self._durations) if self._durations else 5.0
+        depth = self._queue.qsize() if self._queue is not None else 0
+        return max(1, int(avg * max(1, depth) / self.workers + 0.5))
+
+    def submit(self, fn, *args):
+        """
+        Queues fn(job, *args); its return value becomes the job result. Raises
+        QueueFull when max_depth jobs are already waiting.
+        """
+        self._ensure_workers()
+        self._sweep()
+        job = Job(self, uuid.uuid4().hex)
+        self._save(job.state)
+        try:
+            self._queue.put_nowait((job, fn, args))
+        except queue.Full:
+            self._delete(job.id)
+            raise QueueFull(self.retry_after())
+        return job.id
+
+    def status(self, job_id):
+        """The job's state dict (including "result" once done), or None if unknown/expired."""
+        self._sweep()
+        if not JOB_ID_RE.match(job_id or ""):
+            return None
+        try:
+            with open(self._path(job_id), "r", encoding="utf-8") as fh:
+                return json.load(fh)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _work(self, pending):
+        while True:
+            job, fn, args = pending.get()
+            job.state.update(status="running", started_at=time.time())
+            self._save(job.state)
+            try:
+                result = fn(job, *args)
+                job.state.update(status="done", result=result)
+            except Exception as e:
+                logging.error(f"Job {job.id} failed: {e}")
+                job.state.update(status="failed", error=str(e))
+            job.state["finished_at"] = time.time()
+            self._save(job.state)
+            with self._lock:
+                self._durations = (self._durations + [job.state["finished_at"] - job.state["started_at"]])[-20:]
+
+    def _path(self, job_id):
+        return os.path.join(self.folder, f"{job_id}.json")
+
+    def _save(self, state):
+        path = self._path(state["job_id"])
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(state, fh)
+        os.replace(tmp, path)
+
+    def _delete(self, job_id):
+        try:
+            os.remove(self._path(job_id))
+        except OSError:
+            pass
+
+    def _sweep(self):
+        """Drops finished jobs older than result_ttl (at most every SWEEP_INTERVAL_SEC)."""
+        now = time.time()
+        if now - self._last_sweep < SWEEP_INTERVAL_SEC:
+            return
+        self._last_sweep = now
+        for name in os.listdir(self.folder):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.folder, name)
+            try:
+                # Files are rewritten on every state change, so mtime is the last update
+                if now - os.path.getmtime(path) <= self.result_ttl:
+                    continue
+                with open(path, "r", encoding="utf-8") as fh:
+                    state = json.load(fh)
+                if state.get("finished_at") or now - os.path.getmtime(path) > 10 * self.result_ttl:
+                    os.remove(path)
+            except (OSError, ValueError):
+                continue
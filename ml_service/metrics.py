@@ -0,0 +1,249 @@
+import os
+import sys
+import time
+import logging
+import threading
+import functools
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+
+# ------------------- Instrumentation -------------------
+# In-process histograms and counters for pipeline stages, rendered as Prometheus
+# text by /metrics (each worker process reports its own numbers). A request scope
+# also collects a per-request breakdown of the same stages, including work done
+# on analysis-pool threads (the pool runs jobs in a copy of the caller's context),
+# and can sample the stacks of every thread working for a request so slow ones
+# leave a folded-stack profile behind.
+
+PREFIX = "smartfit"
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BUCKETS = {
+    "stage_seconds": TIME_BUCKETS,
+    "request_seconds": TIME_BUCKETS,
+    "image_megapixels": (0.1, 0.3, 1.0, 2.0, 5.0, 12.0, 24.0, 50.0),
+    "items_per_request": (1, 2, 5, 10, 20, 40, 100, 500, 1000),
+}
+HELP = {
+    "stage_seconds": "Time spent in each pipeline stage",
+    "request_seconds": "End-to-end time of instrumented requests",
+    "image_megapixels": "Uploaded image sizes (before normalization)",
+    "items_per_request": "Garments per analyze/ingest/suggest request",
+    "events_total": "Pipeline events such as cache hits and failures",
+    "http_requests_total": "HTTP responses by endpoint and status",
+    "uploads_reclaimed_files_total": "Upload files deleted by the reaper, by reason (ttl, quota)",
+    "uploads_reclaimed_bytes_total": "Bytes freed in the upload folder by the reaper, by reason (ttl, quota)",
+}
+
+_lock = threading.Lock()
+_histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+_counters = {}  # (name, labels) -> value
+_scope = contextvars.ContextVar("metrics_scope", default=None)
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def observe(name, value, **labels):
+    buckets = BUCKETS[name]
+    key = (name, _labels(labels))
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [[0] * len(buckets), 0.0, 0]
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                h[0][i] += 1
+        h[1] += value
+        h[2] += 1
+
+
+def count(name, value=1, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def event(name, value=1):
+    """Counts a pipeline event globally and in the current request's breakdown."""
+    count("events_total", value, event=name)
+    scope = _scope.get()
+    if scope is not None:
+        scope.add_event(name, value)
+
+
+class RequestScope:
+    """Per-request stage breakdown, shared by the request thread and pool threads."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.events = {}
+        self.threads = {threading.get_ident()}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            s = self.stages.setdefault(name, {"count": 0, "total_sec": 0.0})
+            s["count"] += 1
+            s["total_sec"] += seconds
+            self.threads.add(threading.get_ident())
+
+    def add_event(self, name, value):
+        with self._lock:
+            self.events[name] = self.events.get(name, 0) + value
+
+    def breakdown(self):
+        with self._lock:
+            return {
+                "total_sec": time.perf_counter() - self.started,
+                "stages": {k: dict(v) for k, v in self.stages.items()},
+                "events": dict(self.events),
+            }
+
+
+@contextmanager
+def stage(name):
+    """Times a pipeline stage into stage_seconds and the current request breakdown."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("stage_seconds", elapsed, stage=name)
+        scope = _scope.get()
+        if scope is not None:
+            scope.add_stage(name, elapsed)
+
+
+def current_scope():
+    return _scope.get()
+
+
+@contextmanager
+def request_scope(endpoint):
+    """Opens a breakdown for one request; yields the RequestScope."""
+    scope = RequestScope(endpoint)
+    token = _scope.set(scope)
+    sampler = profiler.start(scope) if profiler.enabled else None
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+        elapsed = time.perf_counter() - scope.started
+        observe("request_seconds", elapsed, endpoint=endpoint)
+        if sampler is not None:
+            profiler.finish(sampler, scope, elapsed)
+
+
+def instrumented(endpoint):
+    """View decorator: runs the whole view inside request_scope(endpoint)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with request_scope(endpoint):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class SlowRequestProfiler:
+    """
+    Opt-in sampling profiler: while a request runs, a sampler thread records the
+    stacks of the threads working for it every interval_ms; requests slower than
+    threshold_sec get their folded stacks written to `folder`.
+    """
+
+    def __init__(self, threshold_sec=0.0, interval_ms=10, folder="profiles"):
+        self.configure(threshold_sec, interval_ms, folder)
+
+    def configure(self, threshold_sec, interval_ms=10, folder="profiles"):
+        self.threshold_sec = threshold_sec
+        self.interval = interval_ms / 1000.0
+        self.folder = folder
+
+    @property
+    def enabled(self):
+        return self.threshold_sec > 0
+
+    def start(self, scope):
+        stop = threading.Event()
+        samples = Counter()
+        own = set()
+
+        def run():
+            own.add(threading.get_ident())
+            while not stop.wait(self.interval):
+                frames = sys._current_frames()
+                for ident in list(scope.threads):
+                    frame = frames.get(ident)
+                    if frame is not None and ident not in own:
+                        samples[_fold(frame)] += 1
+
+        thread = threading.Thread(target=run, name="request-sampler", daemon=True)
+        thread.start()
+        return stop, thread, samples
+
+    def finish(self, sampler, scope, elapsed):
+        stop, thread, samples = sampler
+        stop.set()
+        thread.join()
+        if elapsed < self.threshold_sec or not samples:
+            return None
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, f"{scope.endpoint}_{int(time.time() * 1000)}.folded")
+        with open(path, "w", encoding="utf-8") as fh:
+            for stack, n in samples.most_common():
+                fh.write(f"{stack} {n}\n")
+        hottest = samples.most_common(1)[0][0].rsplit(";", 1)[-1]
+        logging.warning(f"Slow {scope.endpoint} request ({elapsed:.2f}s): profile written to {path}, hottest frame {hottest}")
+        return path
+
+
+def _fold(frame):
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+profiler = SlowRequestProfiler()
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in pairs) + "}"
+
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        histograms = {k: (list(v[0]), v[1], v[2]) for k, v in _histograms.items()}
+        counters = dict(_counters)
+    lines = []
+    for name in sorted({n for n, _ in histograms}):
+        full = f"{PREFIX}_{name}"
+        lines.append(f"# HELP {full} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {full} histogram")
+        for (n, labels), (buckets, total, num) in sorted(histograms.items()):
+            if n != name:
+                continue
+            for bound, c in zip(BUCKETS[name], buckets):
+                lines.append(f"{full}_bucket{_format_labels(labels, [('le', bound)])} {c}")
+            lines.append(f"{full}_bucket{_format_labels(labels, [('le', '+Inf')])} {num}")
+            lines.append(f"{full}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{full}_count{_format_labels(labels)} {num}")
+    for name in sorted({n for n, _ in counters}):
+        full = f"{PREFIX}_{name}"
+        lines.append(f"# HELP {full} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {full} counter")
+        for (n, labels), value in sorted(counters.items()):
+            if n == name:
+                lines.append(f"{full}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,367 @@
+import itertools
+
+import numpy as np
+
+# ------------------- Vectorized outfit scoring -------------------
+# Computes exactly the terms of app.score_outfit for whole blocks of item
+# combinations at once. Items are encoded once into small integer/float arrays;
+# combinations are generated lazily in itertools order and only a running top-K
+# is kept, so memory stays bounded by the block size. The base terms do not
+# depend on skin tone or occasion, so tables for many (skin tone, occasion)
+# pairs are ranked from a single enumeration.
+
+BLOCK_SIZE = 1 << 16
+MAX_OUTFIT_SIZE = 5
+_SEQ_BITS = 40  # sort key = score << 40 - sequence number (stable tie-break)
+
+LIGHT_TONES = ("Very Light / Porcelain", "Light / Fair")
+MEDIUM_TONES = ("Medium / Olive", "Tan / Caramel / Light Brown")
+DARK_TONES = ("Brown / Warm Brown", "Dark Brown / Deep", "Very Dark / Ebony")
+SKIN_TONES = LIGHT_TONES + MEDIUM_TONES + DARK_TONES
+
+
+def skin_tone_bonus(item, skin_tone):
+    """Boost score_outfit grants when `item` is the first item of an outfit."""
+    colors = item.get('dominant_colors')
+    if not colors:
+        return 0
+    r, g, b = colors[0]
+    total = r + g + b
+    if skin_tone in LIGHT_TONES and total > 400:
+        return 5
+    elif skin_tone in MEDIUM_TONES and 150 < total < 400:
+        return 4
+    elif skin_tone in DARK_TONES and total < 300:
+        return 4
+    return 0
+
+
+class EncodedItems:
+    """Per-item arrays consumed by score_block."""
+
+    def __init__(self, items):
+        style_values, pattern_values = [], []
+        style_idx = self._encode([item.get('style', 'Casual') for item in items], style_values)
+        pattern_idx = self._encode([item.get('pattern', 'Solid') for item in items], pattern_values)
+        first_colors = np.zeros((len(items), 3), dtype=np.float64)
+        has_color = np.zeros(len(items), dtype=bool)
+        for i, item in enumerate(items):
+            colors = item.get('dominant_colors')
+            if colors:
+                first_colors[i] = colors[0]
+                has_color[i] = True
+        self._setup(style_values, style_idx, pattern_values, pattern_idx, first_colors, has_color)
+
+    @classmethod
+    def from_columns(cls, style_values, style_idx, pattern_values, pattern_idx, first_colors, has_color):
+        """Builds the encoding straight from stored columns (e.g. a closet index)."""
+        enc = cls.__new__(cls)
+        enc._setup(list(style_values), np.asarray(style_idx, dtype=np.int64), list(pattern_values),
+                   np.asarray(pattern_idx, dtype=np.int64), np.asarray(first_colors, dtype=np.float64),
+                   np.asarray(has_color, dtype=bool))
+        return enc
+
+    def _setup(self, style_values, style_idx, pattern_values, pattern_idx, first_colors, has_color):
+        self.n = len(style_idx)
+        self.style_values = style_values
+        self.style_idx = style_idx
+        self.pattern_idx = pattern_idx
+        self.pattern_count = len(pattern_values)
+        self.patterned_code = pattern_values.index("Patterned") if "Patterned" in pattern_values else -1
+        self.first_colors = first_colors
+        self.has_color = has_color
+
+    @staticmethod
+    def _encode(values, vocabulary):
+        codes = []
+        for v in values:
+            if v not in vocabulary:
+                vocabulary.append(v)
+            codes.append(vocabulary.index(v))
+        return np.array(codes, dtype=np.int64)
+
+    def skin_bonus(self, skin_tone):
+        """skin_tone_bonus for every item at once."""
+        total = self.first_colors.sum(axis=1)
+        if skin_tone in LIGHT_TONES:
+            hit, bonus = total > 400, 5
+        elif skin_tone in MEDIUM_TONES:
+            hit, bonus = (total > 150) & (total < 400), 4
+        elif skin_tone in DARK_TONES:
+            hit, bonus = total < 300, 4
+        else:
+            return np.zeros(self.n, dtype=np.float64)
+        return np.where(self.has_color & hit, float(bonus), 0.0)
+
+    def multipliers(self, occasion_multipliers, occasion):
+        table = occasion_multipliers.get(occasion, {})
+        return np.array([table.get(style, 1.0) for style in self.style_values], dtype=np.float64)
+
+
+def _value_counts(codes, vocabulary_size):
+    """(m, r) codes -> (m, vocabulary_size) occurrence counts per row."""
+    m = len(codes)
+    flat = (np.arange(m, dtype=np.int64)[:, None] * vocabulary_size + codes).ravel()
+    return np.bincount(flat, minlength=m * vocabulary_size).reshape(m, vocabulary_size)
+
+
+def base_terms(enc, combos):
+    """
+    Occasion- and skin-independent terms for an (m, r) block of item indices:
+    returns (style/pattern base score, dominant style index) per combination.
+    """
+    rows = np.arange(len(combos))
+    styles = enc.style_idx[combos]
+    style_counts = _value_counts(styles, len(enc.style_values))
+    consistent = (style_counts > 0).sum(axis=1) == 1
+    if enc.patterned_code >= 0:
+        pattern_counts = _value_counts(enc.pattern_idx[combos], enc.pattern_count)
+        mixed = (pattern_counts[:, enc.patterned_code] > 0) & ((pattern_counts > 0).sum(axis=1) > 1)
+    else:
+        mixed = np.zeros(len(combos), dtype=bool)
+    base = 50 + np.where(consistent, 20, -5) + np.where(mixed, -8, 3)
+
+    # Most frequent style, ties going to the style that appears first in the outfit
+    per_position = style_counts[rows[:, None], styles]
+    first_max = np.argmax(per_position == per_position.max(axis=1, keepdims=True), axis=1)
+    dominant = styles[rows, first_max]
+    return base, dominant
+
+
+def final_scores(base, dominant, combos, skin_bonus, multipliers):
+    """Float scores from base_terms output, clamped to 0..100 exactly as score_outfit does."""
+    return np.clip((base + skin_bonus[combos[:, 0]]) * multipliers[dominant], 0, 100)
+
+
+def score_block(enc, combos, skin_bonus, multipliers):
+    """Float scores for an (m, r) block."""
+    base, dominant = base_terms(enc, combos)
+    return final_scores(base, dominant, combos, skin_bonus, multipliers)
+
+
+class ScoringVariants:
+    """
+    The distinct (skin bonus, multiplier table) vectors behind a list of (skin
+    tone, occasion) pairs. Tones in the same group share a bonus and occasions
+    may share a table, so pairs that always score identically are scored once.
+    """
+
+    def __init__(self, enc, pairs, occasion_multipliers):
+        self.pairs = list(dict.fromkeys(pairs))
+        self.variant_of = {}
+        self.bonuses = {}  # bonus key -> (bonus vector, {table key: multiplier vector})
+        for skin_tone, occasion in self.pairs:
+            bonus = enc.skin_bonus(skin_tone)
+            table = enc.multipliers(occasion_multipliers, occasion)
+            key = (bonus.tobytes(), table.tobytes())
+            self.bonuses.setdefault(key[0], (bonus, {}))[1].setdefault(key[1], table)
+            self.variant_of[(skin_tone, occasion)] = key
+
+    def score(self, base, dominant, combos):
+        """{variant key: float scores} for one block of base_terms output."""
+        scores = {}
+        for bonus_key, (bonus, tables) in self.bonuses.items():
+            boosted = base + bonus[combos[:, 0]]
+            for table_key, table in tables.items():
+                scores[(bonus_key, table_key)] = np.clip(boosted * table[dominant], 0, 100)
+        return scores
+
+
+def combination_blocks(n, sizes, block_size=BLOCK_SIZE):
+    """Yields (r, first_sequence_number, (m, r) index array) in itertools.combinations order."""
+    seq = 0
+    for r in sizes:
+        if r > n:
+            break
+        gen = itertools.combinations(range(n), r)
+        while True:
+            flat = np.fromiter(itertools.chain.from_iterable(itertools.islice(gen, block_size)), dtype=np.int64)
+            if flat.size == 0:
+                break
+            block = flat.reshape(-1, r)
+            yield r, seq, block
+            seq += len(block)
+
+
+class TopK:
+    """Running top-K by (score desc, sequence asc), matching a stable sort of all candidates."""
+
+    def __init__(self, k):
+        self.k = k
+        self.keys = np.empty(0, dtype=np.int64)
+        self.finals = np.empty(0, dtype=np.float64)
+        self.combos = []
+
+    def push(self, finals, seqs, combos):
+        keys = (finals.astype(np.int64) << _SEQ_BITS) - seqs
+        if len(keys) > self.k:
+            keep = np.argpartition(-keys, self.k - 1)[:self.k]
+            keys, finals, combos, seqs = keys[keep], finals[keep], combos[keep], seqs[keep]
+        all_keys = np.concatenate([self.keys, keys])
+        all_finals = np.concatenate([self.finals, finals])
+        all_combos = self.combos + [tuple(int(i) for i in c) for c in combos]
+        order = np.argsort(-all_keys, kind="stable")[:self.k]
+        self.keys = all_keys[order]
+        self.finals = all_finals[order]
+        self.combos = [all_combos[i] for i in order]
+
+    def results(self):
+        """[(item index tuple, int score, float final score)] best first."""
+        return [(c, int(f), float(f)) for c, f in zip(self.combos, self.finals)]
+
+
+def top_k_outfits(items, skin_tone, occasion, occasion_multipliers, k=20, sizes=range(2, 6), block_size=BLOCK_SIZE):
+    """
+    Scores every combination of `items` (item dicts or an EncodedItems) with sizes
+    in `sizes` and returns the best k as [(item index tuple, int score, float final
+    score)], in the same order as sorting score_outfit results (stable, score
+    descending) would give.
+    """
+    pair = (skin_tone, occasion)
+    return top_k_outfit_tables(items, [pair], occasion_multipliers, k, sizes, block_size)[pair]
+
+
+def top_k_outfit_tables(items, pairs, occasion_multipliers, k=20, sizes=range(2, 6), block_size=BLOCK_SIZE):
+    """
+    top_k_outfits for every (skin tone, occasion) in `pairs` from one enumeration:
+    combinations and their base terms are computed once, only the skin bonus and
+    occasion multiplier are applied per pair. Returns {pair: results}.
+    """
+    enc = items if isinstance(items, EncodedItems) else EncodedItems(items)
+    variants = ScoringVariants(enc, pairs, occasion_multipliers)
+    if enc.n == 0 or k <= 0:
+        return {pair: [] for pair in variants.pairs}
+    tops = {key: TopK(k) for key in set(variants.variant_of.values())}
+    for _, seq0, block in combination_blocks(enc.n, sizes, block_size):
+        base, dominant = base_terms(enc, block)
+        seqs = seq0 + np.arange(len(block), dtype=np.int64)
+        for key, finals in variants.score(base, dominant, block).items():
+            tops[key].push(finals, seqs, block)
+    return {pair: tops[key].results() for pair, key in variants.variant_of.items()}
+
+
+def combinations_touching(n, changed, sizes, block_size=BLOCK_SIZE):
+    """
+    Yields (r, (m, r) sorted index array) for every combination of range(n) with
+    a size in `sizes` that contains at least one index in `changed`, each once.
+    """
+    changed = sorted(set(changed))
+    changed_set = set(changed)
+    for r in sizes:
+        if r > n:
+            break
+        for s in changed:
+            # Counted once, under its smallest changed index
+            others = [j for j in range(n) if j != s and (j not in changed_set or j > s)]
+            gen = itertools.combinations(others, r - 1)
+            while True:
+                flat = np.fromiter(itertools.chain.from_iterable(itertools.islice(gen, block_size)), dtype=np.int64)
+                if flat.size == 0:
+                    break
+                rest = flat.reshape(-1, r - 1)
+                yield r, np.sort(np.concatenate([np.full((len(rest), 1), s, dtype=np.int64), rest], axis=1), axis=1)
+
+
+def _rank_keys(finals, combos):
+    """(m, 2 + MAX_OUTFIT_SIZE) sort keys, ascending = better: -score, size, item indices."""
+    sizes = (combos >= 0).sum(axis=1)
+    return np.column_stack([-finals.astype(np.int64), sizes, combos]).astype(np.float64)
+
+
+def _ranks_before(keys, floor):
+    """Rows of `keys` that rank strictly ahead of the single key row `floor`."""
+    before = np.zeros(len(keys), dtype=bool)
+    undecided = np.ones(len(keys), dtype=bool)
+    for col, f in zip(keys.T, floor):
+        before |= undecided & (col < f)
+        undecided &= col == f
+    return before
+
+
+class RankedCombos:
+    """
+    The best `depth` combinations (of mixed sizes) in top_k_outfits order, kept up
+    to date as items change instead of rescoring every combination. Combinations
+    are stored padded to MAX_OUTFIT_SIZE with -1.
+
+    `floor` is the sort key of the best combination ever cut off (None while the
+    buffer has seen every combination): only entries ranking ahead of it are known
+    to be in their true position. Item indices in the floor may be fractional, so
+    it keeps its place between surviving items when others are removed.
+    """
+
+    def __init__(self, depth, finals=None, combos=None, floor=None):
+        self.depth = depth
+        self.finals = np.empty(0, dtype=np.float64) if finals is None else np.asarray(finals, dtype=np.float64)
+        self.combos = (np.empty((0, MAX_OUTFIT_SIZE), dtype=np.int64) if combos is None
+                       else np.asarray(combos, dtype=np.int64).reshape(-1, MAX_OUTFIT_SIZE))
+        self.floor = None if floor is None else np.asarray(floor, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.finals)
+
+    @staticmethod
+    def pad(block):
+        padded = np.full((len(block), MAX_OUTFIT_SIZE), -1, dtype=np.int64)
+        padded[:, :block.shape[1]] = block
+        return padded
+
+    def push(self, finals, block):
+        """Merges scored (m, r) combinations, keeping the best `depth`."""
+        if len(finals) > self.depth:
+            # Nothing scoring below the depth-th best can make the cut
+            scores = finals.astype(np.int64)
+            cutoff = np.partition(scores, len(scores) - self.depth)[len(scores) - self.depth]
+            cut = scores < cutoff
+            if cut.any():
+                self._raise_floor(_rank_keys(finals[cut], self.pad(block[cut])))
+            finals, block = finals[~cut], block[~cut]
+        finals = np.concatenate([self.finals, finals])
+        combos = np.concatenate([self.combos, self.pad(block)])
+        keys = _rank_keys(finals, combos)
+        order = np.lexsort(keys.T[::-1])
+        if len(order) > self.depth:
+            self._raise_floor(keys[order[self.depth:]])
+            order = order[:self.depth]
+        self.finals, self.combos = finals[order], combos[order]
+
+    def _raise_floor(self, cut_keys):
+        cut_keys = cut_keys[cut_keys[:, 0] == cut_keys[:, 0].min()]
+        best = cut_keys[np.lexsort(cut_keys.T[::-1])[0]]
+        if self.floor is None or _ranks_before(best[None, :], self.floor)[0]:
+            self.floor = best
+
+    def drop(self, items):
+        """Forgets every combination containing one of `items`."""
+        hit = np.isin(self.combos, list(items)).any(axis=1)
+        self.finals, self.combos = self.finals[~hit], self.combos[~hit]
+
+    def remap(self, kept_old, kept_new):
+        """
+        Renumbers items after a closet change: old index kept_old[i] becomes
+        kept_new[i] (both increasing). Combinations must only hold kept items.
+        """
+        lookup = np.full(max(int(self.combos.max(initial=-1)), int(kept_old[-1]) if len(kept_old) else -1) + 2, -1,
+                         dtype=np.int64)
+        lookup[kept_old] = kept_new
+        self.combos = np.where(self.combos >= 0, lookup[self.combos], -1)
+        if self.floor is not None:
+            items = self.floor[2:]
+            below = np.searchsorted(kept_old, items, side="left")
+            exact = (below < len(kept_old)) & (kept_old[np.minimum(below, len(kept_old) - 1)] == items)
+            # Removed (or fractional) indices land halfway between their surviving neighbours
+            prev_new = np.where(below > 0, kept_new[np.maximum(below - 1, 0)], -1)
+            moved = np.where(exact, kept_new[np.minimum(below, len(kept_old) - 1)], prev_new + 0.5)
+            real = np.arange(MAX_OUTFIT_SIZE) < self.floor[1]
+            self.floor = np.concatenate([self.floor[:2], np.where(real, moved, -1)])
+
+    def certified(self):
+        """How many leading entries are guaranteed to match a full recomputation."""
+        if self.floor is None:
+            return len(self)
+        return int(_ranks_before(_rank_keys(self.finals, self.combos), self.floor).sum())
+
+    def results(self, k):
+        """[(item index tuple, int score, float final score)] best first, like top_k_outfits."""
+        return [(tuple(int(i) for i in c if i >= 0), int(f), float(f))
+                for c, f in zip(self.combos[:k], self.finals[:k])]
@@ -0,0 +1,130 @@
+import heapq
+
+from outfit_scoring import skin_tone_bonus
+
+# ------------------- Branch-and-bound outfit search -------------------
+# Finds the best K outfits of the full per-category product space (one item per
+# category, in itertools.product order) without enumerating it. Each node of the
+# depth-first search gets an upper bound on score_outfit for every outfit below
+# it, built from the same terms: style consistency (+20 only if one style can be
+# shared by all remaining categories), pattern mixing (-8 once it is certain),
+# the first item's skin-tone bonus and the best reachable occasion multiplier.
+# Leaves are visited in product order, so a subtree whose bound does not beat the
+# current K-th score cannot contribute (ties go to the earlier outfit).
+
+
+def _clamp(score):
+    return max(0, min(100, score))
+
+
+class OutfitSearch:
+    def __init__(self, category_items, score_fn, skin_tone, occasion, occasion_multipliers):
+        """
+        category_items: list of per-category item lists (dicts with style/pattern/
+        dominant_colors). score_fn(items) must return score_outfit's int score.
+        """
+        self.lists = [list(items) for items in category_items]
+        self.score_fn = score_fn
+        self.table = occasion_multipliers.get(occasion, {})
+        n = len(self.lists)
+
+        self.styles = [{it.get('style', 'Casual') for it in items} for items in self.lists]
+        self.patterns = [{it.get('pattern', 'Solid') for it in items} for items in self.lists]
+        # Styles shared by every category from depth d on / present in any of them
+        self.common_suffix = [None] * (n + 1)
+        self.union_suffix = [set() for _ in range(n + 1)]
+        for d in range(n - 1, -1, -1):
+            nxt = self.common_suffix[d + 1]
+            self.common_suffix[d] = set(self.styles[d]) if nxt is None else self.styles[d] & nxt
+            self.union_suffix[d] = self.styles[d] | self.union_suffix[d + 1]
+        # Number of leaves below a node at depth d
+        self.subtree_size = [1] * (n + 1)
+        for d in range(n - 1, -1, -1):
+            self.subtree_size[d] = self.subtree_size[d + 1] * len(self.lists[d])
+        self.skin_bonus = [[skin_tone_bonus(it, skin_tone) for it in items] for items in self.lists]
+
+    def _multiplier(self, style):
+        return self.table.get(style, 1.0)
+
+    def upper_bound(self, depth, chosen_styles, chosen_patterns, skin):
+        n = len(self.lists)
+        if depth == 0:
+            skin = max(self.skin_bonus[0]) if self.lists and self.lists[0] else 0
+        if "Patterned" in chosen_patterns and len(chosen_patterns) > 1:
+            pattern_term = -8
+        else:
+            pattern_term = 3
+
+        distinct = set(chosen_styles)
+        reachable = distinct | self.union_suffix[depth]
+        best = (50 - 5 + pattern_term + skin) * max((self._multiplier(s) for s in reachable), default=1.0)
+        if len(distinct) <= 1:
+            common = self.common_suffix[depth] if depth < n else None
+            if common is None:
+                candidates = distinct
+            elif distinct:
+                candidates = distinct & common
+            else:
+                candidates = common
+            for s in candidates:
+                best = max(best, (50 + 20 + pattern_term + skin) * self._multiplier(s))
+        return int(_clamp(best))
+
+    def run(self, k=10, max_evaluations=None):
+        """
+        Returns ([(index tuple, score)] best first, stats). With a max_evaluations
+        budget the search stops early and stats["complete"] is False.
+        """
+        n = len(self.lists)
+        stats = {
+            "total_candidates": self.subtree_size[0] if n else 0,
+            "evaluated": 0,
+            "pruned_subtrees": 0,
+            "pruned_candidates": 0,
+            "complete": True,
+        }
+        if n == 0 or self.subtree_size[0] == 0 or k <= 0:
+            return [], stats
+
+        heap = []  # min-heap of (score, -sequence, index tuple): root is the current K-th best
+        chosen = []
+        chosen_styles = []
+        seq = [0]
+
+        def visit(depth, patterns, skin):
+            if max_evaluations is not None and stats["evaluated"] >= max_evaluations:
+                stats["complete"] = False
+                return False
+            if depth == n:
+                items = [self.lists[d][i] for d, i in enumerate(chosen)]
+                score = self.score_fn(items)
+                stats["evaluated"] += 1
+                entry = (score, -seq[0], tuple(chosen))
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+                seq[0] += 1
+                return True
+            if len(heap) >= k and self.upper_bound(depth, chosen_styles, patterns, skin) <= heap[0][0]:
+                stats["pruned_subtrees"] += 1
+                stats["pruned_candidates"] += self.subtree_size[depth]
+                seq[0] += self.subtree_size[depth]
+                return True
+            for i, item in enumerate(self.lists[depth]):
+                chosen.append(i)
+                chosen_styles.append(item.get('style', 'Casual'))
+                keep_going = visit(
+                    depth + 1,
+                    patterns | {item.get('pattern', 'Solid')},
+                    self.skin_bonus[0][i] if depth == 0 else skin,
+                )
+                chosen.pop()
+                chosen_styles.pop()
+                if not keep_going:
+                    return False
+            return True
+
+        visit(0, frozenset(), 0)
+        ranked = sorted(heap, reverse=True)
+        return [(combo, score) for score, _, combo in ranked], stats
@@ -0,0 +1,125 @@
+import cv2
+import numpy as np
+
+# ------------------- Pattern analysis -------------------
+# Classifies a garment's surface as solid, striped, checked or printed from cheap
+# texture statistics on a small copy of the garment region: the image is cropped
+# to the _nobg alpha, downscaled to ANALYSIS_EDGE pixels and eroded away from the
+# silhouette so its outline does not count as texture. Strong gradients decide
+# solid vs. textured; the orientation histogram of those gradients separates one
+# dominant direction (stripes), two crossing ones (checks) and no dominant
+# direction (prints). A seam or two adds a few strong pixels but not enough to
+# lift a solid garment over EDGE_DENSITY_SOLID.
+
+ANALYSIS_EDGE = 256
+ALPHA_THRESHOLD = 128
+ERODE_PX = 4
+GRADIENT_THRESHOLD = 24.0  # Sobel magnitude (0-255 scale) counted as a texture edge
+EDGE_DENSITY_SOLID = 0.06  # fraction of garment pixels on texture edges
+ORIENTATION_BINS = 36  # over 0..180 degrees
+STRIPE_CONCENTRATION = 0.72  # share of edge energy within +-15 degrees of one direction
+CHECK_CONCENTRATION = 0.55  # combined share of the two strongest directions 60+ degrees apart
+CHECK_MIN_SECOND = 0.1  # ...of which the weaker one must carry at least this much
+MIN_PIXELS = 64
+
+LABELS = ("solid", "striped", "checked", "printed")
+
+
+def _region(rgb, alpha):
+    """Garment region (downscaled RGB) and its eroded foreground mask."""
+    region = rgb
+    mask = None
+    if alpha is not None:
+        x, y, w, h = cv2.boundingRect((alpha >= ALPHA_THRESHOLD).view(np.uint8))
+        if w == 0 or h == 0:
+            return None, None
+        region = region[y:y + h, x:x + w]
+        mask = alpha[y:y + h, x:x + w]
+    h, w = region.shape[:2]
+    # Integer shrink factors take OpenCV's fast INTER_AREA path
+    factor = -(-max(h, w) // ANALYSIS_EDGE)
+    if factor > 1:
+        size = (max(1, w // factor), max(1, h // factor))
+        region = cv2.resize(region, size, interpolation=cv2.INTER_AREA)
+        if mask is not None:
+            mask = cv2.resize(mask, size, interpolation=cv2.INTER_AREA)
+    if mask is None:
+        mask = np.full(region.shape[:2], 255, dtype=np.uint8)
+    mask = (mask >= ALPHA_THRESHOLD).astype(np.uint8)
+    # Keep away from the silhouette (and the image border) so the outline is not texture
+    mask[:ERODE_PX, :] = mask[-ERODE_PX:, :] = 0
+    mask[:, :ERODE_PX] = mask[:, -ERODE_PX:] = 0
+    mask = cv2.erode(mask, np.ones((2 * ERODE_PX + 1, 2 * ERODE_PX + 1), np.uint8))
+    return region, mask.astype(bool)
+
+
+def pattern_stats(rgb, alpha=None):
+    """Texture statistics for the garment, or None if too little of it is visible."""
+    region, mask = _region(rgb, alpha)
+    if region is None or mask.sum() < MIN_PIXELS:
+        return None
+    # Color gradient: per pixel, the channel with the strongest Sobel response, so
+    # stripes of two colors with similar brightness (e.g. red/green) still count
+    g = region.astype(np.float32)
+    gx = cv2.Sobel(g, cv2.CV_32F, 1, 0, ksize=3) / 4.0
+    gy = cv2.Sobel(g, cv2.CV_32F, 0, 1, ksize=3) / 4.0
+    channel_mag = gx * gx + gy * gy
+    best = np.argmax(channel_mag, axis=2)[..., None]
+    gx = np.take_along_axis(gx, best, axis=2)[..., 0]
+    gy = np.take_along_axis(gy, best, axis=2)[..., 0]
+    mag = np.sqrt(np.take_along_axis(channel_mag, best, axis=2)[..., 0])[mask]
+    strong = mag > GRADIENT_THRESHOLD
+    stats = {
+        "edge_density": float(strong.mean()),
+        "orientations": np.zeros(ORIENTATION_BINS),
+    }
+    if strong.any():
+        # Gradient direction is perpendicular to the stripe; only the axis matters
+        theta = np.arctan2(gy[mask][strong], gx[mask][strong]) % np.pi
+        bins = (theta / np.pi * ORIENTATION_BINS).astype(int) % ORIENTATION_BINS
+        hist = np.bincount(bins, weights=mag[strong], minlength=ORIENTATION_BINS)
+        stats["orientations"] = hist / hist.sum()
+    return stats
+
+
+def direction_shares(hist):
+    """Share of edge energy within +-15 degrees of each direction (circular)."""
+    half = ORIENTATION_BINS // 12
+    padded = np.concatenate([hist[-half:], hist, hist[:half]])
+    return np.convolve(padded, np.ones(2 * half + 1), mode="valid")
+
+
+def classify(stats):
+    """(label, confidence) from pattern_stats output."""
+    if stats is None:
+        return "unknown", 0.0
+    density = stats["edge_density"]
+    if density < EDGE_DENSITY_SOLID:
+        return "solid", round(1.0 - 0.5 * density / EDGE_DENSITY_SOLID, 3)
+    textured = min(1.0, 0.5 + 0.5 * (density - EDGE_DENSITY_SOLID) / EDGE_DENSITY_SOLID)
+
+    shares = direction_shares(stats["orientations"])
+    first = int(np.argmax(shares))
+    offset = np.abs(np.arange(ORIENTATION_BINS) - first)
+    offset = np.minimum(offset, ORIENTATION_BINS - offset)
+    first_share = float(shares[first])
+    # Strongest direction at least 60 degrees away from the first
+    second_share = float(shares[offset >= ORIENTATION_BINS // 3].max())
+
+    if first_share >= STRIPE_CONCENTRATION:
+        return "striped", round(textured * first_share, 3)
+    if second_share >= CHECK_MIN_SECOND and first_share + second_share >= CHECK_CONCENTRATION:
+        return "checked", round(textured * min(1.0, (first_share + second_share) / STRIPE_CONCENTRATION), 3)
+    if first_share >= CHECK_CONCENTRATION:
+        # One clear direction but not clean enough for stripes (folds, perspective)
+        return "striped", round(textured * first_share, 3)
+    # No dominant direction: an irregular print
+    uniform = shares.mean()
+    spread = 1.0 - (first_share - uniform) / (CHECK_CONCENTRATION - uniform)
+    return "printed", round(textured * (0.5 + 0.5 * min(1.0, max(0.0, spread))), 3)
+
+
+def analyze(rgb, alpha=None):
+    """{"label": solid|striped|checked|printed|unknown, "confidence": 0..1}."""
+    label, confidence = classify(pattern_stats(rgb, alpha))
+    return {"label": label, "confidence": confidence}
@@ -0,0 +1,208 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+from PIL import Image
+
+# ------------------- Combined previews -------------------
+# /analyze only registers a preview (a small manifest keyed by the hash of its
+# constituent item files and output options); the image is composited the first
+# time /uploads/combined_<hash>.<ext> is fetched. Per-item resized thumbnails are
+# cached and reused by every preview containing that item, and rendered files
+# live in a size-bounded cache directory evicted least-recently-used first.
+# Manifests share that budget and also expire when unused for manifest_ttl, so
+# previews that are registered but never fetched do not accumulate.
+
+PREVIEW_NAME_RE = re.compile(r"^combined_([0-9a-f]{24})\.(png|webp|jpg)$")
+FORMATS = {"png": "PNG", "webp": "WEBP", "jpg": "JPEG"}
+RESAMPLE = Image.Resampling.LANCZOS if hasattr(Image, 'Resampling') else Image.LANCZOS
+# register() runs an eviction pass at most this often (rendering always runs one)
+EVICT_INTERVAL_SEC = 60
+
+
+class PreviewStore:
+    def __init__(self, folder, height=300, default_format="png", quality=85, max_bytes=256 * 1024 * 1024,
+                 manifest_ttl=7 * 86400):
+        self.folder = folder
+        self.manifest_folder = os.path.join(folder, "manifests")
+        self.thumb_folder = os.path.join(folder, "thumbs")
+        self.height = height
+        self.default_format = default_format
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.manifest_ttl = manifest_ttl
+        self._last_evict = 0.0
+        self._locks = {}  # filename -> [lock, holders]; dropped when the last holder leaves
+        self._locks_guard = threading.Lock()
+        for d in (self.folder, self.manifest_folder, self.thumb_folder):
+            os.makedirs(d, exist_ok=True)
+
+    @staticmethod
+    def is_preview(filename):
+        return PREVIEW_NAME_RE.match(filename) is not None
+
+    def register(self, item_paths, fmt=None, quality=None):
+        """Records which items make up a preview and returns its filename (nothing is rendered)."""
+        items = [p for p in item_paths if p and os.path.exists(p)]
+        if not items:
+            return None
+        fmt = fmt if fmt in FORMATS else self.default_format
+        quality = int(quality) if quality else self.quality
+        h = hashlib.sha1()
+        for p in items:
+            st = os.stat(p)
+            h.update(f"{os.path.abspath(p)}|{st.st_size}|{st.st_mtime_ns}\n".encode("utf-8"))
+        h.update(f"{self.height}|{fmt}|{quality if fmt != 'png' else ''}".encode("utf-8"))
+        key = h.hexdigest()[:24]
+        manifest_path = os.path.join(self.manifest_folder, f"{key}.json")
+        if os.path.exists(manifest_path):
+            os.utime(manifest_path)
+        else:
+            self._atomic_write(manifest_path, json.dumps({"items": items, "format": fmt, "quality": quality}).encode("utf-8"))
+        if time.time() - self._last_evict > EVICT_INTERVAL_SEC:
+            self.evict()
+        return f"combined_{key}.{fmt}"
+
+    def ensure(self, filename):
+        """Path of the rendered preview, rendering it on first request. None if unknown."""
+        match = PREVIEW_NAME_RE.match(filename)
+        if not match:
+            return None
+        path = os.path.join(self.folder, filename)
+        if os.path.exists(path):
+            os.utime(path)  # LRU bookkeeping
+            return path
+        manifest_path = os.path.join(self.manifest_folder, f"{match.group(1)}.json")
+        if not os.path.exists(manifest_path):
+            return None
+        with self._locked(filename):
+            if not os.path.exists(path):
+                try:
+                    with open(manifest_path, "r", encoding="utf-8") as fh:
+                        manifest = json.load(fh)
+                except FileNotFoundError:
+                    return None  # expired meanwhile
+                os.utime(manifest_path)
+                if not self._render(manifest, path):
+                    return None
+                self.evict(keep=(path, manifest_path))
+        return path
+
+    def manifest_paths(self):
+        """Paths of every live manifest."""
+        return [os.path.join(self.manifest_folder, name) for name in os.listdir(self.manifest_folder)
+                if name.endswith(".json")]
+
+    @staticmethod
+    def manifest_items(manifest_path):
+        """Item files a manifest references (empty if it is gone or unreadable)."""
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as fh:
+                return list(json.load(fh)["items"])
+        except (OSError, ValueError, KeyError):
+            return []
+
+    @contextmanager
+    def _locked(self, key):
+        with self._locks_guard:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._locks_guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+    def thumbnail(self, item_path):
+        """Item resized to the preview height, cached across previews."""
+        st = os.stat(item_path)
+        key = hashlib.sha1(f"{os.path.abspath(item_path)}|{st.st_size}|{st.st_mtime_ns}|{self.height}".encode("utf-8")).hexdigest()
+        thumb_path = os.path.join(self.thumb_folder, f"{key}.png")
+        if os.path.exists(thumb_path):
+            os.utime(thumb_path)
+            return Image.open(thumb_path).convert("RGBA")
+        img = Image.open(item_path).convert("RGBA")
+        wsize = max(1, int(img.size[0] * (self.height / float(img.size[1]))))
+        img = img.resize((wsize, self.height), RESAMPLE)
+        tmp = f"{thumb_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        img.save(tmp, "PNG")
+        os.replace(tmp, thumb_path)
+        return img
+
+    def _render(self, manifest, path):
+        thumbs = []
+        for p in manifest["items"]:
+            try:
+                if os.path.exists(p):
+                    thumbs.append(self.thumbnail(p))
+            except Exception as e:
+                logging.error(f"Failed to open image {p} for combination: {e}")
+        if not thumbs:
+            return False
+
+        total_width = sum(t.size[0] for t in thumbs)
+        combined = Image.new("RGBA", (total_width, self.height), (255, 255, 255, 0))
+        x_offset = 0
+        for t in thumbs:
+            combined.paste(t, (x_offset, 0), mask=t)
+            x_offset += t.size[0]
+
+        fmt = manifest.get("format", "png")
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if fmt == "jpg":
+            # JPEG has no alpha: flatten onto white
+            flat = Image.new("RGB", combined.size, (255, 255, 255))
+            flat.paste(combined, mask=combined.split()[3])
+            flat.save(tmp, "JPEG", quality=manifest.get("quality", self.quality), optimize=True)
+        elif fmt == "webp":
+            combined.save(tmp, "WEBP", quality=manifest.get("quality", self.quality), method=4)
+        else:
+            combined.save(tmp, "PNG")
+        os.replace(tmp, path)
+        return True
+
+    def evict(self, keep=()):
+        """
+        Deletes manifests unused for manifest_ttl, then least-recently-used rendered
+        previews, thumbnails and manifests above max_bytes (except the paths in `keep`).
+        """
+        self._last_evict = now = time.time()
+        files = []
+        for d in (self.folder, self.thumb_folder, self.manifest_folder):
+            for name in os.listdir(d):
+                p = os.path.join(d, name)
+                if d == self.folder and not PREVIEW_NAME_RE.match(name):
+                    continue
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                if os.path.isfile(p):
+                    files.append((st.st_mtime, st.st_size, p, d == self.manifest_folder))
+        total = sum(size for _, size, _, _ in files)
+        for mtime, size, p, is_manifest in sorted(files):
+            if p in keep:
+                continue
+            expired = is_manifest and now - mtime > self.manifest_ttl
+            if not expired and total <= self.max_bytes:
+                continue
+            try:
+                os.remove(p)
+                total -= size
+            except OSError as e:
+                logging.warning(f"Could not evict preview file {p}: {e}")
+
+    @staticmethod
+    def _atomic_write(path, data):
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
@@ -0,0 +1,280 @@
+import os
+import math
+import hashlib
+import contextlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from outfit_scoring import RankedCombos, ScoringVariants, base_terms, combinations_touching, top_k_outfit_tables
+
+# ------------------- Incremental closet recommendations -------------------
+# For every (closet, skin tone, occasion) a ranked buffer of the best `depth`
+# outfits is kept next to the closet index, together with the item keys and
+# scoring fingerprints it was computed from. When the closet changes, the buffer
+# is diffed against the new index: outfits with removed or edited items are
+# dropped, surviving indices are renumbered, and only the combinations that
+# include an added or edited item are scored and merged in. A full rescore
+# happens only when too much changed or too few certified entries remain.
+# Buffers for several (skin tone, occasion) pairs are refreshed together, sharing
+# one enumeration of the combinations and their base terms. Only the most recently
+# used buffers stay in memory; the rest are reloaded from disk when needed.
+
+
+def buffer_signature(skin_tone, occasion, multipliers, analysis_version):
+    raw = f"{analysis_version}\0{skin_tone}\0{occasion}\0{sorted((multipliers or {}).items())}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def combination_count(n, sizes):
+    return sum(math.comb(n, r) for r in sizes)
+
+
+class RecommendationBuffer:
+    def __init__(self, generation, sizes, keys, fingerprints, ranked):
+        self.generation = generation
+        self.sizes = tuple(sizes)
+        self.keys = list(keys)
+        self.fingerprints = list(fingerprints)
+        self.ranked = ranked
+
+    def save(self, path):
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        r = self.ranked
+        np.savez(tmp, generation=np.array(self.generation), sizes=np.array(self.sizes, dtype=np.int64),
+                 keys=np.array(self.keys, dtype=str), fingerprints=np.array(self.fingerprints, dtype=str),
+                 depth=np.array(r.depth), finals=r.finals, combos=r.combos,
+                 floor=r.floor if r.floor is not None else np.empty(0))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                floor = data["floor"]
+                ranked = RankedCombos(int(data["depth"]), data["finals"], data["combos"],
+                                      floor if floor.size else None)
+                return cls(str(data["generation"]), data["sizes"].tolist(), data["keys"].tolist(),
+                           data["fingerprints"].tolist(), ranked)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable recommendation buffer {path}: {e}")
+            return None
+
+
+class ClosetRecommender:
+    def __init__(self, occasion_multipliers, depth=200, max_rescore_fraction=0.5, analysis_version=None,
+                 max_buffers=1024):
+        self.occasion_multipliers = occasion_multipliers
+        self.depth = depth
+        self.max_rescore_fraction = max_rescore_fraction
+        self.analysis_version = analysis_version
+        self.max_buffers = max_buffers
+        self._lock = threading.Lock()
+        self._locks = {}  # (closet_id, signature) -> [lock, holders]; dropped when the last holder leaves
+        self._buffers = OrderedDict()  # (closet_id, signature) -> RecommendationBuffer, in LRU order
+
+    def _path(self, closet, signature):
+        return os.path.join(closet.path, "recommendations", f"{signature}.npz")
+
+    @contextlib.contextmanager
+    def _buffer_lock(self, key):
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+    def _cached(self, key):
+        with self._lock:
+            buf = self._buffers.get(key)
+            if buf is not None:
+                self._buffers.move_to_end(key)
+            return buf
+
+    def _remember(self, key, buf):
+        with self._lock:
+            self._buffers[key] = buf
+            self._buffers.move_to_end(key)
+            while len(self._buffers) > self.max_buffers:
+                self._buffers.popitem(last=False)
+
+    def forget(self, closet_id):
+        """Drops this process's in-memory buffers of a closet (e.g. once it is deleted)."""
+        with self._lock:
+            for key in [key for key in self._buffers if key[0] == closet_id]:
+                del self._buffers[key]
+
+    def recommend(self, closet, skin_tone, occasion, sizes, k=20, verify=False):
+        """
+        Top-k outfits for the closet as [(item index tuple, int score, float final
+        score)] in top_k_outfits order, plus stats on how they were obtained
+        ("cached", "incremental" or "full"). verify=True also runs the full
+        recomputation and reports whether both agree.
+        """
+        return self.recommend_many(closet, [(skin_tone, occasion)], sizes, k, verify)[(skin_tone, occasion)]
+
+    def recommend_many(self, closet, pairs, sizes, k=20, verify=False):
+        """
+        recommend() for every (skin tone, occasion) in `pairs` at once: buffers that
+        need a full or incremental rescore are brought up to date together, with
+        one enumeration of the changed combinations. Returns {pair: (results, stats)}.
+        """
+        pairs = list(dict.fromkeys(pairs))
+        sizes = tuple(sizes)
+        total = combination_count(len(closet), sizes)
+        if k > self.depth:
+            # Deeper than the buffers: nothing to reuse
+            tables = top_k_outfit_tables(closet.encoded(), pairs, self.occasion_multipliers, k=k, sizes=sizes)
+            return {pair: (tables[pair], {"mode": "full", "depth": self.depth, "changed_items": 0,
+                                          "scored_combinations": total, "total_combinations": total,
+                                          **({"verified": True} if verify else {})})
+                    for pair in pairs}
+        cache_keys = {pair: (closet.closet_id, self._signature(*pair)) for pair in pairs}
+        with contextlib.ExitStack() as stack:
+            # Always taken in the same order, so overlapping requests cannot deadlock
+            for cache_key in sorted(set(cache_keys.values())):
+                stack.enter_context(self._buffer_lock(cache_key))
+            buffers, stats = {}, {}
+            for pair in pairs:
+                path = self._path(closet, cache_keys[pair][1])
+                buf = self._cached(cache_keys[pair])
+                if buf is None or buf.generation != closet.generation:
+                    # Another worker may already have brought the stored copy up to date
+                    stored = RecommendationBuffer.load(path)
+                    if stored is not None and (buf is None or stored.generation == closet.generation):
+                        buf = stored
+                buffers[pair] = buf
+                stats[pair] = {"mode": "cached", "depth": self.depth, "changed_items": 0, "scored_combinations": 0,
+                               "total_combinations": total}
+
+            stale = [pair for pair in pairs if buffers[pair] is not None and buffers[pair].generation != closet.generation]
+            for pair in stale:
+                stats[pair]["mode"] = "incremental"
+            for pair in self._apply_changes({pair: buffers[pair] for pair in stale}, closet, sizes, stats):
+                buffers[pair] = None
+            for pair in pairs:
+                if buffers[pair] is not None and buffers[pair].ranked.certified() < min(k, total):
+                    buffers[pair] = None
+
+            rebuild = [pair for pair in pairs if buffers[pair] is None]
+            if rebuild:
+                # One extra outfit per table tells where the buffer was cut off
+                tables = top_k_outfit_tables(closet.encoded(), rebuild, self.occasion_multipliers,
+                                             k=self.depth + 1, sizes=sizes)
+                for pair in rebuild:
+                    stats[pair].update(mode="full", scored_combinations=total)
+                    buffers[pair] = self._full(closet, sizes, tables[pair])
+
+            results = {}
+            for pair in pairs:
+                buf = buffers[pair]
+                if stats[pair]["mode"] != "cached":
+                    path = self._path(closet, cache_keys[pair][1])
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    buf.save(path)
+                self._remember(cache_keys[pair], buf)
+                results[pair] = buf.ranked.results(k)
+
+        if verify:
+            expected = top_k_outfit_tables(closet.encoded(), pairs, self.occasion_multipliers, k=k, sizes=sizes)
+            for pair in pairs:
+                stats[pair]["verified"] = [(c, s) for c, s, _ in expected[pair]] == [(c, s) for c, s, _ in results[pair]]
+                if not stats[pair]["verified"]:
+                    logging.error(f"Incremental recommendations for closet {closet.closet_id} {pair} differ from a "
+                                  f"full recomputation ({stats[pair]['mode']}); serving the full result")
+                    results[pair] = expected[pair]
+        return {pair: (results[pair], stats[pair]) for pair in pairs}
+
+    def _signature(self, skin_tone, occasion):
+        return buffer_signature(skin_tone, occasion, self.occasion_multipliers.get(occasion, {}), self.analysis_version)
+
+    def _full(self, closet, sizes, top):
+        """A buffer from top_k_outfits results computed with k = depth + 1."""
+        kept, cut = top[:self.depth], top[self.depth:]
+        ranked = RankedCombos(self.depth)
+        if kept:
+            finals = np.array([f for _, _, f in kept], dtype=np.float64)
+            combos = np.concatenate([RankedCombos.pad(np.array([c])) for c, _, _ in kept])
+            ranked = RankedCombos(self.depth, finals, combos)
+        if cut:
+            c, _, f = cut[0]
+            ranked.floor = np.concatenate([[-int(f), len(c)], RankedCombos.pad(np.array([c]))[0]]).astype(np.float64)
+        return RecommendationBuffer(closet.generation, sizes, [it["key"] for it in closet.items],
+                                    closet.fingerprints(), ranked)
+
+    def _diff(self, buf, closet, sizes):
+        """(stale, kept_old, kept_new, changed) item indices between buf and the closet, or None to rescore fully."""
+        if buf.sizes != sizes or buf.ranked.depth != self.depth:
+            return None
+        keys = [it["key"] for it in closet.items]
+        fingerprints = closet.fingerprints()
+        position = {key: i for i, key in enumerate(keys)}
+        stale, kept_old, kept_new, changed = [], [], [], []
+        for i, key in enumerate(buf.keys):
+            j = position.get(key)
+            if j is None:
+                stale.append(i)
+                continue
+            kept_old.append(i)
+            kept_new.append(j)
+            if buf.fingerprints[i] != fingerprints[j]:
+                stale.append(i)
+                changed.append(j)
+        if any(b <= a for a, b in zip(kept_new, kept_new[1:])):
+            return None  # items were reordered
+        old_keys = set(buf.keys)
+        changed += [j for j, key in enumerate(keys) if key not in old_keys]
+
+        n = len(keys)
+        rescore = combination_count(n, sizes) - combination_count(n - len(changed), sizes)
+        if rescore > self.max_rescore_fraction * combination_count(n, sizes):
+            return None
+        return stale, kept_old, kept_new, sorted(changed)
+
+    def _apply_changes(self, buffers, closet, sizes, stats):
+        """
+        Brings the {pair: buffer} up to the closet's generation in place. Buffers
+        sharing the same changed items are rescored from one enumeration of the
+        combinations touching them. Returns the pairs that need a full rescore.
+        """
+        failed, groups = [], {}
+        for pair, buf in buffers.items():
+            diff = self._diff(buf, closet, sizes)
+            if diff is None:
+                failed.append(pair)
+                continue
+            stale, kept_old, kept_new, changed = diff
+            ranked = buf.ranked
+            ranked.drop(stale)
+            ranked.remap(np.array(kept_old, dtype=np.int64), np.array(kept_new, dtype=np.int64))
+            groups.setdefault(tuple(changed), []).append(pair)
+            n = len(closet)
+            stats[pair].update(changed_items=len(buf.keys) - len(kept_old) + len(changed),
+                               scored_combinations=combination_count(n, sizes) - combination_count(n - len(changed), sizes))
+
+        enc = None
+        for changed, group in groups.items():
+            if changed:
+                enc = enc or closet.encoded()
+                variants = ScoringVariants(enc, group, self.occasion_multipliers)
+                for _, block in combinations_touching(len(closet), changed, sizes):
+                    base, dominant = base_terms(enc, block)
+                    scores = variants.score(base, dominant, block)
+                    for pair in group:
+                        buffers[pair].ranked.push(scores[variants.variant_of[pair]], block)
+            for pair in group:
+                buf = buffers[pair]
+                buf.generation = closet.generation
+                buf.keys = [it["key"] for it in closet.items]
+                buf.fingerprints = list(closet.fingerprints())
+        return failed
@@ -0,0 +1,177 @@
+import os
+import queue
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+from image_pipeline import ImageFrame
+
+# ------------------- Skin-tone detection -------------------
+# FaceMesh graphs are not safe to share between threads, so each worker process
+# keeps a small pool of detectors that requests check out one at a time. Faces
+# are landmarked on a downscaled copy of the photo and the tone is sampled only
+# from cheek and forehead polygons (no eyes, brows or lips), cropped to each
+# polygon's bounding box. Results are cached in memory by image hash.
+
+DEFAULT_TONE = "Medium / Olive"
+
+# MediaPipe FaceMesh landmark indices outlining skin-only regions
+SKIN_REGIONS = {
+    "forehead": [109, 10, 338, 337, 9, 108],
+    "left_cheek": [116, 117, 118, 101, 205, 187, 147, 123],
+    "right_cheek": [345, 346, 347, 330, 425, 411, 376, 352],
+}
+MIN_REGION_PIXELS = 20
+
+
+def classify_brightness(brightness):
+    if brightness > 210: return "Very Light / Porcelain"
+    elif 180 < brightness <= 210: return "Light / Fair"
+    elif 150 < brightness <= 180: return "Medium / Olive"
+    elif 120 < brightness <= 150: return "Tan / Caramel / Light Brown"
+    elif 90 < brightness <= 120: return "Brown / Warm Brown"
+    elif 60 < brightness <= 90: return "Dark Brown / Deep"
+    else: return "Very Dark / Ebony"
+
+
+def downscale(rgb, max_edge):
+    h, w = rgb.shape[:2]
+    scale = max_edge / float(max(h, w))
+    if scale >= 1:
+        return rgb
+    return cv2.resize(rgb, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+def _polygon_pixels(rgb, pts):
+    """Pixels inside the convex hull of `pts`, rasterized only over its bounding box."""
+    h, w = rgb.shape[:2]
+    x0, y0 = np.clip(np.floor(pts.min(axis=0)).astype(int), 0, [w, h])
+    x1, y1 = np.clip(np.ceil(pts.max(axis=0)).astype(int) + 1, 0, [w, h])
+    if x1 <= x0 or y1 <= y0:
+        return np.empty((0, 3), dtype=rgb.dtype)
+    mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    hull = cv2.convexHull(np.round(pts - [x0, y0]).astype(np.int32))
+    cv2.fillConvexPoly(mask, hull, 255)
+    return rgb[y0:y1, x0:x1][mask > 0]
+
+
+def skin_pixels(rgb, landmarks):
+    """Cheek/forehead pixels for one face; falls back to the whole mesh hull."""
+    h, w = rgb.shape[:2]
+    pts = np.array([(lm.x * w, lm.y * h) for lm in landmarks], dtype=np.float32)
+    regions = [_polygon_pixels(rgb, pts[idx]) for idx in SKIN_REGIONS.values()]
+    pixels = np.concatenate(regions) if regions else np.empty((0, 3), dtype=rgb.dtype)
+    if len(pixels) < MIN_REGION_PIXELS:
+        pixels = _polygon_pixels(rgb, pts)
+    return pixels
+
+
+class SkinToneDetector:
+    def __init__(self, detector_factory, pool_size=4, max_edge=640, cache_size=1024):
+        """detector_factory() must return a FaceMesh-like object with .process(rgb)."""
+        self.detector_factory = detector_factory
+        self.pool_size = max(1, pool_size)
+        self.max_edge = max_edge
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._reset_pool()
+
+    def _reset_pool(self):
+        self._idle = queue.Queue()
+        self._created = 0
+        self._pid = os.getpid()
+
+    @contextmanager
+    def _detector(self):
+        # Detectors are never handed across fork; a forked worker builds its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset_pool()
+        # None on the idle queue is a free slot: whoever takes it builds the detector
+        try:
+            detector = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.pool_size
+                if create:
+                    self._created += 1
+            detector = None if create else self._idle.get()
+        if detector is None:
+            try:
+                detector = self.detector_factory()
+            except Exception:
+                self._idle.put(None)  # hand the slot on so waiters are not stranded
+                raise
+        try:
+            yield detector
+        except Exception:
+            # A detector that failed mid-graph is dropped rather than reused; the next
+            # caller (possibly one already waiting) builds a replacement in its slot
+            self._idle.put(None)
+            raise
+        else:
+            self._idle.put(detector)
+
+    def warm_up(self):
+        """Builds one detector for this process so its first request does not pay for it."""
+        with self._detector():
+            pass
+
+    def _cached(self, key):
+        with self._lock:
+            tone = self._cache.get(key)
+            if tone is not None:
+                self._cache.move_to_end(key)
+            return tone
+
+    def _remember(self, key, tone):
+        with self._lock:
+            self._cache[key] = tone
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def detect_bytes(self, data):
+        """Skin tone of an encoded face photo; identical uploads are answered from cache."""
+        if not data:
+            return DEFAULT_TONE
+        key = hashlib.sha1(data).hexdigest()
+        tone = self._cached(key)
+        if tone is None:
+            tone = self._detect(ImageFrame.from_bytes(data, self.max_edge))
+            self._remember(key, tone)
+        return tone
+
+    def detect(self, frame):
+        if frame is None:
+            return DEFAULT_TONE
+        small = downscale(frame.rgb, self.max_edge)
+        key = hashlib.sha1(np.ascontiguousarray(small).data).hexdigest()
+        tone = self._cached(key)
+        if tone is None:
+            tone = self._classify(small)
+            self._remember(key, tone)
+        return tone
+
+    def _detect(self, frame):
+        if frame is None:
+            return DEFAULT_TONE
+        return self._classify(downscale(frame.rgb, self.max_edge))
+
+    def _classify(self, rgb):
+        rgb = np.ascontiguousarray(rgb)
+        with self._detector() as detector:
+            results = detector.process(rgb)
+        if not results.multi_face_landmarks:
+            return DEFAULT_TONE
+        pixels = np.concatenate([skin_pixels(rgb, face.landmark) for face in results.multi_face_landmarks])
+        if len(pixels) == 0:
+            return DEFAULT_TONE
+        # Simple classification based on the brightness of the average skin color
+        return classify_brightness(float(np.mean(np.mean(pixels, axis=0))))
@@ -0,0 +1,86 @@
+import os
+import time
+import logging
+import threading
+
+# ------------------- Startup and readiness -------------------
+# Heavy models are not built at import time. Each one is a named warm-up step
+# that runs on a background thread once the worker is serving (liveness comes
+# first), or synchronously in a preforking master for steps whose result is
+# shared with the workers. /readyz reports ready once every step has finished;
+# a step that failed leaves the service degraded, and its model still loads
+# lazily on first use.
+
+
+class Startup:
+    def __init__(self, started_at=None):
+        self.started_at = started_at if started_at is not None else time.time()
+        self.ready_at = None
+        self._lock = threading.Lock()
+        self._steps = {}  # name -> {"status", "seconds", "error", "shared"}
+        self._fns = {}
+        self._pid = None
+
+    def record(self, name, seconds):
+        """Records a phase that already happened (e.g. module imports)."""
+        with self._lock:
+            self._steps[name] = {"status": "done", "seconds": round(seconds, 3), "error": None, "shared": True}
+
+    def add(self, name, fn, shared=False):
+        """Registers a warm-up step; shared steps may run before fork."""
+        with self._lock:
+            self._steps[name] = {"status": "pending", "seconds": None, "error": None, "shared": shared}
+            self._fns[name] = fn
+
+    def run_shared(self):
+        """Runs the shared steps in this process now (a preforking master)."""
+        self._run([name for name, s in self._steps.items() if s["shared"] and s["status"] == "pending"])
+
+    def start(self):
+        """Runs the remaining steps of this process on a background thread."""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self.ready_at = None
+        with self._lock:
+            names = [name for name, s in self._steps.items() if s["status"] == "pending"]
+        threading.Thread(target=self._run, args=(names, True), name="warm-up", daemon=True).start()
+
+    def _run(self, names, report=False):
+        for name in names:
+            with self._lock:
+                self._steps[name]["status"] = "running"
+            start = time.time()
+            try:
+                self._fns[name]()
+                status, error = "ready", None
+            except Exception as e:
+                logging.error(f"Warm-up step {name} failed, it will load on first use: {e}")
+                status, error = "failed", str(e)
+            with self._lock:
+                self._steps[name].update(status=status, seconds=round(time.time() - start, 3), error=error)
+        if report:
+            self.ready_at = time.time()
+            logging.info(f"Startup report (pid {os.getpid()}): {self.summary()}")
+
+    @property
+    def ready(self):
+        return self.ready_at is not None
+
+    def summary(self):
+        with self._lock:
+            steps = [f"{name} {s['seconds']}s ({s['status']})" for name, s in self._steps.items()]
+        total = f"ready {self.ready_at - self.started_at:.2f}s after start" if self.ready else "warming up"
+        return ", ".join(steps + [total])
+
+    def report(self):
+        with self._lock:
+            steps = {name: dict(s) for name, s in self._steps.items()}
+        return {
+            "ready": self.ready,
+            "degraded": any(s["status"] == "failed" for s in steps.values()),
+            "pid": os.getpid(),
+            "uptime_sec": round(time.time() - self.started_at, 3),
+            "ready_after_sec": round(self.ready_at - self.started_at, 3) if self.ready else None,
+            "steps": steps,
+        }
@@ -0,0 +1,233 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # no flock (Windows): every process reaps on its own
+    fcntl = None
+
+import metrics
+
+# ------------------- Upload storage lifecycle -------------------
+# Artifacts served via /uploads/<filename> (the no-background item images) are
+# written to sharded subdirectories, uploads/<2 hex chars of the name's hash>/,
+# so no single directory grows past a few thousand entries. Files in the root
+# folder (written before sharding, or checked into the repo) are still served but
+# never reaped: the reaper only manages the shard directories.
+#
+# A background reaper deletes sharded files nobody has used for ttl_sec and,
+# while they are over max_bytes, the least recently used ones first. Files still
+# referenced (by closet items or live preview manifests) are never deleted.
+# "Used" is the access time, bumped when a file is served or reused from the
+# feature cache; mtime is left alone because preview and thumbnail cache keys
+# depend on it. With several worker processes, a lock file lets one of them reap
+# at a time. References come from small files (closet meta.json, preview
+# manifests); each pass only stats them and re-parses the ones that changed.
+
+SHARD_CHARS = 2  # 256 subdirectories
+LOCK_NAME = ".reaper.lock"
+# Access times are bumped at most this often per file, so serving stays read-only
+TOUCH_INTERVAL_SEC = 3600
+# Files younger than this are never evicted for quota (they may still be in flight)
+MIN_AGE_SEC = 300
+
+
+class UploadStore:
+    def __init__(self, root, ttl_sec=7 * 86400, max_bytes=2 * 1024 ** 3, interval_sec=600):
+        self.root = root
+        self.ttl_sec = ttl_sec
+        self.max_bytes = max_bytes
+        self.interval_sec = interval_sec
+        self._reference_sources = []
+        self._lock = threading.Lock()
+        self._pid = None
+        self._last_reap = None
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def shard(filename):
+        return hashlib.sha1(filename.encode("utf-8")).hexdigest()[:SHARD_CHARS]
+
+    def path_for(self, filename):
+        """Where a new artifact called filename is written (its shard directory is created)."""
+        folder = os.path.join(self.root, self.shard(filename))
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, filename)
+
+    def resolve(self, filename):
+        """Path of a stored artifact, from its shard or else the root folder; None if missing."""
+        for path in (os.path.join(self.root, self.shard(filename), filename), os.path.join(self.root, filename)):
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def touch(self, path):
+        """Marks an artifact as recently used (access time only)."""
+        try:
+            st = os.stat(path)
+            now = time.time()
+            if now - st.st_atime > TOUCH_INTERVAL_SEC:
+                os.utime(path, (now, st.st_mtime))
+        except OSError:
+            pass
+
+    def add_reference_source(self, fn):
+        """fn() returns filenames still referenced elsewhere; the reaper never deletes those."""
+        self._reference_sources.append(fn)
+
+    def add_reference_files(self, list_paths, parse):
+        """
+        A reference source backed by files: list_paths() returns the files, parse(path)
+        the filenames one of them references. Results are cached per file and only
+        re-parsed when its inode, mtime or size changes.
+        """
+        self._reference_sources.append(ReferenceFiles(list_paths, parse))
+
+    def start(self):
+        """Starts this process's reaper thread (threads do not survive fork)."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name="upload-reaper", daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                self.reap()
+            except Exception as e:
+                logging.error(f"Upload reaper pass failed: {e}")
+            time.sleep(self.interval_sec)
+
+    def reap(self, now=None):
+        """
+        One pass: deletes unreferenced files idle for longer than ttl_sec, then the
+        least recently used ones while the folder is over max_bytes. Returns a
+        summary, or None if another process is reaping.
+        """
+        with self._exclusive() as acquired:
+            if not acquired:
+                return None
+            start = time.time()
+            now = now if now is not None else start
+            pinned = self._referenced()
+            files = self._scan()
+            total = sum(size for _, size, _, _ in files)
+            reclaimed = {"ttl": [0, 0], "quota": [0, 0]}  # reason -> [files, bytes]
+
+            def delete(path, size, reason):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    return True  # already gone (e.g. reaped by an earlier pass)
+                except OSError as e:
+                    logging.warning(f"Could not reap upload {path}: {e}")
+                    return False
+                reclaimed[reason][0] += 1
+                reclaimed[reason][1] += size
+                metrics.count("uploads_reclaimed_files_total", reason=reason)
+                metrics.count("uploads_reclaimed_bytes_total", size, reason=reason)
+                return True
+
+            survivors = []
+            for used, size, path, name in sorted(files):
+                if name not in pinned and now - used > self.ttl_sec and delete(path, size, "ttl"):
+                    total -= size
+                else:
+                    survivors.append((used, size, path, name))
+            for used, size, path, name in survivors:
+                if total <= self.max_bytes:
+                    break
+                if name not in pinned and now - used > MIN_AGE_SEC and delete(path, size, "quota"):
+                    total -= size
+            if total > self.max_bytes:
+                logging.warning(f"Uploads hold {total} bytes after reaping, above the {self.max_bytes} byte quota "
+                                f"(referenced or recent files are kept)")
+
+            summary = {
+                "finished_at": time.time(),
+                "seconds": round(time.time() - start, 3),
+                "files": len(files) - sum(n for n, _ in reclaimed.values()),
+                "bytes": total,
+                "referenced": len(pinned),
+                "reclaimed_files": {reason: n for reason, (n, _) in reclaimed.items()},
+                "reclaimed_bytes": {reason: b for reason, (_, b) in reclaimed.items()},
+            }
+            self._last_reap = summary
+            if any(n for n, _ in reclaimed.values()):
+                logging.info(f"Upload reaper: {summary}")
+            return summary
+
+    def stats(self):
+        return {"root": self.root, "ttl_sec": self.ttl_sec, "max_bytes": self.max_bytes,
+                "interval_sec": self.interval_sec, "last_reap": self._last_reap}
+
+    def _referenced(self):
+        pinned = set()
+        for fn in self._reference_sources:
+            pinned.update(fn())
+        return pinned
+
+    def _scan(self):
+        """(last used, size, path, filename) of every file in a shard directory."""
+        files = []
+        for entry in os.scandir(self.root):
+            if len(entry.name) == SHARD_CHARS and not entry.name.startswith(".") and entry.is_dir(follow_symlinks=False):
+                files.extend(self._stat_files(entry.path))
+        return files
+
+    @staticmethod
+    def _stat_files(folder):
+        files = []
+        for entry in os.scandir(folder):
+            try:
+                if entry.name.startswith(".") or not entry.is_file(follow_symlinks=False):
+                    continue
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue  # removed while scanning
+            files.append((max(st.st_atime, st.st_mtime), st.st_size, entry.path, entry.name))
+        return files
+
+    @contextmanager
+    def _exclusive(self):
+        if fcntl is None:
+            yield True
+            return
+        with open(os.path.join(self.root, LOCK_NAME), "a") as fh:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+class ReferenceFiles:
+    def __init__(self, list_paths, parse):
+        self.list_paths = list_paths
+        self.parse = parse
+        self._parsed = {}  # path -> ((inode, mtime_ns, size), filenames)
+
+    def __call__(self):
+        parsed, names = {}, set()
+        for path in self.list_paths():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # missing (e.g. a deleted closet) or removed meanwhile
+            stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+            cached = self._parsed.get(path)
+            if cached is None or cached[0] != stamp:
+                cached = (stamp, set(self.parse(path)))
+            parsed[path] = cached
+            names.update(cached[1])
+        self._parsed = parsed  # forgets files that are gone
+        return names